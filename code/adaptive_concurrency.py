@@ -0,0 +1,207 @@
+import time
+import asyncio
+import threading
+import statistics
+from collections import deque
+
+
+class AimdController:
+    """Concurrency limit that adapts to the server, by additive increase and multiplicative decrease.
+
+    Workers take a slot before fetching a product and give it back when
+    done, so at most `limit` products are worked on at once. The outcome
+    and latency of every request are recorded. After every round of
+    `limit` requests (at least `min_round`) the limit grows by `increase`
+    while the server is healthy, and it is multiplied by `decrease` when
+    the round's rate of 403/429/5xx responses or transport errors exceeds
+    `error_threshold`, or when its median latency rises above
+    `latency_factor` times the long-term average of the round medians (the
+    server is queueing).
+
+    A 403 also cuts the limit right away and pauses all workers. The pause
+    starts at `min_backoff` and doubles with every further 403 up to
+    `max_backoff`; a healthy round halves it again. The limit therefore
+    settles just below the rate the server tolerates that day.
+
+    Args:
+        initial (int, optional): The starting limit. Defaults to 2.
+        minimum (int, optional): The lowest limit. Defaults to 1.
+        maximum (int, optional): The highest limit. Defaults to 64.
+        increase (int, optional): Slots added after a healthy round. Defaults to 1.
+        decrease (float, optional): Factor applied to the limit after an unhealthy round. Defaults to 0.5.
+        window (int, optional): Number of recent requests the reported error rate is computed over.
+            Defaults to 100.
+        min_round (int, optional): Minimum number of requests per round. Defaults to 10.
+        error_threshold (float, optional): Error rate above which the limit is cut. Defaults to 0.05.
+        latency_factor (float, optional): Round median latency, relative to the long-term average,
+            above which the limit is cut. Defaults to 2.0.
+        latency_smoothing (float, optional): Weight of a round in the long-term average latency.
+            Defaults to 0.05.
+        min_backoff (float, optional): Seconds all workers pause after a first 403. Defaults to 5.
+        max_backoff (float, optional): Longest pause in seconds. Defaults to 120.
+    """
+
+    ERROR_STATUSES = {403, 429, 500, 502, 503, 504}
+
+    def __init__(self, initial=2, minimum=1, maximum=64, increase=1, decrease=0.5, window=100, min_round=10,
+                 error_threshold=0.05, latency_factor=2.0, latency_smoothing=0.05, min_backoff=5.0,
+                 max_backoff=120.0):
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError("Expected 1 <= minimum <= initial <= maximum")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.min_round = min_round
+        self.error_threshold = error_threshold
+        self.latency_factor = latency_factor
+        self.latency_smoothing = latency_smoothing
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.backoff = min_backoff
+        self.outcomes = deque(maxlen=window)
+        self.round_latencies = []
+        self.round_errors = 0
+        self.baseline_latency = None
+        self.requests = 0
+        self.errors = 0
+        self.increases = 0
+        self.decreases = 0
+        # No cut yet, so the first error always cuts
+        self.last_decrease = float("-inf")
+        self.history = [(time.monotonic(), initial)]
+
+    def _free(self, now):
+        return self.in_flight < int(self.limit) and now >= self.paused_until
+
+    def try_acquire(self):
+        """Take a slot if one is free and workers are not paused.
+
+        Returns:
+            bool: True if a slot was taken.
+        """
+        with self.condition:
+            if self._free(time.monotonic()):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Block the calling thread until a slot is free and take it."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self._free(now):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=max(0.01, self.paused_until - now) if now < self.paused_until else None)
+
+    async def acquire_async(self, poll_interval=0.01):
+        """Wait in the event loop until a slot is free and take it."""
+        while not self.try_acquire():
+            await asyncio.sleep(max(poll_interval, self.paused_until - time.monotonic()))
+
+    def release(self):
+        """Give a slot back."""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def wait_if_paused(self):
+        """Block the calling thread while all workers are paused after a 403."""
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _set_limit(self, limit):
+        self.limit = min(self.maximum, max(self.minimum, limit))
+        self.history.append((time.monotonic(), int(self.limit)))
+        self.condition.notify_all()
+
+    def _cut(self):
+        # Errors of requests that were already in flight belong to the same overload, cut once per round
+        if self.requests - self.last_decrease >= int(self.limit):
+            self.decreases += 1
+            self.last_decrease = self.requests
+            self._set_limit(self.limit * self.decrease)
+            self.round_latencies, self.round_errors = [], 0
+
+    def record(self, status, latency):
+        """Record the outcome of one request and adapt the limit.
+
+        Args:
+            status (int): The HTTP status code, or None for a transport error.
+            latency (float): Seconds from sending the request to receiving the response.
+
+        Returns:
+            float: Seconds all workers pause because of this response, 0 if none.
+        """
+        is_error = status is None or status in self.ERROR_STATUSES
+        with self.condition:
+            self.requests += 1
+            self.errors += is_error
+            self.outcomes.append(is_error)
+            self.round_errors += is_error
+            if not is_error:
+                self.round_latencies.append(latency)
+
+            if status == 403:
+                pause = self.backoff
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                self.backoff = min(self.max_backoff, self.backoff * 2)
+                self._cut()
+                return pause
+
+            if len(self.round_latencies) + self.round_errors >= max(self.min_round, int(self.limit)):
+                self._adjust()
+            return 0.0
+
+    def _adjust(self):
+        error_rate = self.round_errors / (len(self.round_latencies) + self.round_errors)
+        median_latency = statistics.median(self.round_latencies) if self.round_latencies else None
+        self.round_latencies, self.round_errors = [], 0
+        slow = median_latency is not None and self.baseline_latency is not None and \
+            median_latency > self.latency_factor * self.baseline_latency
+        if median_latency is not None:
+            self.baseline_latency = median_latency if self.baseline_latency is None else \
+                self.baseline_latency + self.latency_smoothing * (median_latency - self.baseline_latency)
+
+        if error_rate > self.error_threshold or slow:
+            self._cut()
+        else:
+            self.backoff = max(self.min_backoff, self.backoff / 2)
+            if self.limit < self.maximum:
+                self.increases += 1
+                self._set_limit(self.limit + self.increase)
+
+    def state(self):
+        """Return the current state of the controller.
+
+        Returns:
+            dict: limit, in_flight, paused (seconds left), backoff, error_rate (rolling),
+                baseline_latency, requests, errors, increases and decreases.
+        """
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "paused": max(0.0, self.paused_until - time.monotonic()),
+                "backoff": self.backoff,
+                "error_rate": sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0,
+                "baseline_latency": self.baseline_latency,
+                "requests": self.requests,
+                "errors": self.errors,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,330 @@
+import asyncio
+import random
+import threading
+import time
+from tqdm import tqdm
+import scrape_data
+from scrape_data import BASE_URL, PRODUCT_API_PATH, iter_products_to_fetch
+from transport import ConnectionStats, negotiate_headers, print_connection_stats
+
+
+class TokenBucket:
+    """Request rate limiter shared by every asyncio worker.
+
+    Tokens are refilled at a fixed rate and every request has to take one
+    before it is sent, so the total request rate is bounded no matter how
+    many workers are running. A 403 pauses the bucket, which makes all
+    workers back off together instead of only the one that was blocked.
+
+    Args:
+        requests_per_second (float): The number of requests allowed per second.
+        burst (int, optional): Maximum number of tokens that can be saved up. Defaults to 1.
+        jitter (tuple, optional): Range in seconds of the random delay added after
+            taking a token. Defaults to (0.0, 0.25).
+    """
+
+    def __init__(self, requests_per_second, burst=1, jitter=(0.0, 0.25)):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be positive")
+        self.rate = requests_per_second
+        self.capacity = burst
+        self.jitter = jitter
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a request may be sent."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+        await asyncio.sleep(random.uniform(*self.jitter))
+
+    def pause(self, seconds):
+        """Stop handing out tokens to all workers for the given number of seconds.
+
+        Args:
+            seconds (float): The backoff duration.
+        """
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+
+async def initialize_async_session(api_headers, base_url=BASE_URL, pool_size=10, stats=None):
+    """Create an aiohttp session and establish cookies.
+
+    The connector keeps up to pool_size connections alive, one per
+    concurrent request, so connections are reused instead of reopened.
+
+    Args:
+        api_headers (dict): The headers to include in every request.
+        base_url (str, optional): The host to establish the session with. Defaults to BASE_URL.
+        pool_size (int, optional): Maximum number of connections. Defaults to 10.
+        stats (transport.ConnectionStats, optional): Counts the requests and new connections
+            of the session. Defaults to None.
+
+    Returns:
+        aiohttp.ClientSession: A session with established headers and cookies.
+
+    Raises:
+        Exception: If the initial request fails to establish the session.
+    """
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("The async fetch mode requires aiohttp (pip install aiohttp).") from e
+
+    trace_configs = []
+    if stats is not None:
+        # Every request gets its own trace context, which remembers the host for the connection event
+        async def on_request_start(session, context, params):
+            context.host = f"{params.url.scheme}://{params.url.host}:{params.url.port}"
+
+        async def on_connection_create_end(session, context, params):
+            stats.add(context.host, connections=1)
+
+        async def on_request_end(session, context, params):
+            stats.add(context.host, requests=1)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_end.append(on_request_end)
+        trace_configs.append(trace_config)
+
+    connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size, keepalive_timeout=60)
+    session = aiohttp.ClientSession(headers=negotiate_headers(api_headers, "aiohttp"), connector=connector,
+                                    trace_configs=trace_configs)
+    async with session.get(base_url) as initial_request:
+        if initial_request.status != 200:
+            await session.close()
+            raise Exception(f"Failed to establish session ({initial_request.status}).")
+    print("Session established and cookies set.")
+
+    return session
+
+
+async def fetch_product_data_async(session, limiter, product_id, product_store, max_retries=500, backoff=None,
+                                   journal=None, incremental=None, lastmod=None, base_url=BASE_URL,
+                                   controller=None, metrics=None):
+    """Fetch product data from the API and save it in the product store, with retry logic.
+
+    This is the asyncio counterpart of scrape_data.fetch_product_data. Every
+    attempt waits for a token from the shared limiter and a 403 pauses the
+    limiter for all workers.
+
+    Args:
+        session (aiohttp.ClientSession): The session object to manage requests.
+        limiter (TokenBucket): The rate limiter shared by all workers.
+        product_id (str): The unique identifier for the product.
+        product_store (JsonDirectoryStore or SnapshotDay): The store the product data is saved in.
+        max_retries (int, optional): Maximum number of retry attempts. Defaults to 500.
+        backoff (float, optional): Seconds all workers pause after a 403. Defaults to
+            scrape_data.FORBIDDEN_BACKOFF.
+        journal (CrawlJournal, optional): Journal in which the outcome is recorded. Defaults to None.
+        incremental (IncrementalCrawl, optional): Previous run to send conditional requests
+            against. A 304 response carries the previous JSON forward. Defaults to None.
+        lastmod (str, optional): The <lastmod> of the product in the sitemap, recorded in
+            the journal. Defaults to None.
+        base_url (str, optional): The host to request the product from. Defaults to BASE_URL.
+        controller (AimdController, optional): Adaptive concurrency controller every response is
+            reported to. A 403 then pauses the limiter for the controller's backoff instead of
+            backoff. Defaults to None.
+        metrics (RunMetrics, optional): Receives every response, retry and the final failure. The
+            downloaded bytes are taken from Content-Length. Defaults to None.
+
+    Returns:
+        str: The product ID if the fetch is successful, None otherwise.
+    """
+    import aiohttp
+
+    backoff = scrape_data.FORBIDDEN_BACKOFF if backoff is None else backoff
+    api_search_url = base_url + PRODUCT_API_PATH + product_id
+    conditional_headers = incremental.conditional_headers(product_id) if incremental is not None else {}
+
+    last_error = last_reason = None
+    for attempt in range(max_retries):
+        await limiter.acquire()
+        started, status = time.monotonic(), None
+        try:
+            async with session.get(api_search_url, headers=conditional_headers) as request:
+                status, latency = request.status, time.monotonic() - started
+                if controller is not None:
+                    pause = controller.record(request.status, latency)
+                if metrics is not None:
+                    metrics.observe_request(request.status, latency, request.content_length or 0)
+                if request.status == 304 and incremental is not None:
+                    incremental.carry_forward(product_id, product_store, journal, lastmod)
+                    return product_id
+
+                elif request.status == 500:
+                    last_error = last_reason = "HTTP 500"
+                    break
+
+                elif request.status == 403:
+                    pause = pause if controller is not None else backoff
+                    print(f"Access denied for product {product_id}. Pausing all workers for {pause} seconds.")
+                    if metrics is not None:
+                        metrics.observe_retry("HTTP 403", pause)
+                    limiter.pause(pause)
+                    continue
+
+                elif request.status == 404:
+                    print(f"Error 404 for product {product_id}.")
+                    last_error = last_reason = "HTTP 404"
+                    break
+
+                request.raise_for_status()
+                data = await request.json(content_type=None)
+                etag, last_modified = request.headers.get("ETag"), request.headers.get("Last-Modified")
+
+            product_store.put(product_id, data)
+            if journal is not None:
+                journal.record(product_id, journal.DONE, lastmod=lastmod, etag=etag, last_modified=last_modified)
+            return product_id
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if controller is not None and status is None:
+                controller.record(None, time.monotonic() - started)  # No response at all
+            if metrics is not None:
+                if status is None:
+                    metrics.observe_request(None, time.monotonic() - started)
+                metrics.observe_retry(type(e).__name__, scrape_data.RETRY_DELAY)
+            print(f"Error fetching product {product_id} on attempt {attempt + 1}: {e}")
+            last_error, last_reason = str(e) or type(e).__name__, type(e).__name__
+            await asyncio.sleep(scrape_data.RETRY_DELAY)
+
+    print(f"Failed to fetch product {product_id}: {last_error or 'HTTP 403'}.")
+    if metrics is not None:
+        metrics.observe_failure(product_id, last_reason or "HTTP 403", last_error or "HTTP 403")
+    if journal is not None:
+        journal.record(product_id, journal.FAILED, last_error or "HTTP 403")
+    return None
+
+
+async def _scrape_products_async(api_headers, product_store, products, requests_per_second, max_concurrency,
+                                 journal, incremental, base_url, controller, metrics):
+    if controller is not None:
+        max_concurrency = controller.maximum
+    limiter = TokenBucket(requests_per_second)
+    queue = asyncio.Queue(maxsize=4 * max_concurrency)
+    loop = asyncio.get_running_loop()
+
+    stop = threading.Event()
+
+    def put(item):
+        # Give up on a full queue once the workers are stopped, instead of blocking forever
+        while not stop.is_set():
+            try:
+                return asyncio.run_coroutine_threadsafe(asyncio.wait_for(queue.put(item), 1.0), loop).result()
+            except asyncio.TimeoutError:
+                continue
+
+    def produce():
+        # Reading the sitemap blocks, so it runs in a thread and feeds the bounded queue
+        try:
+            for product in products:
+                if stop.is_set():
+                    return
+                put(product)
+        finally:
+            for _ in range(max_concurrency):
+                put(None)
+
+    connection_stats = ConnectionStats()
+    session = await initialize_async_session(api_headers, base_url, max_concurrency, connection_stats)
+    progress = tqdm()
+
+    async def worker():
+        while True:
+            product = await queue.get()
+            if product is None:
+                return
+            product_id, lastmod = product
+            if controller is not None:
+                await controller.acquire_async()
+            try:
+                await fetch_product_data_async(session, limiter, product_id, product_store, journal=journal,
+                                               incremental=incremental, lastmod=lastmod, base_url=base_url,
+                                               controller=controller, metrics=metrics)
+            finally:
+                if controller is not None:
+                    controller.release()
+            progress.update(1)
+            if controller is not None:
+                progress.set_postfix(limit=controller.state()["limit"])
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_concurrency)]
+    producer = loop.run_in_executor(None, produce)
+    try:
+        await asyncio.gather(producer, *workers)
+    except BaseException:
+        # A failing worker (e.g. an OSError from the store) stops the producer and the other workers
+        stop.set()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(producer, *workers, return_exceptions=True)
+        raise
+    finally:
+        progress.close()
+        await session.close()
+        print_connection_stats(connection_stats.report())
+
+
+def scrape_products_async(api_headers, product_store, products, checkpoint=0,
+                          requests_per_second=5.0, max_concurrency=10, journal=None, incremental=None,
+                          base_url=BASE_URL, controller=None, metrics=None, budget=None):
+    """Scrape product data with asyncio workers sharing a token-bucket rate limiter.
+
+    Instead of sleeping after every product, workers wait for tokens from a
+    single limiter, so a full run is bounded by the allowed request rate and
+    concurrency can be raised without increasing the load on the server.
+    Products are read lazily into a bounded queue, so fetching starts while
+    the sitemap is still being parsed.
+
+    Args:
+        api_headers (dict): The headers to include in the API requests.
+        product_store (JsonDirectoryStore or SnapshotDay): The store the product data is saved in.
+        products (iterable): (product_id, lastmod) tuples, e.g. from scrape_data.iter_sitemap_products.
+        checkpoint (int, optional): The product ID threshold for skipping products. Defaults to 0.
+        requests_per_second (float, optional): Request rate shared by all workers. Defaults to 5.0.
+        max_concurrency (int, optional): Maximum number of in-flight requests. Defaults to 10.
+        journal (CrawlJournal, optional): Journal of the crawl. Products it records as
+            done are skipped and every outcome is written to it. Defaults to None.
+        incremental (IncrementalCrawl, optional): Previous run to compare against. Products
+            whose sitemap <lastmod> did not change are carried forward without a request.
+            Defaults to None.
+        base_url (str, optional): The host to request the products from. Defaults to BASE_URL.
+        controller (AimdController, optional): Adaptive concurrency controller. controller.maximum
+            workers are started, of which only controller.limit fetch at a time. Defaults to None.
+        metrics (RunMetrics, optional): Receives every response, retry and failure. Defaults to None.
+        budget (CrawlBudget, optional): Stop queueing products once its requests or time are
+            used up; the products left over are collected in budget.skipped. Defaults to None.
+    """
+    products = iter_products_to_fetch(products, product_store, checkpoint, journal, incremental)
+    if budget is not None:
+        products = budget.limit(products)
+    asyncio.run(_scrape_products_async(api_headers, product_store, products,
+                                       requests_per_second, max_concurrency, journal, incremental, base_url,
+                                       controller, metrics))
+
+
+if __name__ == "__main__":
+    pass
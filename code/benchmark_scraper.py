@@ -0,0 +1,171 @@
+import os
+import time
+import tempfile
+import statistics
+import scrape_data
+from header_objects import api_headers, xml_headers
+from mock_ah_server import MockAHServer
+from product_store import JsonDirectoryStore
+from adaptive_concurrency import AimdController
+from transport import get_connection_stats, print_connection_stats
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_fetch_mode(fetch_mode, mock_server, product_store, workers, requests_per_second, controller=None):
+    """Scrape the whole mock catalogue into product_store with one fetch mode.
+
+    Returns:
+        str: The HTTP versions the responses came in, e.g. "HTTP/1.1".
+    """
+    products = scrape_data.iter_sitemap_products(xml_headers, mock_server.base_url + scrape_data.SITEMAP_PATH)
+    if fetch_mode in ("threads", "http2"):
+        session = scrape_data.initialize_session(api_headers, mock_server.base_url, pool_size=workers,
+                                                 http2=fetch_mode == "http2")
+        scrape_data.scrape_products(session, product_store, products, 0, max_workers=workers,
+                                    base_url=mock_server.base_url, controller=controller)
+        print_connection_stats(get_connection_stats(session))
+        session.close()
+        if fetch_mode == "http2":
+            return ",".join(sorted(session.http_versions)) or "none"
+        return "HTTP/1.1"
+    elif fetch_mode == "async":
+        from async_scrape import scrape_products_async
+        scrape_products_async(api_headers, product_store, products, requests_per_second=requests_per_second,
+                              max_concurrency=workers, base_url=mock_server.base_url, controller=controller)
+        return "HTTP/1.1"
+    else:
+        raise ValueError(f"Unknown fetch mode: {fetch_mode}")
+
+
+def benchmark(fetch_modes, mock_server, workers=10, requests_per_second=50.0, adaptive=False):
+    """Run every fetch mode against the mock server and collect its statistics.
+
+    Latencies are measured by the mock server from the arrival of a product
+    request to its response, which on localhost is the latency the scraper sees.
+
+    Args:
+        fetch_modes (list): Fetch modes to run, e.g. ["threads", "async", "http2"]. The mock server
+            only speaks HTTP/1.1, so "http2" measures the httpx client over HTTP/1.1; the protocol
+            of every result is the one the responses actually came in.
+        mock_server (MockAHServer): A started mock server.
+        workers (int, optional): Threads or concurrent requests per mode. Defaults to 10.
+        requests_per_second (float, optional): Rate limit of the async mode. Defaults to 50.
+        adaptive (bool, optional): Let an AimdController adapt the concurrency, with workers
+            as its ceiling. Defaults to False.
+
+    Returns:
+        list: One dict of results per fetch mode.
+    """
+    results = []
+    for fetch_mode in fetch_modes:
+        mock_server.reset_stats()
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            product_store = JsonDirectoryStore(os.path.join(temporary_dir, "product_jsons_bench"))
+            os.makedirs(product_store.json_dir)
+
+            controller = None
+            if adaptive:
+                controller = AimdController(maximum=workers, min_backoff=min(5.0, scrape_data.FORBIDDEN_BACKOFF),
+                                            max_backoff=scrape_data.FORBIDDEN_BACKOFF)
+
+            started = time.monotonic()
+            protocol = run_fetch_mode(fetch_mode, mock_server, product_store, workers, requests_per_second,
+                                      controller)
+            elapsed = time.monotonic() - started
+            saved = len(product_store.product_ids())
+
+        if fetch_mode == "http2" and protocol != "HTTP/2":
+            # The mock server is plain http:// HTTP/1.1, which httpx falls back to without an error
+            print(f"The http2 mode was served over {protocol}, its numbers are not HTTP/2 numbers.")
+        requests_made = sum(mock_server.product_requests.values())
+        results.append({
+            "mode": fetch_mode,
+            "protocol": protocol,
+            "products": saved,
+            "seconds": elapsed,
+            "products_per_second": saved / elapsed if elapsed else float("nan"),
+            "p50_latency": percentile(mock_server.latencies, 0.50),
+            "p99_latency": percentile(mock_server.latencies, 0.99),
+            "mean_latency": statistics.fmean(mock_server.latencies) if mock_server.latencies else float("nan"),
+            "requests": requests_made,
+            "retries": requests_made - len(mock_server.product_requests),
+            "status_counts": dict(mock_server.status_counts),
+            "limit": controller.state()["limit"] if controller is not None else workers,
+        })
+    return results
+
+
+def print_results(results):
+    print(f"{'mode':<8} {'protocol':<9} {'products':>8} {'seconds':>8} {'prod/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'requests':>8} {'retries':>8} {'limit':>6}  status counts")
+    for result in results:
+        print(f"{result['mode']:<8} {result['protocol']:<9} {result['products']:>8} {result['seconds']:>8.1f} "
+              f"{result['products_per_second']:>8.1f} {result['p50_latency'] * 1000:>8.1f} "
+              f"{result['p99_latency'] * 1000:>8.1f} {result['requests']:>8} {result['retries']:>8} {result['limit']:>6}  "
+              f"{result['status_counts']}")
+
+
+def run_benchmark(fetch_modes, products=500, workers=10, requests_per_second=50.0, latency=0.05, jitter=0.02,
+                  rate_403=0.0, rate_404=0.0, rate_500=0.0, rate_limit=None, adaptive=False, delay_scale=0.01):
+    """Start a mock server, benchmark the fetch modes against it and print the results.
+
+    Args:
+        fetch_modes (list): Fetch modes to run, e.g. ["threads", "async", "http2"].
+        products (int, optional): Size of the mock catalogue. Defaults to 500.
+        workers (int, optional): Threads or concurrent requests per mode. Defaults to 10.
+        requests_per_second (float, optional): Rate limit of the async mode. Defaults to 50.
+        latency, jitter, rate_403, rate_404, rate_500, rate_limit: The mock server's behaviour,
+            see MockAHServer.
+        adaptive (bool, optional): Adapt the concurrency, with workers as the ceiling. Defaults to False.
+        delay_scale (float, optional): Factor applied to the scraper's sleeps and 403 backoff.
+            Defaults to 0.01.
+
+    Returns:
+        list: One dict of results per fetch mode, see benchmark.
+    """
+    # Shrink the production politeness delays so a benchmark takes seconds, not hours, and restore
+    # them afterwards so a later scrape in the same process is polite again
+    delays = scrape_data.REQUEST_DELAY, scrape_data.FORBIDDEN_BACKOFF, scrape_data.RETRY_DELAY
+    scrape_data.REQUEST_DELAY = tuple(delay * delay_scale for delay in scrape_data.REQUEST_DELAY)
+    scrape_data.FORBIDDEN_BACKOFF *= delay_scale
+    scrape_data.RETRY_DELAY *= delay_scale
+
+    try:
+        mock_server = MockAHServer(products, latency, jitter, rate_403, rate_404, rate_500, rate_limit).start()
+        try:
+            results = benchmark(fetch_modes, mock_server, workers, requests_per_second, adaptive)
+        finally:
+            mock_server.stop()
+    finally:
+        scrape_data.REQUEST_DELAY, scrape_data.FORBIDDEN_BACKOFF, scrape_data.RETRY_DELAY = delays
+    print_results(results)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the scraper fetch modes against a local mock AH server.")
+    parser.add_argument("--modes", default="threads,async", help="comma separated fetch modes: threads, async, http2 (default: threads,async)")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--rps", type=float, default=50.0, help="request rate of the async mode")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-403", type=float, default=0.0)
+    parser.add_argument("--rate-404", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None, help="server requests per second before 403s")
+    parser.add_argument("--adaptive", action="store_true", help="adapt the concurrency, --workers is the ceiling")
+    parser.add_argument("--delay-scale", type=float, default=0.01,
+                        help="factor applied to the scraper's sleeps and 403 backoff (default: 0.01)")
+    args = parser.parse_args()
+
+    run_benchmark(args.modes.split(","), args.products, args.workers, args.rps, args.latency, args.jitter,
+                  args.rate_403, args.rate_404, args.rate_500, args.rate_limit, args.adaptive, args.delay_scale)
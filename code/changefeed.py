@@ -0,0 +1,204 @@
+import os
+import gzip
+import json
+from tqdm import tqdm
+from crawl_journal import get_failed_ids
+from nutrient_list import nutrition_labels
+from product_store import JsonDirectoryStore, SnapshotDay, open_product_store, get_dataset_dir
+from write_csv_from_jsons import build_product_row, get_csv_header
+
+
+INGREDIENT_COLUMNS = {"Ingredients", "ContainedAllergens", "MayContainAllergens", "NonFoodIngredients"}
+NUTRIENT_COLUMNS = set(nutrition_labels)
+
+
+def get_changefeed_path(date):
+    """Return the path of the changefeed of a date, complete_datasets/<date>_changes.jsonl.gz."""
+    return os.path.join(get_dataset_dir(), f"{date}_changes.jsonl.gz")
+
+
+def same_payload(previous_store, current_store, product_id):
+    """Return True if a product's stored payload is the same on both days, without parsing it.
+
+    Snapshots compare the content hashes in their manifests. JSON directories
+    compare file identity first, as carried-forward products are hardlinks of
+    the previous day's file, and the raw bytes otherwise.
+    """
+    if isinstance(previous_store, SnapshotDay) and isinstance(current_store, SnapshotDay):
+        return previous_store.manifest[product_id] == current_store.manifest[product_id]
+    if isinstance(previous_store, JsonDirectoryStore) and isinstance(current_store, JsonDirectoryStore):
+        if os.path.samefile(previous_store._path(product_id), current_store._path(product_id)):
+            return True
+    return previous_store.load_raw(product_id) == current_store.load_raw(product_id)
+
+
+def classify_change(changed_fields):
+    """Return the change events of a product from its {column: [old, new]} field changes.
+
+    Args:
+        changed_fields (dict): The changed columns with their previous and current value.
+
+    Returns:
+        list: Sorted event names: "price", "sale_start", "sale_end", "sale_price",
+            "nutrients", "ingredients" and "details" for any other column.
+    """
+    events = set()
+    for column, (old, new) in changed_fields.items():
+        if column == "PriceRegular":
+            events.add("price")
+        elif column == "PriceSale":
+            events.add("sale_start" if old == "NA" else "sale_end" if new == "NA" else "sale_price")
+        elif column in NUTRIENT_COLUMNS:
+            events.add("nutrients")
+        elif column in INGREDIENT_COLUMNS:
+            events.add("ingredients")
+        else:
+            events.add("details")
+    return sorted(events)
+
+
+def diff_product(previous_store, current_store, product_id, header):
+    """Return the "changed" record of a product in both stores, None if its output row is unchanged."""
+    if same_payload(previous_store, current_store, product_id):
+        return None
+    old_row = build_product_row(previous_store.load(product_id))
+    new_row = build_product_row(current_store.load(product_id))
+    if old_row == new_row:
+        return None
+    changed_fields = {column: [old, new] for column, old, new in zip(header, old_row, new_row) if old != new}
+    return {"id": int(product_id), "change": "changed", "events": classify_change(changed_fields),
+            "fields": changed_fields}
+
+
+def diff_stores(previous_store, current_store, failed_ids=(), previous_failed_ids=(), earlier_store=None):
+    """Yield the changes between two days of products, one dict per new, delisted or changed product.
+
+    Both stores list their product IDs sorted numerically, so the days are
+    walked in a single sorted merge and only one product of each day is held
+    in memory at a time. Products whose payload is unchanged are skipped
+    without being parsed (see same_payload); for the others the output rows
+    of build_product_row are compared column by column.
+
+    A product missing from a day because its fetch failed is not delisted.
+    It is reported as "unknown" on the day of the failure, and the day after
+    it is compared with earlier_store instead of being reported as new.
+
+    Args:
+        previous_store (JsonDirectoryStore or SnapshotDay): The earlier day.
+        current_store (JsonDirectoryStore or SnapshotDay): The later day.
+        failed_ids (set, optional): IDs (as strings) of the products whose fetch failed on the
+            later day, see crawl_journal.get_failed_ids. Defaults to ().
+        previous_failed_ids (set, optional): IDs of the products whose fetch failed on the
+            earlier day. Defaults to ().
+        earlier_store (JsonDirectoryStore or SnapshotDay, optional): The day before previous_store,
+            to compare the products in previous_failed_ids with. Defaults to None.
+
+    Yields:
+        dict: {"id", "change": "new", "fields": {column: value}} with the non-NA columns of a
+            new product, {"id", "change": "delisted"}, {"id", "change": "unknown"} for a product
+            that could not be fetched, or {"id", "change": "changed", "events",
+            "fields": {column: [old, new]}} with only the changed columns.
+    """
+    header = get_csv_header()
+    previous_ids = iter(previous_store.product_ids())
+    current_ids = iter(current_store.product_ids())
+    previous_id = next(previous_ids, None)
+    current_id = next(current_ids, None)
+
+    while previous_id is not None or current_id is not None:
+        if current_id is None or (previous_id is not None and int(previous_id) < int(current_id)):
+            yield {"id": int(previous_id), "change": "unknown" if previous_id in failed_ids else "delisted"}
+            previous_id = next(previous_ids, None)
+            continue
+
+        if previous_id is None or int(current_id) < int(previous_id):
+            if current_id in previous_failed_ids and earlier_store is not None and earlier_store.has(current_id):
+                change = diff_product(earlier_store, current_store, current_id, header)
+                if change is not None:
+                    yield change
+            else:
+                row = build_product_row(current_store.load(current_id))
+                yield {"id": int(current_id), "change": "new",
+                       "fields": {column: value for column, value in zip(header[1:], row[1:]) if value != "NA"}}
+            current_id = next(current_ids, None)
+            continue
+
+        change = diff_product(previous_store, current_store, current_id, header)
+        if change is not None:
+            yield change
+        previous_id = next(previous_ids, None)
+        current_id = next(current_ids, None)
+
+
+def write_changefeed(current_store=None, previous_store=None, changefeed_path=None):
+    """Write what changed since the previous day to a gzipped JSON-lines changefeed.
+
+    The first line names both dates, every further line is one product
+    from diff_stores. Products whose fetch failed are read from the crawl
+    journals of both days. Consumers only have to ingest the changed products
+    instead of the full catalogue.
+
+    Args:
+        current_store (JsonDirectoryStore or SnapshotDay, optional): The day to describe.
+            Defaults to today's JSON directory.
+        previous_store (JsonDirectoryStore or SnapshotDay, optional): The day to compare with.
+            Defaults to current_store.previous().
+        changefeed_path (str, optional): The output file. Defaults to get_changefeed_path.
+
+    Returns:
+        dict: The number of products per change and per event, or None if there is no
+            previous day.
+    """
+    if current_store is None:
+        current_store = open_product_store("json")
+    if previous_store is None:
+        previous_store = current_store.previous()
+    if previous_store is None:
+        print(f"No earlier snapshot to compare {current_store.date} with, no changefeed written.")
+        return None
+
+    changefeed_path = changefeed_path or get_changefeed_path(current_store.date)
+    previous_failed_ids = get_failed_ids(previous_store)
+    earlier_store = previous_store.previous() if previous_failed_ids else None
+    changes = diff_stores(previous_store, current_store, get_failed_ids(current_store), previous_failed_ids,
+                          earlier_store)
+    counts = {"new": 0, "delisted": 0, "changed": 0, "unknown": 0}
+    temporary_path = changefeed_path + ".tmp"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as changefeed_file:
+        changefeed_file.write(json.dumps({"date": current_store.date, "previous": previous_store.date}) + "\n")
+        for change in tqdm(changes, desc="Changes", unit=" products"):
+            changefeed_file.write(json.dumps(change, ensure_ascii=False, separators=(",", ":")) + "\n")
+            counts[change["change"]] += 1
+            for event in change.get("events", ()):
+                counts[event] = counts.get(event, 0) + 1
+    os.replace(temporary_path, changefeed_path)
+
+    print(f"{counts['new']} new, {counts['delisted']} delisted, {counts['changed']} changed and "
+          f"{counts['unknown']} unfetched products since {previous_store.date}, written to {changefeed_path}.")
+    return counts
+
+
+def read_changefeed(changefeed_path):
+    """Return the header and an iterator over the changes of a changefeed file."""
+    changefeed_file = gzip.open(changefeed_path, "rt", encoding="utf-8")
+    header = json.loads(changefeed_file.readline())
+
+    def changes():
+        with changefeed_file:
+            for line in changefeed_file:
+                yield json.loads(line)
+
+    return header, changes()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write the changes between two daily snapshots.")
+    parser.add_argument("--date", help="the day to describe as yyyy-mm-dd (default: today)")
+    parser.add_argument("--previous", help="the day to compare with (default: the latest earlier crawl)")
+    parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+    args = parser.parse_args()
+
+    current = open_product_store(args.storage, args.date)
+    write_changefeed(current, open_product_store(args.storage, args.previous) if args.previous else None)
@@ -0,0 +1,179 @@
+import os
+from datetime import datetime
+from tqdm import tqdm
+from nutrient_list import nutrition_labels
+from nutrient_parser import parse_nutrient_value, to_grams
+from product_store import open_product_store, get_dataset_dir
+from write_csv_from_jsons import build_product_row, get_csv_header
+
+
+CATEGORY_COLUMNS = ["Category1", "Category2", "Category3", "Category4", "Category5", "Category6"]
+PRICE_COLUMNS = ["PriceRegular", "PriceSale"]
+ENERGY_COLUMNS = ["Energie (kcal)", "Energie (kJ)"]
+NUTRIENT_COLUMNS = set(nutrition_labels) - set(ENERGY_COLUMNS)
+COLUMNS = get_csv_header()
+# {nutrient: qualifier} of the nutrient values given as a bound, e.g. {"Suikers": "<"} for "<0.5 g"
+QUALIFIER_COLUMN = "NutrientQualifiers"
+
+
+def parse_amount_and_qualifier(value):
+    """Parse a nutrient value such as "12,5 g" or "<0.5 mg" into a number and its qualifier.
+
+    Mass units are converted to grams and values without a unit are returned
+    as written; values in any other unit (e.g. "IE") are not a mass and give
+    None.
+
+    Args:
+        value (str): The nutrient value as found in the product JSON.
+
+    Returns:
+        tuple: (amount, qualifier), amount None if the value holds no number or no mass and
+            qualifier "<", ">", "~", "<=", ">=" or None.
+    """
+    if value is None or value == "NA":
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), None
+
+    amount, unit, qualifier = parse_nutrient_value(value)
+    return to_grams(amount, unit), qualifier
+
+
+def parse_amount(value):
+    """Parse a nutrient value into grams like parse_amount_and_qualifier, dropping the qualifier."""
+    return parse_amount_and_qualifier(value)[0]
+
+
+def get_columnar_schema():
+    """Build the typed Arrow schema of the columnar export.
+
+    Prices and nutrients are float64 (nutrient masses in grams), energy is
+    int64, categories are dictionary encoded and all other columns are
+    strings. Missing values are nulls instead of "NA". The last column,
+    NutrientQualifiers, maps the nutrients given as a bound (e.g. "<0.5 g")
+    to their qualifier, null if there are none.
+
+    Returns:
+        pyarrow.Schema: The schema, with columns in the order of get_csv_header and
+            NutrientQualifiers.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for column in COLUMNS:
+        if column == "ProductId" or column in ENERGY_COLUMNS:
+            column_type = pa.int64()
+        elif column in PRICE_COLUMNS or column in NUTRIENT_COLUMNS:
+            column_type = pa.float64()
+        elif column in CATEGORY_COLUMNS:
+            column_type = pa.dictionary(pa.int32(), pa.string())
+        else:
+            column_type = pa.string()
+        fields.append(pa.field(column, column_type))
+    fields.append(pa.field(QUALIFIER_COLUMN, pa.map_(pa.string(), pa.string())))
+    return pa.schema(fields)
+
+
+def convert_row(row):
+    """Convert a row of build_product_row to typed Python values.
+
+    Args:
+        row (list): The row as returned by build_product_row.
+
+    Returns:
+        list: The row with None for "NA", numbers for prices and nutrients, and the
+            [(nutrient, qualifier)] pairs of NutrientQualifiers (None if there are none) appended.
+    """
+    converted = []
+    qualifiers = []
+    for column, value in zip(COLUMNS, row):
+        if value == "NA" or value is None:
+            converted.append(None)
+        elif column == "ProductId" or column in ENERGY_COLUMNS:
+            converted.append(int(value))
+        elif column in PRICE_COLUMNS:
+            converted.append(float(value))
+        elif column in NUTRIENT_COLUMNS:
+            amount, qualifier = parse_amount_and_qualifier(value)
+            converted.append(amount)
+            if qualifier is not None:
+                qualifiers.append((column, qualifier))
+        else:
+            converted.append(str(value))
+    converted.append(qualifiers or None)
+    return converted
+
+
+def get_columnar_file_path(date=None, file_format="parquet"):
+    """
+    Construct the file path of the columnar output, next to the CSV output.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+        file_format (str, optional): "parquet" or "arrow". Defaults to "parquet".
+
+    Returns:
+        str: The full file path, complete_datasets/<date>.parquet or .arrow.
+    """
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    return os.path.join(get_dataset_dir(), f"{date}.{file_format}")
+
+
+def write_columnar_from_store(product_store=None, file_format="parquet", batch_size=10000):
+    """
+    Write product data from a product store into a typed Parquet or Arrow IPC file.
+
+    Rows are built by the same extractors as the CSV and converted in batches,
+    so memory use is bounded by batch_size rows. Requires pyarrow.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay, optional): The store to read the
+            products from. Defaults to today's JSON directory.
+        file_format (str, optional): "parquet" or "arrow" (Arrow IPC file). Defaults to "parquet".
+        batch_size (int, optional): Number of rows per row group / record batch. Defaults to 10000.
+
+    Returns:
+        str: The path of the written file.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("The columnar export requires pyarrow (pip install pyarrow).") from e
+
+    if product_store is None:
+        product_store = open_product_store("json")
+    schema = get_columnar_schema()
+    file_path = get_columnar_file_path(product_store.date, file_format)
+
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(file_path, schema, compression="zstd")
+        write_batch = writer.write_table
+    elif file_format == "arrow":
+        writer = pa.ipc.new_file(file_path, schema)
+        write_batch = writer.write_table
+    else:
+        raise ValueError(f"Unknown columnar format: {file_format}")
+
+    def flush(rows):
+        columns = list(zip(*rows))
+        arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema)]
+        write_batch(pa.Table.from_arrays(arrays, schema=schema))
+
+    try:
+        rows = []
+        for product_id in tqdm(product_store.product_ids()):
+            rows.append(convert_row(build_product_row(product_store.load(product_id))))
+            if len(rows) == batch_size:
+                flush(rows)
+                rows = []
+        if rows:
+            flush(rows)
+    finally:
+        writer.close()
+
+    return file_path
+
+
+if __name__ == "__main__":
+    write_columnar_from_store()
@@ -0,0 +1,210 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+
+ManifestEntry = namedtuple("ManifestEntry", ["lastmod", "etag", "last_modified"])
+
+
+class CrawlJournal:
+    """Persistent record of the fetch status of every product in a crawl.
+
+    The journal is a SQLite database stored next to the product store of the
+    day, e.g. json_collections/product_jsons_yyyy-mm-dd.journal.sqlite. Every fetch
+    attempt updates the row of its product, so a restarted run can look up
+    which products are already done instead of fetching everything again.
+    Alongside the status it keeps the sitemap <lastmod> and the HTTP
+    validators of each product, which makes the journal of a finished run
+    the manifest that the next incremental run compares against.
+
+    Args:
+        journal_path (str): The path of the SQLite journal file.
+    """
+
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(journal_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS products (
+                product_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at TEXT NOT NULL,
+                lastmod TEXT,
+                etag TEXT,
+                last_modified TEXT
+            )"""
+        )
+        # Journals written before incremental crawling lack the validator columns
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(products)")}
+        for column in ManifestEntry._fields:
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE products ADD COLUMN {column} TEXT")
+        self.connection.commit()
+
+    @classmethod
+    def for_store(cls, product_store):
+        """Open the journal belonging to the product store of a day.
+
+        If the journal is new and the store already holds products (for
+        example from a run made before journaling existed), those products
+        are recorded as done.
+
+        Args:
+            product_store (JsonDirectoryStore or SnapshotDay): The product store of the crawl.
+
+        Returns:
+            CrawlJournal: The journal of product_store.
+        """
+        journal = cls(product_store.journal_path)
+        if journal.is_empty():
+            journal.record_many(product_store.product_ids(), cls.DONE)
+        return journal
+
+    def is_empty(self):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM products LIMIT 1").fetchone() is None
+
+    def record(self, product_id, status, error=None, lastmod=None, etag=None, last_modified=None):
+        """Record the outcome of one fetch of a product.
+
+        Args:
+            product_id (str): The unique identifier for the product.
+            status (str): CrawlJournal.DONE or CrawlJournal.FAILED.
+            error (str, optional): The reason of a failure. Defaults to None.
+            lastmod (str, optional): The <lastmod> of the product in the sitemap. Defaults to None.
+            etag (str, optional): The ETag header of the response. Defaults to None.
+            last_modified (str, optional): The Last-Modified header of the response. Defaults to None.
+        """
+        updated_at = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            self.connection.execute(
+                """INSERT INTO products (product_id, status, attempts, last_error, updated_at,
+                                         lastmod, etag, last_modified)
+                   VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+                   ON CONFLICT(product_id) DO UPDATE SET
+                       status = excluded.status,
+                       attempts = products.attempts + 1,
+                       last_error = excluded.last_error,
+                       updated_at = excluded.updated_at,
+                       lastmod = excluded.lastmod,
+                       etag = excluded.etag,
+                       last_modified = excluded.last_modified""",
+                (int(product_id), status, error, updated_at, lastmod, etag, last_modified),
+            )
+            self.connection.commit()
+
+    def record_many(self, product_ids, status, error=None):
+        """Record the same outcome for several products in one transaction."""
+        updated_at = datetime.now().isoformat(timespec="seconds")
+        rows = [(int(product_id), status, error, updated_at) for product_id in product_ids]
+        with self.lock:
+            self.connection.executemany(
+                """INSERT INTO products (product_id, status, attempts, last_error, updated_at)
+                   VALUES (?, ?, 1, ?, ?)
+                   ON CONFLICT(product_id) DO UPDATE SET
+                       status = excluded.status,
+                       attempts = products.attempts + 1,
+                       last_error = excluded.last_error,
+                       updated_at = excluded.updated_at""",
+                rows,
+            )
+            self.connection.commit()
+
+    def import_manifest(self, manifest):
+        """Record products fetched elsewhere, e.g. by a shard worker, as done with their validators.
+
+        Args:
+            manifest (dict): A mapping of product ID to ManifestEntry, as returned by manifest().
+        """
+        updated_at = datetime.now().isoformat(timespec="seconds")
+        rows = [(int(product_id), self.DONE, updated_at, *entry) for product_id, entry in manifest.items()]
+        with self.lock:
+            self.connection.executemany(
+                """INSERT INTO products (product_id, status, attempts, updated_at, lastmod, etag, last_modified)
+                   VALUES (?, ?, 1, ?, ?, ?, ?)
+                   ON CONFLICT(product_id) DO UPDATE SET
+                       status = excluded.status,
+                       last_error = NULL,
+                       updated_at = excluded.updated_at,
+                       lastmod = excluded.lastmod,
+                       etag = excluded.etag,
+                       last_modified = excluded.last_modified""",
+                rows,
+            )
+            self.connection.commit()
+
+    def completed_ids(self):
+        """Return the set of product IDs (as strings) that were fetched successfully."""
+        with self.lock:
+            rows = self.connection.execute("SELECT product_id FROM products WHERE status = ?", (self.DONE,))
+            return {str(product_id) for (product_id,) in rows}
+
+    def pending(self, product_ids):
+        """Filter product IDs down to those that are missing from the journal or failed.
+
+        Args:
+            product_ids (iterable): The product IDs of the crawl.
+
+        Returns:
+            list: The product IDs that still have to be fetched, in their original order.
+        """
+        completed = self.completed_ids()
+        return [product_id for product_id in product_ids if product_id not in completed]
+
+    def manifest(self):
+        """Return the sitemap and HTTP validators of every product that was fetched successfully.
+
+        Returns:
+            dict: A mapping of product ID (as string) to ManifestEntry.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT product_id, lastmod, etag, last_modified FROM products WHERE status = ?", (self.DONE,)
+            )
+            return {str(product_id): ManifestEntry(*validators) for product_id, *validators in rows}
+
+    def failures(self):
+        """Return a list of (product_id, attempts, last_error) tuples of failed products."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT product_id, attempts, last_error FROM products WHERE status = ? ORDER BY product_id",
+                (self.FAILED,),
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_failed_ids(product_store):
+    """Return the IDs (as strings) of the products whose fetch failed in the crawl of a product store.
+
+    Such products are missing from the store although they may still be
+    listed, so they must not be mistaken for delisted products. Returns an
+    empty set if the store has no journal.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay): The product store of the crawl.
+    """
+    journal_path = getattr(product_store, "journal_path", None)
+    if not journal_path or not os.path.isfile(journal_path):
+        return set()
+    journal = CrawlJournal(journal_path)
+    try:
+        return {str(product_id) for product_id, _, _ in journal.failures()}
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,143 @@
+import os
+import time
+from datetime import date as Date
+from price_history import PriceHistory, get_price_history_path
+
+
+class CrawlBudget:
+    """Stop submitting products once a number of requests or a number of seconds is used up.
+
+    The budget wraps the stream of products to fetch (see
+    scrape_data.iter_products_to_fetch). Products that no longer fit are
+    not requested and are collected in skipped, so they can be carried
+    forward from the previous run instead. Products already submitted when
+    the time runs out are still finished.
+
+    Args:
+        max_requests (int, optional): Maximum number of products to request. Defaults to None (no limit).
+        max_seconds (float, optional): Seconds after the first product within which products are
+            submitted. Defaults to None (no limit).
+    """
+
+    def __init__(self, max_requests=None, max_seconds=None):
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self.requests = 0
+        self.deadline = None
+        self.skipped = []
+
+    @property
+    def exhausted(self):
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def limit(self, products):
+        """Yield products while the budget lasts, then collect the rest in skipped.
+
+        Args:
+            products (iterable): (product_id, lastmod) tuples.
+
+        Yields:
+            tuple: (product_id, lastmod) of every product within the budget.
+        """
+        if self.max_seconds is not None:
+            self.deadline = time.monotonic() + self.max_seconds
+        for product_id, lastmod in products:
+            if self.exhausted:
+                self.skipped.append(product_id)
+                continue
+            self.requests += 1
+            yield product_id, lastmod
+
+
+def score_products(price_history, as_of=None, half_life_days=30.0, sale_weight=2.0, on_sale_bonus=1.0):
+    """Score every product in the price history by how volatile its prices are.
+
+    Every price change counts, weighted by its age so that a product that
+    changed last week scores higher than one that changed last year (a
+    change half_life_days old counts half). A change that starts or ends a
+    sale counts sale_weight times. Products that are on sale now get
+    on_sale_bonus on top, as their price changes when the sale ends.
+
+    Args:
+        price_history (PriceHistory): The consolidated price history.
+        as_of (str, optional): The date to weigh the ages against as yyyy-mm-dd. Defaults to the
+            latest snapshot in the price history.
+        half_life_days (float, optional): Age in days at which a change counts half. Defaults to 30.
+        sale_weight (float, optional): Weight of a change of the sale status. Defaults to 2.
+        on_sale_bonus (float, optional): Score added for a product currently on sale. Defaults to 1.
+
+    Returns:
+        dict: {product_id (str): score}, 0 for products whose prices never changed.
+    """
+    dates = price_history.dates()
+    if not dates:
+        return {}
+    as_of = Date.fromisoformat(as_of or dates[-1])
+
+    scores = {}
+    previous_id = previous_on_sale = None
+    for product_id, valid_from, valid_to, price_regular, price_sale in price_history.intervals():
+        on_sale = price_sale is not None
+        if product_id != previous_id:
+            # The first interval is the product's appearance, not a change
+            scores[str(product_id)] = 0.0
+        else:
+            age = (as_of - Date.fromisoformat(valid_from)).days
+            weight = sale_weight if on_sale != previous_on_sale else 1.0
+            scores[str(product_id)] += weight * 0.5 ** (max(0, age) / half_life_days)
+        if valid_to is None and on_sale:
+            scores[str(product_id)] += on_sale_bonus
+        previous_id, previous_on_sale = product_id, on_sale
+    return scores
+
+
+def prioritize_products(products, scores, new_score=float("inf")):
+    """Order the products of a sitemap by descending score.
+
+    Products with equal scores keep their sitemap order. The whole sitemap
+    is read before the first product is returned.
+
+    Args:
+        products (iterable): (product_id, lastmod) tuples, e.g. from scrape_data.iter_sitemap_products.
+        scores (dict): {product_id: score} from score_products.
+        new_score (float, optional): Score of products that are not in the price history yet.
+            Defaults to infinity: products without any data are fetched first.
+
+    Returns:
+        list: The (product_id, lastmod) tuples in crawl order.
+    """
+    return sorted(products, key=lambda product: -scores.get(product[0], new_score))
+
+
+def load_priority_scores(db_path=None, **score_options):
+    """Return score_products of the price history database, {} if there is none yet.
+
+    Args:
+        db_path (str, optional): The SQLite database path. Defaults to get_price_history_path().
+        **score_options: Passed to score_products.
+    """
+    db_path = db_path or get_price_history_path()
+    if not os.path.isfile(db_path):
+        print("No price history yet, crawling in sitemap order.")
+        return {}
+    price_history = PriceHistory(db_path)
+    try:
+        return score_products(price_history, **score_options)
+    finally:
+        price_history.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the products the priority crawl fetches first.")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--half-life", type=float, default=30.0, help="age in days at which a change counts half")
+    args = parser.parse_args()
+
+    scores = load_priority_scores(half_life_days=args.half_life)
+    for product_id, score in sorted(scores.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{product_id}\t{score:.3f}")
+    print(f"{sum(score > 0 for score in scores.values())} of {len(scores)} products changed price.")
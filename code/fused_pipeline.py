@@ -0,0 +1,158 @@
+import os
+import csv
+import queue
+import threading
+from datetime import datetime
+from write_csv_from_jsons import build_product_row, write_csv_header, get_csv_file_path
+
+
+class StreamingCsvWriter:
+    """Product store front-end that turns every fetched product into a CSV row right away.
+
+    The scrapers hand each response to put(), which queues it on a bounded
+    queue. A writer thread runs the write_product_data extractors on it and
+    appends the row to the CSV file, so the CSV is complete when fetching
+    ends and no payload has to be written and read back. Rows are in fetch
+    order, not sorted by product ID.
+
+    Writing the raw JSON archive is optional: with an archive_store every
+    product is also saved there, which keeps the crawl journal, restarts
+    and incremental carry-forward working. Without one, a run always
+    fetches the whole catalogue.
+
+    Args:
+        csv_file_path (str): The CSV file to write.
+        archive_store (JsonDirectoryStore or SnapshotDay, optional): Store to also save the raw
+            product JSON in. Defaults to None.
+        max_queue (int, optional): Maximum number of products waiting to be written. Defaults to 1000.
+        metrics (RunMetrics, optional): Receives the time spent in each extractor when the
+            writer is closed. Defaults to None.
+    """
+
+    def __init__(self, csv_file_path, archive_store=None, max_queue=1000, metrics=None):
+        self.csv_file_path = csv_file_path
+        self.metrics = metrics
+        self.extractor_times = {} if metrics is not None else None
+        self.archive_store = archive_store
+        self.date = archive_store.date if archive_store is not None else datetime.now().strftime("%Y-%m-%d")
+        self.journal_path = archive_store.journal_path if archive_store is not None else None
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.rows_written = 0
+        self.failed_ids = []
+
+        self.error = None
+
+        # Resuming from the journal only fetches the missing products. The archive can be ahead
+        # of the CSV (a product is archived before its row is written), so every archived
+        # product whose row is not in the CSV yet is written first
+        archived_ids = archive_store.product_ids() if archive_store is not None else []
+        appending = bool(archived_ids) and os.path.isfile(csv_file_path)
+        written_ids = read_written_ids(csv_file_path) if appending else set()
+        self.csvfile = open(csv_file_path, 'a' if appending else 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.csvfile)
+        if not appending:
+            write_csv_header(self.writer)
+
+        self.thread = threading.Thread(target=self._write_rows, daemon=True)
+        self.thread.start()
+        for product_id in archived_ids:
+            if product_id not in written_ids:
+                self._enqueue((product_id, archive_store.load(product_id)))
+
+    def _write_rows(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                product_id, json_data = item
+                try:
+                    row = build_product_row(json_data, self.extractor_times)
+                except Exception as e:
+                    print(f"Could not extract product {product_id}: {e!r}")
+                    self.failed_ids.append(product_id)
+                    if self.metrics is not None:
+                        self.metrics.observe_malformed(product_id, repr(e))
+                    continue
+                self.writer.writerow(row)
+                # A killed run then loses at most the row being written, see read_written_ids
+                self.csvfile.flush()
+                self.rows_written += 1
+        except BaseException as e:
+            # Raised again from put() and close(), instead of leaving them waiting on a dead thread
+            self.error = e
+
+    def _enqueue(self, item):
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"Writing {self.csv_file_path} failed") from self.error
+            try:
+                self.queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, product_id, data):
+        if self.archive_store is not None:
+            self.archive_store.put(product_id, data)
+        self._enqueue((product_id, data))
+
+    def carry_forward(self, previous_store, product_id):
+        self.archive_store.carry_forward(previous_store, product_id)
+        self._enqueue((product_id, previous_store.load(product_id)))
+
+    def has(self, product_id):
+        return self.archive_store is not None and self.archive_store.has(product_id)
+
+    def product_ids(self):
+        return self.archive_store.product_ids() if self.archive_store is not None else []
+
+    def previous(self):
+        return self.archive_store.previous() if self.archive_store is not None else None
+
+    def close(self):
+        """Write the remaining queued rows and close the CSV file (and the archive)."""
+        try:
+            self._enqueue(None)
+            self.thread.join()
+        finally:
+            self.csvfile.close()
+        if self.error is not None:
+            raise RuntimeError(f"Writing {self.csv_file_path} failed") from self.error
+        if self.metrics is not None:
+            self.metrics.merge_extractor_times(self.extractor_times)
+        if self.archive_store is not None:
+            self.archive_store.close()
+        print(f"Wrote {self.rows_written} rows to {self.csv_file_path}.")
+
+
+def read_written_ids(csv_file_path):
+    """Return the product IDs of the rows in a CSV file, dropping a last row cut off by a killed run."""
+    with open(csv_file_path, 'rb+') as csvfile:
+        content = csvfile.read()
+        if content and not content.endswith(b"\n"):
+            csvfile.truncate(content.rfind(b"\n") + 1)
+    with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)
+        return {row[0] for row in reader if row}
+
+
+def open_streaming_writer(archive_store=None, date=None, metrics=None):
+    """Open a StreamingCsvWriter for complete_datasets/<date>.csv.
+
+    Args:
+        archive_store (JsonDirectoryStore or SnapshotDay, optional): Store to also save the raw
+            product JSON in. Defaults to None.
+        date (str, optional): The date as yyyy-mm-dd. Defaults to the archive's date or today.
+        metrics (RunMetrics, optional): Receives the extractor run times. Defaults to None.
+
+    Returns:
+        StreamingCsvWriter: The writer, to be passed as product_store to collect_product_jsons.
+    """
+    date = date or (archive_store.date if archive_store is not None else None)
+    return StreamingCsvWriter(get_csv_file_path(date), archive_store, metrics=metrics)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,84 @@
+from crawl_journal import CrawlJournal
+
+
+class IncrementalCrawl:
+    """Decide which products of today's sitemap have to be requested again.
+
+    A product is carried forward from the previous run's product store
+    without a request when its sitemap <lastmod> is unchanged since the
+    previous run. All other products are requested with If-None-Match/
+    If-Modified-Since built from the previous run's ETag/Last-Modified,
+    and a 304 response carries the previous product forward as well.
+
+    Args:
+        previous_store (JsonDirectoryStore or SnapshotDay): The product store of the previous
+            run, or None if there is no previous run.
+        previous_manifest (dict): Product ID to ManifestEntry of the previous run.
+    """
+
+    def __init__(self, previous_store, previous_manifest):
+        self.previous_store = previous_store
+        self.previous_manifest = previous_manifest
+
+    @classmethod
+    def from_previous_run(cls, product_store):
+        """Build an incremental plan against the most recent earlier run.
+
+        Args:
+            product_store (JsonDirectoryStore or SnapshotDay): Today's product store.
+
+        Returns:
+            IncrementalCrawl: The plan. Without a previous run every product is fetched.
+        """
+        previous_store = product_store.previous()
+        if previous_store is None:
+            print("No previous run found, fetching all products.")
+            return cls(None, {})
+
+        previous_journal = CrawlJournal.for_store(previous_store)
+        previous_manifest = previous_journal.manifest()
+        previous_journal.close()
+        print(f"Incremental crawl against {previous_store.date} ({len(previous_manifest)} products).")
+
+        return cls(previous_store, previous_manifest)
+
+    def _has_previous(self, product_id):
+        return product_id in self.previous_manifest and self.previous_store.has(product_id)
+
+    def is_unchanged(self, product_id, lastmod):
+        """Return True if the sitemap <lastmod> says the product did not change since the previous run."""
+        return (lastmod is not None and self._has_previous(product_id)
+                and self.previous_manifest[product_id].lastmod == lastmod)
+
+    def conditional_headers(self, product_id):
+        """Return the If-None-Match/If-Modified-Since headers for a product, if any are known."""
+        if not self._has_previous(product_id):
+            return {}
+
+        previous = self.previous_manifest[product_id]
+        headers = {}
+        if previous.etag:
+            headers["If-None-Match"] = previous.etag
+        if previous.last_modified:
+            headers["If-Modified-Since"] = previous.last_modified
+        return headers
+
+    def carry_forward(self, product_id, product_store, journal=None, lastmod=None):
+        """Reuse the previous run's data of a product for today's run.
+
+        Args:
+            product_id (str): The unique identifier for the product.
+            product_store (JsonDirectoryStore or SnapshotDay): Today's product store.
+            journal (CrawlJournal, optional): Today's journal, in which the product is
+                recorded as done with its previous validators. Defaults to None.
+            lastmod (str, optional): The product's <lastmod> in today's sitemap. Defaults to None.
+        """
+        product_store.carry_forward(self.previous_store, product_id)
+        if journal is not None:
+            previous = self.previous_manifest[product_id]
+            journal.record(product_id, journal.DONE, lastmod=lastmod,
+                           etag=previous.etag, last_modified=previous.last_modified)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,18 +1,229 @@
+import os
+from datetime import datetime
 from header_objects import xml_headers, api_headers
-from scrape_data import collect_product_jsons
-from write_csv_from_jsons import write_csv_from_json_dir
+from product_store import JsonDirectoryStore, SnapshotStore, open_product_store
+from run_metrics import RunMetrics, get_run_report_path
 
-def main():
+# The stages import their modules (requests, tqdm, pandas, ...) when they run, so a
+# subcommand only pays for what it uses
+
+def main(storage="json", workers=1, columnar_format=None, streaming=False, archive=True, report=True,
+         profiler=None, metrics_port=None, decoder="json", normalize=False, priority=False, max_requests=None,
+         max_seconds=None):
     """collect all Albert Heijn product jsons and write a csv
 
     This function retrieves all product jsons from their sitemap xml
     and stores it into json_collections/product_jsons_yyyy-mm-dd/ as
-    today's date. After data scraping, the data is written into a .csv
-    file stored in complete_datasets/yyyy-mm-dd.csv as today's date
+    today's date (or into the compressed snapshot_store/ when storage
+    is "snapshot"). After data scraping, the data is written into a .csv
+    file stored in complete_datasets/yyyy-mm-dd.csv as today's date,
+    using `workers` processes for the conversion and the "json" or the
+    faster msgspec-based "typed" decoder. If columnar_format is
+    "parquet" or "arrow", a typed columnar file is written next to it.
+    With normalize=True the nutrients, unit sizes and prices of the CSV
+    are parsed into numbers in complete_datasets/yyyy-mm-dd_normalized.csv.
+    Finally the day's prices are consolidated into the price history and
+    the changes since the previous crawl are written to
+    complete_datasets/yyyy-mm-dd_changes.jsonl.gz. The ingredient and
+    allergen search index is built in complete_datasets/yyyy-mm-dd_search.sqlite.
+
+    With streaming=True every fetched product is written to the CSV while
+    scraping instead of in a second pass. The raw product JSONs are then
+    only kept when archive is True, and the stages that read them back
+    (columnar export, price history, changefeed, search index) are skipped without an
+    archive. The normalization only needs the CSV and always runs.
+
+    With priority=True the products whose prices change most often are
+    fetched first. max_requests and max_seconds cap the crawl; products
+    left over are carried forward from the previous run.
+
+    Request latencies, status codes, retries, failed products, extractor
+    and stage timings are appended to run_reports/yyyy-mm-dd.jsonl unless
+    report is False, and served for Prometheus on metrics_port if given.
+    profiler ("cprofile" or "pyinstrument") profiles every stage.
+    """
+    from scrape_data import collect_product_jsons
+    from write_csv_from_jsons import write_csv_from_json_dir
+    from price_history import update_price_history
+    from changefeed import write_changefeed
+    from product_search import build_search_index
+
+    metrics = RunMetrics(get_run_report_path() if report else None, profiler)
+    if metrics_port is not None:
+        metrics.serve_prometheus(metrics_port)
+
+    try:
+        if streaming:
+            from fused_pipeline import open_streaming_writer
+            archive_store = open_product_store(storage) if archive else None
+            if archive_store is not None and storage == "json":
+                os.makedirs(archive_store.json_dir, exist_ok=True)
+            streaming_writer = open_streaming_writer(archive_store, metrics=metrics)
+            with metrics.stage("scrape"):
+                collect_product_jsons(xml_headers, api_headers, checkpoint=0, metrics=metrics,
+                                      product_store=streaming_writer, priority=priority,
+                                      max_requests=max_requests, max_seconds=max_seconds)
+            date = streaming_writer.date
+            product_store = open_product_store(storage) if archive_store is not None else None
+        else:
+            with metrics.stage("scrape"):
+                collect_product_jsons(xml_headers, api_headers, checkpoint=0, storage=storage, metrics=metrics,
+                                      priority=priority, max_requests=max_requests, max_seconds=max_seconds)
+            product_store = open_product_store(storage)
+            with metrics.stage("convert"):
+                write_csv_from_json_dir(product_store, workers=workers, metrics=metrics, decoder=decoder)
+            date = product_store.date
+        if normalize:
+            from nutrient_normalization import write_normalized_products
+            with metrics.stage("normalize"):
+                write_normalized_products(date)
+        if product_store is None:
+            return  # The remaining stages read the archived product JSONs
+        if columnar_format is not None:
+            from columnar_export import write_columnar_from_store
+            with metrics.stage("columnar_export"):
+                write_columnar_from_store(product_store, file_format=columnar_format)
+        with metrics.stage("price_history"):
+            update_price_history(product_store)
+        with metrics.stage("changefeed"):
+            write_changefeed(product_store)
+        with metrics.stage("search_index"):
+            build_search_index(product_store)
+    finally:
+        metrics.close()
+
+
+def open_store(storage="json", date=None, path=None):
+    """Open the product store of a date, or the one at path.
+
+    Args:
+        storage (str, optional): "json" or "snapshot". Defaults to "json".
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today, or for a JSON directory
+            given by path, the date in its name.
+        path (str, optional): A product_jsons_yyyy-mm-dd directory, or a snapshot store directory.
+            Relative paths are taken from the working directory. Defaults to the project's store.
+
+    Returns:
+        JsonDirectoryStore or SnapshotDay: The store.
     """
-    collect_product_jsons(xml_headers, api_headers, checkpoint=0)
-    write_csv_from_json_dir()
+    if path is None:
+        return open_product_store(storage, date)
+    path = os.path.abspath(path)
+    if storage == "snapshot":
+        return SnapshotStore(path).day(date or datetime.now().strftime("%Y-%m-%d"))
+    store = JsonDirectoryStore(path)
+    if not os.path.isdir(store.json_dir):
+        raise Exception(f"{store.json_dir} is not a directory.")
+    store.date = date or store.date
+    return store
+
+
+def prepare_output(path):
+    """Return path as an absolute path, creating its directory."""
+    if path is None:
+        return None
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scrape the Albert Heijn catalogue and build the daily datasets. "
+                                                 "Without a command the full daily run is done.")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="scrape, convert and build every daily output (default)")
+    run_parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+    run_parser.add_argument("--workers", type=int, default=1, help="conversion processes")
+    run_parser.add_argument("--decoder", choices=["json", "typed"], default="json")
+    run_parser.add_argument("--columnar", choices=["parquet", "arrow"], help="also write a columnar file")
+    run_parser.add_argument("--streaming", action="store_true", help="write the CSV while scraping")
+    run_parser.add_argument("--no-archive", action="store_true",
+                            help="with --streaming, do not keep the product JSONs (skips the stages reading them)")
+    run_parser.add_argument("--normalize", action="store_true", help="also write the normalized numeric table")
+    run_parser.add_argument("--priority", action="store_true", help="fetch volatile products first")
+    run_parser.add_argument("--max-requests", type=int)
+    run_parser.add_argument("--max-seconds", type=float)
+    run_parser.add_argument("--no-report", action="store_true", help="do not write run_reports/<date>.jsonl")
+    run_parser.add_argument("--profile", choices=["cprofile", "pyinstrument"])
+    run_parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+
+    scrape_parser = commands.add_parser("scrape", help="fetch the product JSONs")
+    scrape_parser.add_argument("--date", help="the date the store is named after (default: today)")
+    scrape_parser.add_argument("--output", help="a product_jsons_yyyy-mm-dd directory to write to")
+    scrape_parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+    scrape_parser.add_argument("--fetch-mode", choices=["threads", "async"], default="threads")
+    scrape_parser.add_argument("--concurrency", type=int, default=10)
+    scrape_parser.add_argument("--rps", type=float, default=5.0, help="request rate of the async mode")
+    scrape_parser.add_argument("--incremental", action="store_true", help="only fetch products that changed")
+    scrape_parser.add_argument("--adaptive", action="store_true", help="adapt the concurrency to the server")
+    scrape_parser.add_argument("--http2", action="store_true")
+    scrape_parser.add_argument("--priority", action="store_true", help="fetch volatile products first")
+    scrape_parser.add_argument("--max-requests", type=int)
+    scrape_parser.add_argument("--max-seconds", type=float)
+    scrape_parser.add_argument("--base-url", help="the host to scrape (default: AH_BASE_URL or https://www.ah.nl)")
+
+    convert_parser = commands.add_parser("convert", help="write the CSV of a day's product JSONs")
+    convert_parser.add_argument("--date", help="the day to convert (default: today)")
+    convert_parser.add_argument("--input", help="a product_jsons_yyyy-mm-dd directory or snapshot store to read")
+    convert_parser.add_argument("--output", help="the CSV file (default: complete_datasets/<date>.csv)")
+    convert_parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+    convert_parser.add_argument("--workers", type=int, default=1)
+    convert_parser.add_argument("--decoder", choices=["json", "typed"], default="json")
+    convert_parser.add_argument("--columns", type=lambda text: text.split(","),
+                                help="comma-separated subset of the columns, e.g. ProductId,PriceRegular,PriceSale")
+
+    diff_parser = commands.add_parser("diff", help="write the changefeed between two days")
+    diff_parser.add_argument("--date", help="the day to describe (default: today)")
+    diff_parser.add_argument("--previous", help="the day to compare with (default: the latest earlier crawl)")
+    diff_parser.add_argument("--input", help="the product_jsons directory or snapshot store of --date")
+    diff_parser.add_argument("--previous-input", help="the product_jsons directory or snapshot store of --previous")
+    diff_parser.add_argument("--output", help="the changefeed file (default: complete_datasets/<date>_changes.jsonl.gz)")
+    diff_parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+
+    bench_parser = commands.add_parser("bench", help="benchmark the fetch modes against a local mock server")
+    bench_parser.add_argument("--modes", default="threads,async", help="comma separated: threads, async, http2")
+    bench_parser.add_argument("--products", type=int, default=500)
+    bench_parser.add_argument("--workers", type=int, default=10)
+    bench_parser.add_argument("--rps", type=float, default=50.0, help="request rate of the async mode")
+    bench_parser.add_argument("--latency", type=float, default=0.05, help="mean server latency in seconds")
+    bench_parser.add_argument("--rate-403", type=float, default=0.0)
+    bench_parser.add_argument("--rate-limit", type=float, help="server requests per second before 403s")
+    bench_parser.add_argument("--adaptive", action="store_true")
+    args = parser.parse_args()
+
+    if args.command in (None, "run"):
+        if args.command is None:
+            args = run_parser.parse_args([])
+        main(args.storage, args.workers, args.columnar, args.streaming, archive=not args.no_archive,
+             report=not args.no_report, profiler=args.profile, metrics_port=args.metrics_port,
+             decoder=args.decoder, normalize=args.normalize, priority=args.priority,
+             max_requests=args.max_requests, max_seconds=args.max_seconds)
+    elif args.command == "scrape":
+        from scrape_data import BASE_URL, collect_product_jsons
+        product_store = None
+        if args.output is not None:
+            product_store = JsonDirectoryStore(os.path.abspath(args.output))
+            os.makedirs(product_store.json_dir, exist_ok=True)
+        collect_product_jsons(xml_headers, api_headers, fetch_mode=args.fetch_mode, requests_per_second=args.rps,
+                              max_concurrency=args.concurrency, incremental=args.incremental, storage=args.storage,
+                              base_url=args.base_url or BASE_URL, product_store=product_store, http2=args.http2,
+                              adaptive=args.adaptive, priority=args.priority, max_requests=args.max_requests,
+                              max_seconds=args.max_seconds, date=args.date)
+    elif args.command == "convert":
+        from write_csv_from_jsons import write_csv_from_json_dir
+        write_csv_from_json_dir(open_store(args.storage, args.date, args.input), workers=args.workers,
+                                decoder=args.decoder, columns=args.columns, csv_file_path=prepare_output(args.output))
+    elif args.command == "diff":
+        from changefeed import write_changefeed
+        current = open_store(args.storage, args.date, args.input)
+        previous = None
+        if args.previous is not None or args.previous_input is not None:
+            previous = open_store(args.storage, args.previous, args.previous_input)
+        write_changefeed(current, previous, prepare_output(args.output))
+    elif args.command == "bench":
+        from benchmark_scraper import run_benchmark
+        run_benchmark(args.modes.split(","), args.products, args.workers, args.rps, args.latency,
+                      rate_403=args.rate_403, rate_limit=args.rate_limit, adaptive=args.adaptive)
@@ -0,0 +1,243 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import Counter
+from email.utils import formatdate
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+SITEMAP_NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing idle keep-alive connections are not errors
+        pass
+
+
+def make_product_json(product_id, seed=0):
+    """Build a synthetic product JSON shaped like the AH product API response.
+
+    The content is deterministic for a (product_id, seed) pair. Changing the
+    seed changes the price of some products, like a new day would.
+
+    Args:
+        product_id (int): The product ID.
+        seed (int, optional): The "day" of the catalogue. Defaults to 0.
+
+    Returns:
+        dict: The product JSON with the card.products[0] and card.meta fields
+            that write_product_data reads.
+    """
+    rnd = random.Random(product_id)
+    price = round(rnd.uniform(0.5, 15.0), 2)
+    on_sale = random.Random(product_id * 7919 + seed).random() < 0.15
+
+    product = {
+        "id": product_id,
+        "title": f"AH Testproduct {product_id}",
+        "price": {"now": round(price * 0.75, 2) if on_sale else price, "unitSize": f"{rnd.choice([100, 250, 500, 1000])} g"},
+        "taxonomies": [{"name": name} for name in rnd.sample(["Zuivel", "Kaas", "Brood", "Snoep", "Groente", "Fruit"], rnd.randint(1, 4))],
+        "images": [{"url": f"https://static.example/{product_id}/{size}.jpg"} for size in (200, 400, 800)],
+    }
+    if on_sale:
+        product["price"]["was"] = price
+
+    kcal = rnd.randint(10, 900)
+    meta = {
+        "nutritions": [{"nutrients": [
+            {"name": "Energie", "value": f"{round(kcal * 4.184)} kJ ({kcal} kcal)"},
+            {"name": "Vet", "value": f"{rnd.uniform(0, 40):.1f} g"},
+            {"name": "waarvan verzadigd", "value": f"{rnd.uniform(0, 15):.1f} g"},
+            {"name": "Koolhydraten", "value": f"{rnd.uniform(0, 80):.1f} g"},
+            {"name": "Eiwitten", "value": f"{rnd.uniform(0, 30):.1f} g"},
+            {"name": "Zout", "value": f"<{rnd.uniform(0, 2):.2f} g"},
+        ]}],
+        "ingredients": {
+            "statement": "Tarwebloem, water,\nhazelnoot, melk",
+            "allergens": {"contains": rnd.sample(["melk", "gluten", "hazelnoot", "soja"], rnd.randint(0, 2)),
+                          "mayContain": rnd.sample(["noten", "sesam"], rnd.randint(0, 1))},
+        },
+    }
+    if rnd.random() < 0.1:
+        meta = {}
+
+    return {"card": {"products": [product], "meta": meta}}
+
+
+class MockAHServer:
+    """Local stand-in for www.ah.nl to test and benchmark the scraper offline.
+
+    Serves the session page (/), a synthetic product sitemap and product JSON
+    from the product API path, with configurable latency, error rates and a
+    request-rate limit that answers with 403 like the real site. ETag and
+    Last-Modified validators are sent and honoured with 304 responses.
+
+    Args:
+        products (int, optional): Number of products in the catalogue. Defaults to 1000.
+        latency (float, optional): Mean response latency in seconds. Defaults to 0.05.
+        jitter (float, optional): Uniform latency jitter in seconds. Defaults to 0.02.
+        rate_403 (float, optional): Fraction of product requests answered with 403. Defaults to 0.
+        rate_404 (float, optional): Fraction answered with 404. Defaults to 0.
+        rate_500 (float, optional): Fraction answered with 500. Defaults to 0.
+        rate_limit (float, optional): Allowed product requests per second before every
+            request gets a 403; None for no limit. Defaults to None.
+        seed (int, optional): The "day" of the catalogue, see make_product_json. Defaults to 0.
+        host (str, optional): Interface to listen on. Defaults to "127.0.0.1".
+        port (int, optional): Port to listen on, 0 for any free port. Defaults to 0.
+    """
+
+    def __init__(self, products=1000, latency=0.05, jitter=0.02, rate_403=0.0, rate_404=0.0, rate_500=0.0,
+                 rate_limit=None, seed=0, host="127.0.0.1", port=0):
+        self.products = products
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_403 = rate_403
+        self.rate_404 = rate_404
+        self.rate_500 = rate_500
+        self.rate_limit = rate_limit
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.reset_stats()
+        self.httpd = QuietHTTPServer((host, port), self._make_handler())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_stats(self):
+        """Clear the request statistics."""
+        with self.lock:
+            self.status_counts = Counter()
+            self.latencies = []
+            self.product_requests = Counter()
+
+    def start(self):
+        """Serve in a background thread and return self."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def sitemap(self):
+        urls = "".join(
+            f"<url><loc>https://www.ah.nl/producten/product/wi{product_id}/ah-testproduct</loc>"
+            f"<lastmod>2024-01-{product_id % 28 + 1:02d}</lastmod></url>"
+            for product_id in range(1, self.products + 1)
+        )
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NAMESPACE}">{urls}</urlset>'.encode()
+
+    def _rate_limited(self):
+        if self.rate_limit is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            return self.window_count > self.rate_limit
+
+    def _draw_error(self):
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.rate_403:
+            return 403
+        if draw < self.rate_403 + self.rate_404:
+            return 404
+        if draw < self.rate_403 + self.rate_404 + self.rate_500:
+            return 500
+        return None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/":
+                    self._send(200, b"<html></html>", "text/html", {"Set-Cookie": "session=mock; Path=/"})
+                elif url.path == "/sitemaps/entities/products/detail.xml":
+                    self._send(200, server.sitemap(), "application/xml")
+                elif url.path == "/zoeken/api/products/product":
+                    self._product(parse_qs(url.query).get("webshopId", [""])[0])
+                else:
+                    self._send(404)
+
+            def _product(self, webshop_id):
+                started = time.monotonic()
+                time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+
+                status = 403 if server._rate_limited() else server._draw_error()
+                if status is None and not (webshop_id.isdigit() and 1 <= int(webshop_id) <= server.products):
+                    status = 404
+
+                if status is not None:
+                    self._send(status, b"{}")
+                else:
+                    body = json.dumps(make_product_json(int(webshop_id), server.seed)).encode()
+                    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                    validators = {"ETag": etag, "Last-Modified": formatdate(86400 * server.seed, usegmt=True)}
+                    if self.headers.get("If-None-Match") == etag:
+                        status = 304
+                        self._send(304, b"", headers=validators)
+                    else:
+                        status = 200
+                        self._send(200, body, headers=validators)
+
+                with server.lock:
+                    server.status_counts[status] += 1
+                    server.latencies.append(time.monotonic() - started)
+                    server.product_requests[webshop_id] += 1
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic AH sitemap and product API locally.")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="latency jitter in seconds")
+    parser.add_argument("--rate-403", type=float, default=0.0)
+    parser.add_argument("--rate-404", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before 403s")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock_server = MockAHServer(args.products, args.latency, args.jitter, args.rate_403, args.rate_404,
+                               args.rate_500, args.rate_limit, args.seed, port=args.port)
+    print(f"Serving on {mock_server.base_url}, scrape it with AH_BASE_URL={mock_server.base_url}")
+    try:
+        mock_server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        mock_server.httpd.server_close()
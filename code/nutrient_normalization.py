@@ -0,0 +1,201 @@
+import os
+from datetime import datetime
+from nutrient_list import nutrition_labels
+from nutrient_parser import GRAMS_PER_UNIT, MILLILITRES_PER_UNIT
+from product_store import get_dataset_dir
+from write_csv_from_jsons import get_csv_file_path
+
+
+ENERGY_COLUMNS = ["Energie (kcal)", "Energie (kJ)"]
+MASS_NUTRIENT_COLUMNS = [label for label in nutrition_labels if label not in ENERGY_COLUMNS]
+KJ_PER_KCAL = 4.184
+
+# "12,5 g", "<0.5 mg", "~3 µg": qualifier, number and unit
+AMOUNT_PATTERN = r"^\s*(?:<=|>=|[<>~])?\s*(\d+(?:[.,]\d+)?)\s*([^\d\s]\S*)?"
+# "500 g", "ca. 1,5 kg", "6 x 330 ml": optional count, number and unit
+UNIT_SIZE_PATTERN = r"(?:(\d+)\s*[xX×]\s*)?(\d+(?:[.,]\d+)?)\s*(kg|gram|gr|g|mg|liter|litre|l|dl|cl|ml)\b"
+
+
+def get_normalized_file_path(date=None, file_format="csv"):
+    """Return the path of the normalized output, complete_datasets/<date>_normalized.csv or .parquet.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+        file_format (str, optional): "csv" or "parquet". Defaults to "csv".
+    """
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    return os.path.join(get_dataset_dir(), f"{date}_normalized.{file_format}")
+
+
+def map_unique(values, parse):
+    """Apply a parser to the distinct values of a Series only and broadcast the result back.
+
+    Nutrient values and unit sizes repeat a lot ("0 g", "500 g"), and regex
+    extraction is the costly part, so every distinct string is parsed once.
+
+    Args:
+        values (pandas.Series): The strings, NaN for missing values.
+        parse (function): Takes a Series of distinct strings, returns a Series or DataFrame
+            with one row per string.
+
+    Returns:
+        pandas.Series or pandas.DataFrame: The parsed rows on the index of values, NaN where
+            values is missing.
+    """
+    import pandas as pd
+
+    codes, uniques = values.factorize()
+    return parse(pd.Series(uniques)).reindex(codes).set_axis(values.index)
+
+
+def to_number(strings):
+    """Convert a Series of decimal strings with "." or "," as separator to float64, NaN where missing."""
+    return strings.str.replace(",", ".", regex=False).astype("float64")
+
+
+def parse_amounts(values):
+    """Parse nutrient values such as "12,5 g" or "<0.5 mg" into grams, for a whole Series at once.
+
+    Mass units are converted to grams, values without a unit are kept as
+    written and values with any other unit (e.g. "IE") become NaN.
+    Qualifiers such as "<" are dropped, as in columnar_export.parse_amount.
+
+    Args:
+        values (pandas.Series): The nutrient values as strings, NaN for missing values.
+
+    Returns:
+        pandas.Series: The amounts in grams as float64.
+    """
+    def parse(strings):
+        parts = strings.str.extract(AMOUNT_PATTERN)
+        # The unit word, as nutrient_parser.to_grams reads it; "%" gives "" and so NaN
+        units = parts[1].str.extract(r"^([a-zA-Zµμ]*)")[0].str.lower()
+        return to_number(parts[0]) * units.map(GRAMS_PER_UNIT).where(units.notna(), 1.0)
+
+    return map_unique(values, parse)
+
+
+def parse_unit_sizes(unit_sizes):
+    """Parse free-text unit sizes into grams and millilitres, for a whole Series at once.
+
+    "500 g", "ca. 1,5 kg" and "6 x 330 ml" are understood; sizes such as
+    "per stuk" or "2 stuks" have no mass or volume and become NaN.
+
+    Args:
+        unit_sizes (pandas.Series): The ProductUnitSize values, NaN for missing values.
+
+    Returns:
+        tuple: (grams, millilitres) float64 Series, NaN where the size is not a mass resp. volume.
+    """
+    import pandas as pd
+
+    def parse(strings):
+        parts = strings.str.extract(UNIT_SIZE_PATTERN)
+        units = parts[2].str.lower()
+        amounts = to_number(parts[1]) * to_number(parts[0]).fillna(1.0)
+        return pd.DataFrame({"grams": amounts * units.map(GRAMS_PER_UNIT),
+                             "millilitres": amounts * units.map(MILLILITRES_PER_UNIT)})
+
+    sizes = map_unique(unit_sizes, parse)
+    return sizes["grams"], sizes["millilitres"]
+
+
+def normalize_products(frame):
+    """Turn the string columns of the product CSV into numbers, with derived price columns.
+
+    All work is done column-wise by pandas and NumPy; the present values
+    of all nutrient columns are parsed together in a single pass, and
+    each distinct string is parsed only once (see map_unique).
+
+    Nutrient masses become grams per 100 g (or 100 ml) and energy becomes
+    kcal and kJ, one filled in from the other where missing. The unit size
+    is parsed into UnitSizeGrams and UnitSizeMl. PriceCurrent is the sale
+    price when on sale and the regular price otherwise, and is used for
+    PricePerKg, PricePerLitre and ProteinPerEuro (grams of protein per euro,
+    taking liquids as 1 g/ml).
+
+    Args:
+        frame (pandas.DataFrame): The product CSV read with every column as a string and "NA"
+            as missing, see read_product_csv.
+
+    Returns:
+        pandas.DataFrame: ProductId, ProductName, Category1, the numeric price, unit size and
+            nutrient columns and the derived columns.
+    """
+    import numpy as np
+    import pandas as pd
+
+    normalized = pd.DataFrame({
+        "ProductId": frame["ProductId"].astype("int64"),
+        "ProductName": frame["ProductName"],
+        "Category1": frame["Category1"],
+        "PriceRegular": to_number(frame["PriceRegular"]),
+        "PriceSale": to_number(frame["PriceSale"]),
+    })
+    normalized["PriceCurrent"] = normalized["PriceSale"].fillna(normalized["PriceRegular"])
+    normalized["UnitSizeGrams"], normalized["UnitSizeMl"] = parse_unit_sizes(frame["ProductUnitSize"])
+
+    kcal = to_number(frame["Energie (kcal)"])
+    kj = to_number(frame["Energie (kJ)"])
+    normalized["Energie (kcal)"] = kcal.fillna(kj / KJ_PER_KCAL)
+    normalized["Energie (kJ)"] = kj.fillna(kcal * KJ_PER_KCAL)
+
+    # Most products fill only a few of the nutrient columns, parse just the present values
+    values = frame[MASS_NUTRIENT_COLUMNS].to_numpy(dtype=object)
+    present = pd.notna(values)
+    amounts = np.full(values.shape, np.nan)
+    amounts[present] = parse_amounts(pd.Series(values[present], dtype=object)).to_numpy()
+    normalized = pd.concat([normalized, pd.DataFrame(amounts, index=frame.index,
+                                                     columns=[f"{label} (g)" for label in MASS_NUTRIENT_COLUMNS])],
+                           axis=1)
+
+    price = normalized["PriceCurrent"].where(normalized["PriceCurrent"] > 0)
+    normalized["PricePerKg"] = price / normalized["UnitSizeGrams"].where(normalized["UnitSizeGrams"] > 0) * 1e3
+    normalized["PricePerLitre"] = price / normalized["UnitSizeMl"].where(normalized["UnitSizeMl"] > 0) * 1e3
+    quantity = normalized["UnitSizeGrams"].fillna(normalized["UnitSizeMl"])
+    normalized["ProteinPerEuro"] = normalized["Eiwitten (g)"] * quantity / 100 / price
+    return normalized.replace([np.inf, -np.inf], np.nan)
+
+
+def read_product_csv(csv_file_path):
+    """Read the product CSV with every column as a string and "NA" as missing."""
+    try:
+        import pandas as pd
+    except ImportError as e:
+        raise ImportError("The nutrient normalization requires pandas (pip install pandas).") from e
+
+    return pd.read_csv(csv_file_path, dtype=str, na_values=["NA"], keep_default_na=False)
+
+
+def write_normalized_products(date=None, file_format="csv"):
+    """Normalize the product CSV of a date and write the numeric table next to it.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+        file_format (str, optional): "csv" or "parquet" (requires pyarrow). Defaults to "csv".
+
+    Returns:
+        str: The path of the written file.
+    """
+    normalized = normalize_products(read_product_csv(get_csv_file_path(date)))
+    file_path = get_normalized_file_path(date, file_format)
+    if file_format == "csv":
+        normalized.to_csv(file_path, index=False, na_rep="NA")
+    elif file_format == "parquet":
+        normalized.to_parquet(file_path, index=False)
+    else:
+        raise ValueError(f"Unknown normalized format: {file_format}")
+
+    print(f"Normalized {len(normalized)} products into {file_path}.")
+    return file_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Normalize the nutrients, unit sizes and prices of a day's CSV.")
+    parser.add_argument("--date", help="the day as yyyy-mm-dd (default: today)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    args = parser.parse_args()
+
+    write_normalized_products(args.date, args.format)
@@ -0,0 +1,174 @@
+import re
+from nutrient_list import nutrition_labels
+
+
+ENERGY_KJ_FIRST = re.compile(r"([\d.]+)\s*kJ\s*\(([\d.]+)\s*kcal\)")
+ENERGY_KCAL_FIRST = re.compile(r"([\d.]+)\s*kcal\s*\(([\d.]+)\s*kJ\)")
+VALUE_PATTERN = re.compile(r"(<=|>=|[<>~])?\s*(\d+(?:[.,]\d+)?)\s*([^\d\s()][^()]*)?")
+
+# Built once: label -> position in the dense nutrition columns
+LABEL_INDEX = {label: index for index, label in enumerate(nutrition_labels)}
+KCAL_INDEX = LABEL_INDEX["Energie (kcal)"]
+KJ_INDEX = LABEL_INDEX["Energie (kJ)"]
+
+# The unit tables of the whole codebase, keyed by the lowercase unit. Both the micro sign
+# (U+00B5) and the Greek mu (U+03BC) are used for micrograms
+GRAMS_PER_UNIT = {"g": 1.0, "gr": 1.0, "gram": 1.0, "mg": 1e-3, "µg": 1e-6, "μg": 1e-6, "mcg": 1e-6, "kg": 1e3}
+MILLILITRES_PER_UNIT = {"ml": 1.0, "cl": 10.0, "dl": 100.0, "l": 1e3, "liter": 1e3, "litre": 1e3}
+UNIT_WORD = re.compile(r"[a-zA-Zµμ]+")
+
+
+def extract_energy_values(nutrient_value):
+    """Extract energy values (kcal and kJ) from the nutrient value string.
+
+    Args:
+        nutrient_value (str): The nutrient value string containing energy information,
+            e.g. "1046 kJ (250 kcal)".
+
+    Returns:
+        tuple: A tuple containing kcal and kJ as integers.
+
+    Raises:
+        ValueError: If the string does not hold both energy values as integers.
+    """
+    match = ENERGY_KJ_FIRST.search(nutrient_value)
+    if match:
+        kj, kcal = match.groups()
+    else:
+        match = ENERGY_KCAL_FIRST.search(nutrient_value)
+        if match is None:
+            raise ValueError(f"Unrecognised energy value: {nutrient_value!r}")
+        kcal, kj = match.groups()
+
+    return int(kcal), int(kj)
+
+
+def parse_nutrient_value(nutrient_value):
+    """Split a nutrient value string into its number, unit and qualifier.
+
+    Args:
+        nutrient_value (str): The nutrient value, e.g. "12,5 g" or "<0.5 mg".
+
+    Returns:
+        tuple: (value, unit, qualifier) where value is a float (None if the string holds
+            no number), unit is the unit text or None and qualifier is "<", ">", "~",
+            "<=", ">=" or None.
+    """
+    match = VALUE_PATTERN.search(nutrient_value)
+    if match is None:
+        return None, None, None
+    qualifier, number, unit = match.groups()
+    unit = unit.strip() if unit else None
+    return float(number.replace(",", ".")), unit or None, qualifier
+
+
+def to_grams(value, unit):
+    """Convert a mass to grams.
+
+    A value without a unit is returned as written. A value in any other
+    unit (e.g. "IE" or "%") is not a mass and gives None.
+
+    Args:
+        value (float): The number, None if there is none.
+        unit (str): The unit as written after the number, e.g. "mg" or "μg", or None.
+
+    Returns:
+        float: The mass in grams, or None.
+    """
+    if value is None:
+        return None
+    if not unit:
+        return value
+    match = UNIT_WORD.match(unit)
+    factor = GRAMS_PER_UNIT.get(match.group().lower()) if match else None
+    return None if factor is None else value * factor
+
+
+def get_nutrient_rows(json_data):
+    """Return the raw (name, value) pairs of the first nutrition table of a product.
+
+    Raises:
+        KeyError, IndexError: If the product has no nutrition table.
+    """
+    return [(nutrient["name"], nutrient["value"]) for nutrient in json_data["card"]["meta"]["nutritions"][0]["nutrients"]]
+
+
+def parse_dense_nutrients(json_data):
+    """Return the known nutrients of a product as (position, value) pairs.
+
+    The positions index into nutrient_list.nutrition_labels. Energy is split
+    into its kcal and kJ integers; all other values are kept as written.
+    The work depends only on the number of nutrients the product has.
+
+    Args:
+        json_data (dict): Parsed JSON data of the product.
+
+    Returns:
+        list: (position, value) pairs, in the order they appear in the product.
+
+    Raises:
+        KeyError, IndexError, TypeError, ValueError: If the nutrition table is missing or malformed.
+    """
+    return parse_dense_nutrient_rows(get_nutrient_rows(json_data))
+
+
+def parse_dense_nutrient_rows(nutrient_rows):
+    """Return (position, value) pairs for raw (name, value) nutrient rows, see parse_dense_nutrients.
+
+    Raises:
+        TypeError, ValueError: If a value is malformed.
+    """
+    positions = []
+    for name, value in nutrient_rows:
+        if name == "Energie":
+            kcal, kj = extract_energy_values(value)
+            positions.append((KCAL_INDEX, kcal))
+            positions.append((KJ_INDEX, kj))
+        else:
+            index = LABEL_INDEX.get(name)
+            if index is not None:
+                positions.append((index, value))
+    return positions
+
+
+def get_long_nutrients(json_data):
+    """Return every nutrient of a product in long format.
+
+    Unlike the dense columns, nutrients that are not in nutrition_labels are
+    kept, and values are parsed into a number, a unit and a qualifier, so
+    "<0.5 g" is recorded as 0.5, "g" and "<".
+
+    Args:
+        json_data (dict): Parsed JSON data of the product.
+
+    Returns:
+        list: (product_id, nutrient, value, unit, qualifier) tuples, "NA" for a missing unit or
+            qualifier; empty if the product has no nutrition table.
+    """
+    product_id = json_data["card"]["products"][0]["id"]
+    try:
+        nutrient_rows = get_nutrient_rows(json_data)
+    except (KeyError, IndexError, TypeError):
+        return []
+
+    long_rows = []
+    for name, value in nutrient_rows:
+        if name == "Energie":
+            try:
+                kcal, kj = extract_energy_values(value)
+            except (TypeError, ValueError):
+                continue
+            long_rows.append((product_id, "Energie (kcal)", kcal, "kcal", "NA"))
+            long_rows.append((product_id, "Energie (kJ)", kj, "kJ", "NA"))
+        else:
+            try:
+                number, unit, qualifier = parse_nutrient_value(value)
+            except TypeError:
+                continue
+            if number is not None:
+                long_rows.append((product_id, name, number, unit or "NA", qualifier or "NA"))
+    return long_rows
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,187 @@
+import os
+import sqlite3
+from tqdm import tqdm
+from crawl_journal import get_failed_ids
+from product_store import open_product_store, get_dataset_dir
+from write_csv_from_jsons import get_product_prices
+
+
+def get_price_history_path():
+    """Return the path of the price history database, complete_datasets/price_history.sqlite."""
+    return os.path.join(get_dataset_dir(), "price_history.sqlite")
+
+
+def to_price(value):
+    return None if value == "NA" else float(value)
+
+
+class PriceHistory:
+    """Price history of all products across daily snapshots.
+
+    Prices are stored as validity intervals (slowly changing dimension, type 2):
+    a row holds the regular and sale price of a product from valid_from until
+    valid_to (exclusive, NULL while current). A daily update only writes rows
+    for products whose prices changed, appeared or disappeared, and both the
+    history of one product and the prices on one date are indexed lookups.
+
+    Args:
+        db_path (str, optional): The SQLite database path. Defaults to get_price_history_path().
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or get_price_history_path()
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.executescript(
+            """CREATE TABLE IF NOT EXISTS prices (
+                product_id INTEGER NOT NULL,
+                valid_from TEXT NOT NULL,
+                valid_to TEXT,
+                price_regular REAL,
+                price_sale REAL,
+                PRIMARY KEY (product_id, valid_from)
+            );
+            CREATE INDEX IF NOT EXISTS prices_by_date ON prices (valid_from, valid_to);
+            CREATE TABLE IF NOT EXISTS snapshots (date TEXT PRIMARY KEY);"""
+        )
+        self.connection.commit()
+
+    def dates(self):
+        """Return the dates of all consolidated snapshots, sorted."""
+        return [date for (date,) in self.connection.execute("SELECT date FROM snapshots ORDER BY date")]
+
+    def update(self, date, prices, failed_ids=()):
+        """Consolidate the prices of one snapshot into the history.
+
+        Snapshots have to be added in date order; adding a date again is a no-op.
+
+        Args:
+            date (str): The date of the snapshot as yyyy-mm-dd.
+            prices (iterable): (product_id, price_regular, price_sale) tuples with None for missing prices.
+            failed_ids (iterable, optional): Products whose fetch failed on this date. They are
+                missing from prices but not delisted, so their current prices stay open.
+                Defaults to ().
+
+        Returns:
+            int: The number of products whose prices changed, appeared or disappeared.
+        """
+        dates = self.dates()
+        if date in dates:
+            print(f"Prices of {date} are already in the price history.")
+            return 0
+        if dates and date < dates[-1]:
+            raise ValueError(f"Cannot add {date} before the latest consolidated snapshot {dates[-1]}.")
+
+        current = {
+            product_id: (price_regular, price_sale)
+            for product_id, price_regular, price_sale in self.connection.execute(
+                "SELECT product_id, price_regular, price_sale FROM prices WHERE valid_to IS NULL")
+        }
+
+        closed, opened = [], []
+        seen = set()
+        for product_id, price_regular, price_sale in prices:
+            product_id = int(product_id)
+            seen.add(product_id)
+            previous = current.get(product_id)
+            if previous == (price_regular, price_sale):
+                continue
+            if previous is not None:
+                closed.append((date, product_id))
+            opened.append((product_id, date, price_regular, price_sale))
+
+        # Products that are no longer listed get their interval closed
+        delisted = current.keys() - seen - {int(product_id) for product_id in failed_ids}
+        closed.extend((date, product_id) for product_id in delisted)
+
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE prices SET valid_to = ? WHERE product_id = ? AND valid_to IS NULL", closed)
+            self.connection.executemany(
+                "INSERT INTO prices (product_id, valid_from, price_regular, price_sale) VALUES (?, ?, ?, ?)", opened)
+            self.connection.execute("INSERT INTO snapshots (date) VALUES (?)", (date,))
+
+        return len(opened) + len(delisted)
+
+    def history(self, product_id):
+        """Return the price history of one product.
+
+        Args:
+            product_id (int): The product ID.
+
+        Returns:
+            list: (valid_from, valid_to, price_regular, price_sale) tuples in date order,
+                valid_to is None for the current prices.
+        """
+        return self.connection.execute(
+            """SELECT valid_from, valid_to, price_regular, price_sale FROM prices
+               WHERE product_id = ? ORDER BY valid_from""", (int(product_id),)).fetchall()
+
+    def prices_on(self, date):
+        """Return the prices of every listed product on a date.
+
+        Args:
+            date (str): The date as yyyy-mm-dd.
+
+        Returns:
+            list: (product_id, price_regular, price_sale) tuples sorted by product ID.
+        """
+        return self.connection.execute(
+            """SELECT product_id, price_regular, price_sale FROM prices
+               WHERE valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)
+               ORDER BY product_id""", (date, date)).fetchall()
+
+    def on_sale(self, date):
+        """Return every product that was on sale on a date.
+
+        Args:
+            date (str): The date as yyyy-mm-dd.
+
+        Returns:
+            list: (product_id, price_regular, price_sale) tuples sorted by product ID.
+        """
+        return self.connection.execute(
+            """SELECT product_id, price_regular, price_sale FROM prices
+               WHERE valid_from <= ? AND (valid_to IS NULL OR valid_to > ?) AND price_sale IS NOT NULL
+               ORDER BY product_id""", (date, date)).fetchall()
+
+    def intervals(self):
+        """Yield every price interval, grouped by product and in date order within a product.
+
+        Yields:
+            tuple: (product_id, valid_from, valid_to, price_regular, price_sale).
+        """
+        yield from self.connection.execute(
+            """SELECT product_id, valid_from, valid_to, price_regular, price_sale FROM prices
+               ORDER BY product_id, valid_from""")
+
+    def close(self):
+        self.connection.close()
+
+
+def iter_store_prices(product_store):
+    """Yield (product_id, price_regular, price_sale) for every product in a product store."""
+    for product_id in tqdm(product_store.product_ids()):
+        price_regular, price_sale = get_product_prices(product_store.load(product_id))
+        yield product_id, to_price(price_regular), to_price(price_sale)
+
+
+def update_price_history(product_store=None, db_path=None):
+    """Consolidate the prices of a product store into the price history.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay, optional): The store to read the
+            products from. Defaults to today's JSON directory.
+        db_path (str, optional): The SQLite database path. Defaults to get_price_history_path().
+    """
+    if product_store is None:
+        product_store = open_product_store("json")
+
+    price_history = PriceHistory(db_path)
+    changed = price_history.update(product_store.date, iter_store_prices(product_store),
+                                   get_failed_ids(product_store))
+    price_history.close()
+    print(f"{changed} price changes recorded for {product_store.date}.")
+
+
+if __name__ == "__main__":
+    update_price_history()
@@ -0,0 +1,242 @@
+import os
+import sqlite3
+from tqdm import tqdm
+from product_store import open_product_store, get_dataset_dir
+from write_csv_from_jsons import get_categories, get_ingredients_and_allergens
+
+
+def get_search_index_path(date):
+    """Return the path of the search index of a date, complete_datasets/<date>_search.sqlite."""
+    return os.path.join(get_dataset_dir(), f"{date}_search.sqlite")
+
+
+def split_allergens(allergens):
+    """Split a comma-joined allergen column into lowercase allergen names, [] for "NA"."""
+    if allergens == "NA":
+        return []
+    return [allergen.strip().lower() for allergen in allergens.split(",") if allergen.strip()]
+
+
+def iter_search_rows(product_store):
+    """Yield (product_id, name, categories, ingredients, contains, may_contain, non_food) for every product.
+
+    The fields are extracted like the CSV columns, categories as the six
+    Category columns and allergens as lists of names.
+    """
+    for product_id in tqdm(product_store.product_ids(), desc="Indexing"):
+        json_data = product_store.load(product_id)
+        product = json_data["card"]["products"][0]
+        ingredients, contains, may_contain, non_food = get_ingredients_and_allergens(json_data)
+        yield (int(product_id), product["title"], get_categories(json_data), ingredients,
+               split_allergens(contains), split_allergens(may_contain), non_food)
+
+
+class ProductSearch:
+    """Indexed search over the products of one day.
+
+    Product names and ingredient statements are indexed with SQLite FTS5.
+    Allergens and categories are kept in inverted indexes of (name,
+    product_id) rows. Full-text, allergen and category filters are then all
+    index lookups instead of a scan of every row:
+
+        search = ProductSearch(get_search_index_path("2024-01-31"))
+        search.search("hazelnoot", exclude_allergens=["melk"])
+
+    Args:
+        db_path (str): The SQLite database path.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(
+            """CREATE TABLE IF NOT EXISTS products (
+                product_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                category1 TEXT, category2 TEXT, category3 TEXT,
+                category4 TEXT, category5 TEXT, category6 TEXT,
+                ingredients TEXT,
+                contains TEXT,
+                may_contain TEXT,
+                non_food TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5 (
+                name, ingredients, non_food,
+                content='products', content_rowid='product_id', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TABLE IF NOT EXISTS allergens (
+                allergen TEXT NOT NULL,
+                may_contain INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                PRIMARY KEY (allergen, may_contain, product_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS categories (
+                category TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                PRIMARY KEY (category, level, product_id)
+            ) WITHOUT ROWID;"""
+        )
+        self.connection.commit()
+
+    def build(self, rows):
+        """Replace the index with the given products.
+
+        Args:
+            rows (iterable): Tuples as yielded by iter_search_rows.
+
+        Returns:
+            int: The number of indexed products.
+        """
+        count = 0
+        with self.connection:
+            self.connection.execute("DELETE FROM products")
+            self.connection.execute("DELETE FROM allergens")
+            self.connection.execute("DELETE FROM categories")
+            for product_id, name, categories, ingredients, contains, may_contain, non_food in rows:
+                self.connection.execute(
+                    "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (product_id, name, *[None if category == "NA" else category for category in categories],
+                     None if ingredients == "NA" else ingredients, ", ".join(contains) or None,
+                     ", ".join(may_contain) or None, None if non_food == "NA" else non_food))
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO allergens VALUES (?, ?, ?)",
+                    [(allergen, 0, product_id) for allergen in contains] +
+                    [(allergen, 1, product_id) for allergen in may_contain])
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO categories VALUES (?, ?, ?)",
+                    [(category, level, product_id) for level, category in enumerate(categories, start=1)
+                     if category != "NA"])
+                count += 1
+            self.connection.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+            self.connection.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+        return count
+
+    def search(self, text=None, allergens=(), exclude_allergens=(), exclude_may_contain=False,
+               categories=(), level=None, limit=100):
+        """Return the products matching all given filters.
+
+        Args:
+            text (str, optional): An FTS5 query over product names and ingredient statements, e.g.
+                "hazelnoot", "hazel*" or '"volle melk"'. Results are then ranked by relevance.
+                Defaults to None.
+            allergens (iterable, optional): Allergens the product must contain. Defaults to ().
+            exclude_allergens (iterable, optional): Allergens the product must not contain.
+                Defaults to ().
+            exclude_may_contain (bool, optional): Also exclude products that may contain one of
+                exclude_allergens (traces). Defaults to False.
+            categories (iterable, optional): Categories the product must be in. Defaults to ().
+            level (int, optional): Only match categories at this level (1 for Category1 up to 6),
+                None for any level. Defaults to None.
+            limit (int, optional): Maximum number of results, None for all. Defaults to 100.
+
+        Returns:
+            list: (product_id, name, category1, ingredients, contains, may_contain) tuples, sorted
+                by relevance for a text query and by product ID otherwise.
+
+        Raises:
+            ValueError: If text is not a valid FTS5 query.
+        """
+        if text:
+            query = ["SELECT p.product_id, p.name, p.category1, p.ingredients, p.contains, p.may_contain "
+                     "FROM products_fts JOIN products p ON p.product_id = products_fts.rowid "
+                     "WHERE products_fts MATCH ?"]
+            parameters = [text]
+        else:
+            query = ["SELECT p.product_id, p.name, p.category1, p.ingredients, p.contains, p.may_contain "
+                     "FROM products p WHERE 1"]
+            parameters = []
+
+        for allergen in allergens:
+            query.append("AND p.product_id IN (SELECT product_id FROM allergens WHERE allergen = ? AND may_contain = 0)")
+            parameters.append(allergen.lower())
+        for allergen in exclude_allergens:
+            query.append("AND p.product_id NOT IN (SELECT product_id FROM allergens WHERE allergen = ?" +
+                         ("" if exclude_may_contain else " AND may_contain = 0") + ")")
+            parameters.append(allergen.lower())
+        for category in categories:
+            query.append("AND p.product_id IN (SELECT product_id FROM categories WHERE category = ?" +
+                         ("" if level is None else " AND level = ?") + ")")
+            parameters += [category] if level is None else [category, level]
+
+        query.append("ORDER BY products_fts.rank" if text else "ORDER BY p.product_id")
+        if limit is not None:
+            query.append("LIMIT ?")
+            parameters.append(limit)
+        try:
+            return self.connection.execute(" ".join(query), parameters).fetchall()
+        except sqlite3.OperationalError as e:
+            if not text:
+                raise
+            # FTS5 rejects unbalanced quotes and stray operators such as "hazel-"
+            raise ValueError(f"Invalid search query {text!r} ({e}); put terms with special characters "
+                             f"in double quotes, e.g. '\"hazel-\"'.") from e
+
+    def allergen_counts(self):
+        """Return {allergen: number of products containing it}, most common first."""
+        return dict(self.connection.execute(
+            """SELECT allergen, COUNT(*) FROM allergens WHERE may_contain = 0
+               GROUP BY allergen ORDER BY COUNT(*) DESC, allergen"""))
+
+    def close(self):
+        self.connection.close()
+
+
+def build_search_index(product_store=None, db_path=None):
+    """Build the search index of a product store.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay, optional): The store to index.
+            Defaults to today's JSON directory.
+        db_path (str, optional): The SQLite database path. Defaults to get_search_index_path.
+
+    Returns:
+        str: The path of the search index.
+    """
+    if product_store is None:
+        product_store = open_product_store("json")
+    db_path = db_path or get_search_index_path(product_store.date)
+
+    product_search = ProductSearch(db_path)
+    count = product_search.build(iter_search_rows(product_store))
+    product_search.close()
+    print(f"Indexed {count} products of {product_store.date} in {db_path}.")
+    return db_path
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Build or query the product search index of a day.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("--date", help="the day as yyyy-mm-dd (default: today)")
+    parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+    parser.add_argument("--text", help="FTS5 query over names and ingredients, e.g. 'hazelnoot' or 'hazel*'")
+    parser.add_argument("--allergen", action="append", default=[], help="must contain this allergen")
+    parser.add_argument("--exclude-allergen", action="append", default=[], help="must not contain this allergen")
+    parser.add_argument("--strict", action="store_true", help="also exclude products that may contain it")
+    parser.add_argument("--category", action="append", default=[], help="must be in this category")
+    parser.add_argument("--level", type=int, choices=range(1, 7), help="only match Category<level>")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_search_index(open_product_store(args.storage, args.date))
+    else:
+        index_path = get_search_index_path(args.date or datetime.now().strftime("%Y-%m-%d"))
+        if not os.path.isfile(index_path):
+            raise Exception(f"No search index at {index_path}, run the build command first.")
+        product_search = ProductSearch(index_path)
+        started = time.perf_counter()
+        try:
+            results = product_search.search(args.text, args.allergen, args.exclude_allergen, args.strict,
+                                            args.category, args.level, args.limit)
+        except ValueError as e:
+            parser.error(str(e))
+        elapsed = time.perf_counter() - started
+        for product_id, name, category, ingredients, contains, may_contain in results:
+            print(f"{product_id}\t{name}\t{category or ''}\t{contains or ''}")
+        print(f"{len(results)} products in {elapsed * 1000:.1f} ms.")
+        product_search.close()
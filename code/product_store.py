@@ -0,0 +1,406 @@
+import os
+import re
+import json
+import gzip
+import shutil
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+
+JSON_DIR_PATTERN = re.compile(r"^product_jsons_(\d{4}-\d{2}-\d{2})$")
+MANIFEST_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})\.manifest$")
+
+
+def get_project_root():
+    working_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.dirname(working_dir)
+
+
+def get_dataset_dir():
+    """Return complete_datasets/ in the project root, creating it if needed."""
+    dataset_dir = os.path.join(get_project_root(), "complete_datasets")
+    os.makedirs(dataset_dir, exist_ok=True)
+    return dataset_dir
+
+
+def link_or_copy(source_path, target_path):
+    """Hardlink source_path to target_path, copying the file where hardlinks are unsupported."""
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+
+class JsonDirectoryStore:
+    """The product JSONs of one day stored as json_collections/product_jsons_yyyy-mm-dd/<id>.json.
+
+    Product stores share one small interface (put, load, load_raw, has,
+    product_ids, carry_forward, previous, close) so that the scrapers and the CSV writer
+    do not need to know how the product data of a day is kept on disk.
+
+    Args:
+        json_dir (str): The directory path where the JSON files are saved.
+    """
+
+    def __init__(self, json_dir):
+        self.json_dir = os.path.normpath(json_dir)
+        self.journal_path = self.json_dir + ".journal.sqlite"
+        match = JSON_DIR_PATTERN.match(os.path.basename(self.json_dir))
+        self.date = match.group(1) if match else None
+
+    def __repr__(self):
+        return f"JsonDirectoryStore({self.json_dir!r})"
+
+    def _path(self, product_id):
+        return os.path.join(self.json_dir, f"{product_id}.json")
+
+    def put(self, product_id, data):
+        """Write the product data of a single product to <json_dir>/<product_id>.json.
+
+        Args:
+            product_id (str): The unique identifier for the product.
+            data (dict): The parsed product JSON.
+        """
+        json_file_path = self._path(product_id)
+        # Write to a temporary file first so a hardlink carried forward from a
+        # previous day is replaced instead of being overwritten in place
+        temporary_path = json_file_path + ".tmp"
+        with open(temporary_path, 'w') as json_file:
+            json.dump(data, json_file)
+        os.replace(temporary_path, json_file_path)
+
+    def load(self, product_id):
+        with open(self._path(product_id), 'r') as json_file:
+            return json.load(json_file)
+
+    def load_raw(self, product_id):
+        """Return the undecoded JSON bytes of a product, e.g. for typed_products.decode_product."""
+        with open(self._path(product_id), 'rb') as json_file:
+            return json_file.read()
+
+    def has(self, product_id):
+        return os.path.isfile(self._path(product_id))
+
+    def product_ids(self):
+        """Return the IDs (as strings) of all stored products, sorted numerically."""
+        product_ids = [file[:-len(".json")] for file in os.listdir(self.json_dir) if file.endswith(".json")]
+        return sorted(product_ids, key=int)
+
+    def carry_forward(self, previous_store, product_id):
+        """Reuse the JSON of a product from a previous day by hardlinking it."""
+        link_or_copy(previous_store._path(product_id), self._path(product_id))
+
+    def previous(self):
+        """Return the most recent earlier dated JSON directory that has a crawl journal, or None."""
+        if self.date is None:
+            return None
+
+        data_dir = os.path.dirname(self.json_dir)
+        candidates = []
+        for name in os.listdir(data_dir):
+            match = JSON_DIR_PATTERN.match(name)
+            path = os.path.join(data_dir, name)
+            if match and match.group(1) < self.date and os.path.isfile(path + ".journal.sqlite"):
+                candidates.append((match.group(1), path))
+
+        return JsonDirectoryStore(max(candidates)[1]) if candidates else None
+
+    def close(self):
+        pass
+
+
+class SnapshotStore:
+    """Content-addressed, compressed storage of product payloads shared by all days.
+
+    Every payload is normalized (sorted keys, compact separators) and hashed
+    with SHA-256. A blob is compressed and appended to a pack file only the
+    first time its hash is seen, so a product that did not change since
+    yesterday costs a manifest line instead of another file. The index of
+    hash -> (pack, offset, length) is kept in SQLite. Blobs are compressed
+    with zstd if the zstandard package is installed and gzip otherwise.
+
+    Layout:
+        snapshot_store/packs/pack-000000.bin   append-only compressed blobs
+        snapshot_store/index.sqlite            blob hash -> location in a pack
+        snapshot_store/manifests/<date>.manifest  append-only "<id>\\t<hash>" lines
+
+    Args:
+        store_dir (str): The root directory of the store.
+        max_pack_bytes (int, optional): Size after which a new pack file is started.
+            Defaults to 256 MiB.
+    """
+
+    def __init__(self, store_dir, max_pack_bytes=256 * 1024 * 1024):
+        self.store_dir = store_dir
+        self.pack_dir = os.path.join(store_dir, "packs")
+        self.manifest_dir = os.path.join(store_dir, "manifests")
+        os.makedirs(self.pack_dir, exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self.max_pack_bytes = max_pack_bytes
+        self.lock = threading.Lock()
+        self.readers = {}
+
+        self.connection = sqlite3.connect(os.path.join(store_dir, "index.sqlite"), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                pack TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )"""
+        )
+        self.connection.commit()
+
+        try:
+            import zstandard
+            self.codec = "zstd"
+            self.compressor = zstandard.ZstdCompressor(level=10)
+            self.decompressor = zstandard.ZstdDecompressor()
+        except ImportError:
+            self.codec = "gzip"
+
+        self.pack_name = self._current_pack_name()
+
+    def __reduce__(self):
+        # Reopen the store from its directory in other processes
+        return (SnapshotStore, (self.store_dir, self.max_pack_bytes))
+
+    @classmethod
+    def default(cls):
+        """Open the store in <project root>/snapshot_store."""
+        return cls(os.path.join(get_project_root(), "snapshot_store"))
+
+    def _current_pack_name(self):
+        packs = sorted(name for name in os.listdir(self.pack_dir) if name.startswith("pack-"))
+        if packs and os.path.getsize(os.path.join(self.pack_dir, packs[-1])) < self.max_pack_bytes:
+            return packs[-1]
+        return f"pack-{len(packs):06d}.bin"
+
+    def _compress(self, raw):
+        if self.codec == "zstd":
+            return self.compressor.compress(raw)
+        return gzip.compress(raw, mtime=0)
+
+    def _decompress(self, blob, codec):
+        if codec == "zstd":
+            if self.codec != "zstd":
+                raise ImportError("This blob is zstd compressed, install zstandard to read it.")
+            return self.decompressor.decompress(blob)
+        return gzip.decompress(blob)
+
+    @staticmethod
+    def normalize(data):
+        return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+
+    def put_blob(self, data):
+        """Store a product payload once and return its hash.
+
+        Args:
+            data (dict): The parsed product JSON.
+
+        Returns:
+            str: The SHA-256 hex digest of the normalized payload.
+        """
+        raw = self.normalize(data)
+        blob_hash = hashlib.sha256(raw).hexdigest()
+
+        with self.lock:
+            if self.connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (blob_hash,)).fetchone():
+                return blob_hash
+
+            blob = self._compress(raw)
+            pack_path = os.path.join(self.pack_dir, self.pack_name)
+            with open(pack_path, 'ab') as pack:
+                offset = pack.tell()
+                pack.write(blob)
+            self.connection.execute("INSERT INTO blobs VALUES (?, ?, ?, ?, ?)",
+                                    (blob_hash, self.pack_name, offset, len(blob), self.codec))
+            self.connection.commit()
+
+            if offset + len(blob) >= self.max_pack_bytes:
+                self.pack_name = self._current_pack_name()
+
+        return blob_hash
+
+    def get_blob(self, blob_hash):
+        """Load a product payload by its hash.
+
+        Args:
+            blob_hash (str): The hash returned by put_blob.
+
+        Returns:
+            dict: The parsed product JSON.
+        """
+        return json.loads(self.get_raw_blob(blob_hash))
+
+    def get_raw_blob(self, blob_hash):
+        """Load the undecoded JSON bytes of a product payload by its hash.
+
+        Args:
+            blob_hash (str): The hash returned by put_blob.
+
+        Returns:
+            bytes: The normalized product JSON.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT pack, offset, length, codec FROM blobs WHERE hash = ?",
+                                          (blob_hash,)).fetchone()
+            if row is None:
+                raise KeyError(blob_hash)
+            pack_name, offset, length, codec = row
+
+            reader = self.readers.get(pack_name)
+            if reader is None:
+                reader = self.readers[pack_name] = open(os.path.join(self.pack_dir, pack_name), 'rb')
+            reader.seek(offset)
+            return self._decompress(reader.read(length), codec)
+
+    def day(self, date):
+        """Return the SnapshotDay view of one dated snapshot.
+
+        Args:
+            date (str): The date as yyyy-mm-dd.
+        """
+        return SnapshotDay(self, date)
+
+    def dates(self):
+        """Return the dates of all snapshots in the store, sorted."""
+        return sorted(match.group(1) for match in map(MANIFEST_PATTERN.match, os.listdir(self.manifest_dir)) if match)
+
+    def close(self):
+        with self.lock:
+            for reader in self.readers.values():
+                reader.close()
+            self.readers = {}
+            self.connection.close()
+
+
+class SnapshotDay:
+    """The products of one day in a SnapshotStore, with the same interface as JsonDirectoryStore.
+
+    Args:
+        snapshot_store (SnapshotStore): The store holding the blobs.
+        date (str): The date as yyyy-mm-dd.
+    """
+
+    def __init__(self, snapshot_store, date):
+        self.snapshot_store = snapshot_store
+        self.date = date
+        self.manifest_path = os.path.join(snapshot_store.manifest_dir, f"{date}.manifest")
+        self.journal_path = os.path.join(snapshot_store.manifest_dir, f"{date}.journal.sqlite")
+        self.lock = threading.Lock()
+        self.manifest = {}
+
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, 'r') as manifest_file:
+                for line in manifest_file:
+                    product_id, _, blob_hash = line.rstrip("\n").partition("\t")
+                    if blob_hash:
+                        self.manifest[product_id] = blob_hash
+        self.manifest_file = None
+
+    def __reduce__(self):
+        return (SnapshotDay, (self.snapshot_store, self.date))
+
+    def __repr__(self):
+        return f"SnapshotDay({self.snapshot_store.store_dir!r}, {self.date!r})"
+
+    def _add(self, product_id, blob_hash):
+        with self.lock:
+            if self.manifest_file is None:
+                self.manifest_file = open(self.manifest_path, 'a')
+            self.manifest_file.write(f"{product_id}\t{blob_hash}\n")
+            self.manifest_file.flush()
+            self.manifest[product_id] = blob_hash
+
+    def put(self, product_id, data):
+        self._add(product_id, self.snapshot_store.put_blob(data))
+
+    def load(self, product_id):
+        return self.snapshot_store.get_blob(self.manifest[product_id])
+
+    def load_raw(self, product_id):
+        return self.snapshot_store.get_raw_blob(self.manifest[product_id])
+
+    def has(self, product_id):
+        return product_id in self.manifest
+
+    def product_ids(self):
+        """Return the IDs (as strings) of all products in this snapshot, sorted numerically."""
+        return sorted(self.manifest, key=int)
+
+    def carry_forward(self, previous_store, product_id):
+        """Reuse the blob of a product from a previous snapshot without copying any data."""
+        self._add(product_id, previous_store.manifest[product_id])
+
+    def previous(self):
+        """Return the most recent earlier snapshot that has a crawl journal, or None."""
+        manifest_dir = self.snapshot_store.manifest_dir
+        candidates = [date for date in self.snapshot_store.dates()
+                      if date < self.date and os.path.isfile(os.path.join(manifest_dir, f"{date}.journal.sqlite"))]
+        return self.snapshot_store.day(max(candidates)) if candidates else None
+
+    def close(self):
+        with self.lock:
+            if self.manifest_file is not None:
+                self.manifest_file.close()
+                self.manifest_file = None
+
+
+def open_product_store(storage="json", date=None):
+    """Open the product store of one day.
+
+    Args:
+        storage (str, optional): "json" for one JSON file per product in
+            json_collections/product_jsons_<date>/ or "snapshot" for the compressed,
+            content-addressed snapshot_store/. Defaults to "json".
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+
+    Returns:
+        JsonDirectoryStore or SnapshotDay: The store of that day.
+    """
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    if storage == "json":
+        return JsonDirectoryStore(os.path.join(get_project_root(), "json_collections", f"product_jsons_{date}"))
+    elif storage == "snapshot":
+        return SnapshotStore.default().day(date)
+    raise ValueError(f"Unknown storage: {storage}")
+
+
+def import_json_directory(json_dir, snapshot_store):
+    """Copy a dated JSON directory into the snapshot store.
+
+    Args:
+        json_dir (str): A json_collections/product_jsons_yyyy-mm-dd directory.
+        snapshot_store (SnapshotStore): The store to import into.
+
+    Returns:
+        SnapshotDay: The imported snapshot.
+    """
+    source = JsonDirectoryStore(json_dir)
+    if source.date is None:
+        raise ValueError(f"{json_dir} is not a product_jsons_yyyy-mm-dd directory.")
+
+    snapshot = snapshot_store.day(source.date)
+    for product_id in source.product_ids():
+        if not snapshot.has(product_id):
+            snapshot.put(product_id, source.load(product_id))
+    snapshot.close()
+    return snapshot
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Import existing dated JSON directories: python product_store.py json_collections/product_jsons_*
+    store = SnapshotStore.default()
+    for json_dir in sys.argv[1:]:
+        imported = import_json_directory(json_dir, store)
+        print(f"Imported {len(imported.product_ids())} products of {imported.date}.")
+    store.close()
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import bisect
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from collections import Counter
+from product_store import get_project_root
+
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def get_run_report_dir():
+    """Return the directory of the run reports and profiles, run_reports/ in the project root."""
+    report_dir = os.path.join(get_project_root(), "run_reports")
+    os.makedirs(report_dir, exist_ok=True)
+    return report_dir
+
+
+def get_run_report_path(date=None):
+    """Return the path of the JSON-lines run report of a date, run_reports/<date>.jsonl.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+    """
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    return os.path.join(get_run_report_dir(), f"{date}.jsonl")
+
+
+def finite(value):
+    return None if value == float("inf") else value
+
+
+class Histogram:
+    """Fixed-bucket histogram, cumulative like a Prometheus histogram when exported.
+
+    Args:
+        buckets (tuple, optional): Sorted bucket upper bounds. Defaults to LATENCY_BUCKETS.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """Return the upper bound of the bucket holding the given quantile, None if empty."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs, ending with +Inf."""
+        pairs, seen = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            pairs.append((bound, seen))
+        return pairs
+
+    def to_dict(self):
+        return {
+            "buckets": {("+Inf" if bound == float("inf") else str(bound)): count for bound, count in self.cumulative()},
+            "sum": self.sum,
+            "count": self.count,
+            "p50": finite(self.quantile(0.5)),
+            "p99": finite(self.quantile(0.99)),
+        }
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Metrics of one run of the scraper and the conversion, written to a JSON-lines report.
+
+    The scrapers report every response (status, latency, bytes), every retry
+    with the backoff it caused and every product that finally failed, with
+    its ID and reason. The conversion reports the time spent in each
+    extractor, and stage() times the pipeline stages. Failures and stages
+    are written to the report as they happen, one JSON object per line, and
+    close() appends a summary with all counters. All methods are thread-safe.
+
+    Args:
+        report_path (str, optional): The JSON-lines file to append to, None for no report.
+            Defaults to None.
+        profiler (str, optional): "cprofile" or "pyinstrument" to profile every stage, see
+            profile_stage. Defaults to None.
+    """
+
+    def __init__(self, report_path=None, profiler=None):
+        self.report_path = report_path
+        self.profiler = profiler
+        self.run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.lock = threading.Lock()
+        self.request_latency = Histogram()
+        self.status_counts = Counter()
+        self.retries = Counter()
+        self.backoff_seconds = 0.0
+        self.bytes_downloaded = 0
+        self.failures = Counter()
+        self.malformed = 0
+        self.extractor_seconds = Counter()
+        self.extractor_calls = Counter()
+        self.stage_seconds = {}
+        self.report_file = open(report_path, "a", encoding="utf-8") if report_path else None
+        self.server = None
+
+    def event(self, event, **fields):
+        """Append one event to the report."""
+        if self.report_file is None:
+            return
+        line = json.dumps({"time": datetime.now().isoformat(timespec="milliseconds"), "run_id": self.run_id,
+                           "event": event, **fields})
+        with self.lock:
+            self.report_file.write(line + "\n")
+            self.report_file.flush()
+
+    def observe_request(self, status, seconds, nbytes=0):
+        """Record one response.
+
+        Args:
+            status (int): The HTTP status code, or None for a transport error.
+            seconds (float): The request latency.
+            nbytes (int, optional): Size of the response body as received. Defaults to 0.
+        """
+        with self.lock:
+            self.request_latency.observe(seconds)
+            self.status_counts["error" if status is None else str(status)] += 1
+            self.bytes_downloaded += nbytes
+
+    def observe_retry(self, reason, backoff=0.0):
+        """Record a retried attempt and the seconds waited before the retry."""
+        with self.lock:
+            self.retries[reason] += 1
+            self.backoff_seconds += backoff
+
+    def observe_failure(self, product_id, reason, message=None):
+        """Record a product that could not be fetched, and write it to the report.
+
+        Args:
+            product_id (str): The product ID.
+            reason (str): A short, bounded reason used as metric label, e.g. "HTTP 404" or the
+                exception type "ConnectionError".
+            message (str, optional): The full error message, only written to the report.
+                Defaults to reason.
+        """
+        with self.lock:
+            self.failures[reason] += 1
+        self.event("failure", product_id=product_id, reason=reason, message=message or reason)
+
+    def observe_malformed(self, product_id, reason):
+        """Record a product payload that did not match the schema, and write it to the report."""
+        with self.lock:
+            self.malformed += 1
+        self.event("malformed", product_id=product_id, reason=reason)
+
+    def observe_extractor(self, name, seconds, calls=1):
+        with self.lock:
+            self.extractor_seconds[name] += seconds
+            self.extractor_calls[name] += calls
+
+    def merge_extractor_times(self, extractor_times):
+        """Add the {name: (seconds, calls)} totals of a worker process."""
+        for name, (seconds, calls) in extractor_times.items():
+            self.observe_extractor(name, seconds, calls)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage, and profile it if a profiler was chosen.
+
+        Args:
+            name (str): The stage name, e.g. "scrape" or "convert".
+        """
+        started = time.monotonic()
+        self.event("stage_start", stage=name)
+        try:
+            with profile_stage(name, self.profiler):
+                yield self
+        finally:
+            seconds = time.monotonic() - started
+            with self.lock:
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.event("stage_end", stage=name, seconds=round(seconds, 3))
+
+    def summary(self):
+        """Return all counters as a JSON-serializable dict."""
+        with self.lock:
+            return {
+                "request_latency": self.request_latency.to_dict(),
+                "status_counts": dict(self.status_counts),
+                "retries": dict(self.retries),
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "bytes_downloaded": self.bytes_downloaded,
+                "failures": dict(self.failures),
+                "malformed": self.malformed,
+                "extractor_seconds": {name: round(seconds, 3) for name, seconds in self.extractor_seconds.items()},
+                "extractor_calls": dict(self.extractor_calls),
+                "stage_seconds": {name: round(seconds, 3) for name, seconds in self.stage_seconds.items()},
+            }
+
+    def prometheus_text(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        with self.lock:
+            latency = self.request_latency.cumulative()
+        lines = ["# TYPE ah_request_latency_seconds histogram"]
+        for bound, count in latency:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'ah_request_latency_seconds_bucket{{le="{le}"}} {count}')
+        lines.append(f"ah_request_latency_seconds_sum {summary['request_latency']['sum']}")
+        lines.append(f"ah_request_latency_seconds_count {summary['request_latency']['count']}")
+
+        lines.append("# TYPE ah_responses_total counter")
+        lines += [f'ah_responses_total{{status="{escape_label(status)}"}} {count}' for status, count in summary["status_counts"].items()]
+        lines.append("# TYPE ah_retries_total counter")
+        lines += [f'ah_retries_total{{reason="{escape_label(reason)}"}} {count}' for reason, count in summary["retries"].items()]
+        lines.append("# TYPE ah_backoff_seconds_total counter")
+        lines.append(f"ah_backoff_seconds_total {summary['backoff_seconds']}")
+        lines.append("# TYPE ah_downloaded_bytes_total counter")
+        lines.append(f"ah_downloaded_bytes_total {summary['bytes_downloaded']}")
+        lines.append("# TYPE ah_failed_products_total counter")
+        lines += [f'ah_failed_products_total{{reason="{escape_label(reason)}"}} {count}' for reason, count in summary["failures"].items()]
+        lines.append("# TYPE ah_malformed_products_total counter")
+        lines.append(f"ah_malformed_products_total {summary['malformed']}")
+        lines.append("# TYPE ah_extractor_seconds_total counter")
+        lines += [f'ah_extractor_seconds_total{{extractor="{escape_label(name)}"}} {seconds}'
+                  for name, seconds in summary["extractor_seconds"].items()]
+        lines.append("# TYPE ah_stage_seconds gauge")
+        lines += [f'ah_stage_seconds{{stage="{escape_label(name)}"}} {seconds}' for name, seconds in summary["stage_seconds"].items()]
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port=9108, host="127.0.0.1"):
+        """Serve prometheus_text() on http://host:port/metrics from a background thread."""
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.prometheus_text().encode() if self.path == "/metrics" else b""
+                self.send_response(200 if body else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server
+
+    def close(self):
+        """Write the summary to the report and stop the Prometheus endpoint."""
+        self.event("summary", **self.summary())
+        if self.report_file is not None:
+            self.report_file.close()
+            self.report_file = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+@contextmanager
+def profile_stage(name, profiler=None):
+    """Profile the code in the with-block if a profiler is chosen.
+
+    cProfile statistics are written to run_reports/<name>-<time>.prof (open
+    them with pstats or snakeviz), pyinstrument reports to
+    run_reports/<name>-<time>.html.
+
+    A cProfile profiler only sees the thread that enabled it, so before
+    Python 3.12 every thread started in the with-block (e.g. the fetch
+    threads of the threaded scraper) gets its own profiler, and their
+    statistics are merged into the .prof file. Threads started before the
+    block are not profiled. pyinstrument only samples the calling thread.
+
+    Args:
+        name (str): The stage name used in the file name.
+        profiler (str, optional): "cprofile", "pyinstrument" or None for no profiling.
+            Defaults to None.
+    """
+    if profiler is None:
+        yield
+        return
+
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    if profiler == "cprofile":
+        import sys
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        thread_profiles = []
+        # From 3.12 on cProfile hooks into sys.monitoring, which already covers every thread
+        per_thread = sys.version_info < (3, 12)
+
+        def profile_thread(*args):
+            # Called once in every new thread, the thread's own profiler then takes over
+            thread_profile = cProfile.Profile()
+            thread_profiles.append(thread_profile)
+            thread_profile.enable()
+
+        if per_thread:
+            threading.setprofile(profile_thread)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if per_thread:
+                threading.setprofile(None)
+            stats = pstats.Stats(profile)
+            for thread_profile in thread_profiles:
+                stats.add(thread_profile)
+            profile_path = os.path.join(get_run_report_dir(), f"{name}-{stamp}.prof")
+            stats.dump_stats(profile_path)
+            print(f"Wrote the {name} profile to {profile_path}" +
+                  (f", with {len(thread_profiles)} threads." if thread_profiles else "."))
+    elif profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError("The pyinstrument profiler requires pyinstrument (pip install pyinstrument).") from e
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            profile_path = os.path.join(get_run_report_dir(), f"{name}-{stamp}.html")
+            with open(profile_path, "w", encoding="utf-8") as f:
+                f.write(profile.output_html())
+            print(f"Wrote the {name} profile to {profile_path}.")
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
+
+
+if __name__ == "__main__":
+    pass
@@ -5,35 +5,52 @@ import requests
 import json
 import time
 import random
-from datetime import datetime
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from header_objects import api_headers, xml_headers
-
-
-def create_json_directory():
+from crawl_journal import CrawlJournal
+from incremental_crawl import IncrementalCrawl
+from product_store import JsonDirectoryStore, open_product_store
+from adaptive_concurrency import AimdController
+from crawl_priority import CrawlBudget, prioritize_products, load_priority_scores
+from transport import create_session, get_connection_stats, get_response_size, print_connection_stats
+
+
+# Point the scraper at another host, e.g. the local mock_ah_server, with AH_BASE_URL
+BASE_URL = os.environ.get("AH_BASE_URL", "https://www.ah.nl")
+PRODUCT_API_PATH = "/zoeken/api/products/product?webshopId="
+SITEMAP_PATH = "/sitemaps/entities/products/detail.xml"
+PRODUCT_API_URL = BASE_URL + PRODUCT_API_PATH
+SITEMAP_URL = BASE_URL + SITEMAP_PATH
+PRODUCT_ID_PATTERN = r"(?<=/wi)(\d+)"
+
+# Delays in seconds: pause after every product, backoff after a 403, wait before a retry
+REQUEST_DELAY = (1.25, 1.50)
+FORBIDDEN_BACKOFF = 120
+RETRY_DELAY = 2
+SITEMAP_NAMESPACE = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+
+
+def create_json_directory(date=None):
     """Create a directory for storing JSON files.
 
     This function creates a directory structure under the project root
     for storing JSON files containing product data. The directory is 
-    named with the current date.
+    named with the date.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
 
     Returns:
         str: The path to the created JSON directory.
     """
-    working_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(working_dir)
-    data_dir = os.path.join(project_root, "json_collections")
-    os.makedirs(data_dir, exist_ok=True)
-
-    today_date = datetime.now().strftime("%Y-%m-%d")
-    json_dir = os.path.join(data_dir, f"product_jsons_{today_date}")
+    json_dir = open_product_store("json", date).json_dir
     os.makedirs(json_dir, exist_ok=True)
 
     return json_dir
 
 
-def fetch_sitemap(xml_headers):
+def fetch_sitemap(xml_headers, base_url=BASE_URL):
     """Fetch the sitemap XML from the specified URL.
 
     This function attempts to download the sitemap XML file from 
@@ -42,13 +59,13 @@ def fetch_sitemap(xml_headers):
 
     Args:
         xml_headers (dict): The headers to include in the request.
+        base_url (str, optional): The host to download the sitemap from. Defaults to BASE_URL.
 
     Returns:
         bytes: The content of the sitemap XML.
     """
-    sitemap_xml_url = "https://www.ah.nl/sitemaps/entities/products/detail.xml"
     while True:
-        sitemap_response = requests.get(sitemap_xml_url, headers=xml_headers)
+        sitemap_response = requests.get(base_url + SITEMAP_PATH, headers=xml_headers)
         if sitemap_response.status_code == 200:
             return sitemap_response.content
         print(f"XML Download unsuccessful ({sitemap_response.status_code}), retrying...")
@@ -69,31 +86,122 @@ def parse_product_urls(sitemap_content):
     """
     xml_tree = ET.ElementTree(ET.fromstring(sitemap_content))
     xml_root = xml_tree.getroot()
-    xml_namespace = {'ns': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+    xml_namespace = SITEMAP_NAMESPACE
     return xml_root.findall("ns:url", xml_namespace), xml_namespace
 
 
-def initialize_session(api_headers):
+def open_sitemap_stream(xml_headers, sitemap_url):
+    """Open a streaming response for a sitemap, retrying until it succeeds.
+
+    Args:
+        xml_headers (dict): The headers to include in the request.
+        sitemap_url (str): The URL of the sitemap or sitemap index.
+
+    Returns:
+        requests.Response: A response whose body has not been read yet.
+    """
+    while True:
+        sitemap_response = requests.get(sitemap_url, headers=xml_headers, stream=True)
+        if sitemap_response.status_code == 200:
+            sitemap_response.raw.decode_content = True
+            return sitemap_response
+        sitemap_response.close()
+        print(f"XML Download unsuccessful ({sitemap_response.status_code}), retrying...")
+        time.sleep(5)
+
+
+def iter_sitemap_products(xml_headers, sitemap_url=SITEMAP_URL):
+    """Lazily yield the products of a sitemap while it is being downloaded.
+
+    The response body is fed straight into ElementTree.iterparse and every
+    <url> element is cleared once its product ID has been read, so memory
+    use does not grow with the size of the sitemap. A sitemap index
+    (<sitemapindex>) is followed into each of its child sitemaps in turn.
+
+    Args:
+        xml_headers (dict): The headers to include in the requests.
+        sitemap_url (str, optional): The URL of the sitemap or sitemap index.
+            Defaults to the Albert Heijn product sitemap.
+
+    Yields:
+        tuple: (product_id, lastmod) with lastmod None if the sitemap has no <lastmod>.
+    """
+    url_tag = "{%s}url" % SITEMAP_NAMESPACE['ns']
+    sitemap_tag = "{%s}sitemap" % SITEMAP_NAMESPACE['ns']
+
+    child_sitemaps = []
+    sitemap_response = open_sitemap_stream(xml_headers, sitemap_url)
+    with sitemap_response:
+        xml_root = None
+        for event, element in ET.iterparse(sitemap_response.raw, events=("start", "end")):
+            if event == "start":
+                if xml_root is None:
+                    xml_root = element
+                continue
+
+            if element.tag == url_tag:
+                yield get_product_id(element, SITEMAP_NAMESPACE), get_product_lastmod(element, SITEMAP_NAMESPACE)
+                xml_root.clear()
+            elif element.tag == sitemap_tag:
+                child_sitemaps.append(element.find('ns:loc', SITEMAP_NAMESPACE).text.strip())
+                xml_root.clear()
+
+    for child_sitemap_url in child_sitemaps:
+        yield from iter_sitemap_products(xml_headers, child_sitemap_url)
+
+
+def get_product_id(url_element, xml_namespace):
+    """Extract the webshop product ID from a sitemap <url> element.
+
+    Args:
+        url_element (xml.etree.ElementTree.Element): A <url> element from the sitemap.
+        xml_namespace (dict): The XML namespace used for parsing product URLs.
+
+    Returns:
+        str: The numeric product ID found in the product URL.
+    """
+    product_url = url_element.find('ns:loc', xml_namespace).text
+    return re.search(PRODUCT_ID_PATTERN, product_url).group()
+
+
+def get_product_lastmod(url_element, xml_namespace):
+    """Extract the <lastmod> timestamp from a sitemap <url> element.
+
+    Args:
+        url_element (xml.etree.ElementTree.Element): A <url> element from the sitemap.
+        xml_namespace (dict): The XML namespace used for parsing product URLs.
+
+    Returns:
+        str: The <lastmod> text, or None if the element has no <lastmod>.
+    """
+    lastmod = url_element.find('ns:lastmod', xml_namespace)
+    return lastmod.text.strip() if lastmod is not None and lastmod.text else None
+
+
+def initialize_session(api_headers, base_url=BASE_URL, pool_size=10, http2=False):
     """Initialize a requests session and establish cookies.
 
-    This function creates a requests session and makes an initial request
-    to establish the session and set cookies. It raises an exception 
-    if the session cannot be established.
+    This function creates a session through transport.create_session and
+    makes an initial request to establish the session and set cookies. It
+    raises an exception if the session cannot be established.
 
     Args:
-        api_headers (dict): The headers to include in the initial request.
+        api_headers (dict): The headers to include in every request.
+        base_url (str, optional): The host to establish the session with. Defaults to BASE_URL.
+        pool_size (int, optional): Number of pooled connections, match it to the number of
+            worker threads. Defaults to 10.
+        http2 (bool, optional): Multiplex the requests over HTTP/2 with httpx. Defaults to False.
 
     Returns:
-        requests.Session: A requests session object with established headers and cookies.
+        requests.Session or transport.HttpxSession: A session with established headers and cookies.
     
     Raises:
         Exception: If the initial request fails to establish the session.
     """
-    session = requests.Session()
-    session.headers.update(api_headers)
+    session = create_session(api_headers, pool_size=pool_size, http2=http2)
 
     # Optional: Make an initial request to establish a session and cookies
-    initial_request = session.get("https://www.ah.nl", headers=api_headers)
+    initial_request = session.get(base_url)
     if initial_request.status_code == 200:
         print("Session established and cookies set.")
     else:
@@ -102,111 +210,327 @@ def initialize_session(api_headers):
     return session
 
 
-def fetch_product_data(session, api_search_url, headers, product_id, json_dir, max_retries=500):
+def fetch_product_data(session, api_search_url, headers, product_id, product_store, max_retries=500, journal=None,
+                       incremental=None, lastmod=None, controller=None, metrics=None):
     """Fetch product data from the API and save it as a JSON file, with retry logic.
 
     This function sends a GET request to the specified API search URL to 
     retrieve product data. It implements retry logic for handling errors 
-    and saves the response data as a JSON file.
+    and saves the response data in the product store.
 
     Args:
         session (requests.Session): The session object to manage requests.
         api_search_url (str): The URL for the API endpoint to fetch product data.
-        headers (dict): The headers to include in the request.
+        headers (dict): Headers to send on top of the session headers, or None.
         product_id (str): The unique identifier for the product.
-        json_dir (str): The directory path where the JSON file will be saved.
+        product_store (JsonDirectoryStore or SnapshotDay): The store the product data is saved in.
         max_retries (int, optional): Maximum number of retry attempts. Defaults to 500.
+        journal (CrawlJournal, optional): Journal in which the outcome is recorded. Defaults to None.
+        incremental (IncrementalCrawl, optional): Previous run to send conditional requests
+            against. A 304 response carries the previous JSON forward. Defaults to None.
+        lastmod (str, optional): The <lastmod> of the product in the sitemap, recorded in
+            the journal. Defaults to None.
+        controller (AimdController, optional): Adaptive concurrency controller every response is
+            reported to. A 403 then pauses all workers for the controller's backoff instead of
+            FORBIDDEN_BACKOFF for this thread only. Defaults to None.
+        metrics (RunMetrics, optional): Receives every response, retry and the final failure.
+            Defaults to None.
 
     Returns:
         str: The product ID if the fetch is successful, None otherwise.
     """
+    if incremental is not None:
+        headers = {**(headers or {}), **incremental.conditional_headers(product_id)}
+
+    last_error = last_reason = None
     for attempt in range(max_retries):
+        if controller is not None:
+            controller.wait_if_paused()
+        started, request = time.monotonic(), None
         try:
-            request = session.get(api_search_url, headers=headers)
-
-            if request.status_code == 500:
-                return None
+            request = session.get(api_search_url, headers=headers or None)
+            latency = time.monotonic() - started
+            backoff = controller.record(request.status_code, latency) if controller else 0
+            if metrics is not None:
+                metrics.observe_request(request.status_code, latency, get_response_size(request))
+
+            if request.status_code == 304 and incremental is not None:
+                incremental.carry_forward(product_id, product_store, journal, lastmod)
+                time.sleep(random.uniform(*REQUEST_DELAY))
+                return product_id
+
+            elif request.status_code == 500:
+                last_error = last_reason = "HTTP 500"
+                break
             
             elif request.status_code == 403:
-                print(f"Access denied for product {product_id}. Retrying after 2 minute delay.")
-                time.sleep(120)  # Wait longer after a 403 error
+                if controller is not None:
+                    print(f"Access denied for product {product_id}. Pausing all workers for {backoff} seconds.")
+                    if metrics is not None:
+                        metrics.observe_retry("HTTP 403", backoff)
+                    continue  # The next attempt waits for the pause
+                print(f"Access denied for product {product_id}. Retrying after {FORBIDDEN_BACKOFF} seconds.")
+                if metrics is not None:
+                    metrics.observe_retry("HTTP 403", FORBIDDEN_BACKOFF)
+                time.sleep(FORBIDDEN_BACKOFF)  # Wait longer after a 403 error
                 continue  # Retry logic
 
             elif request.status_code == 404:
                 print(f"Error 404 for product {product_id}.")
-                return None
+                last_error = last_reason = "HTTP 404"
+                break
             
             request.raise_for_status()  
             data = request.json()
-            json_file_path = os.path.join(json_dir, f"{product_id}.json")
-            with open(json_file_path, 'w') as json_file:
-                json.dump(data, json_file)
-            time.sleep(1 + random.uniform(0.25, 0.50))
+            product_store.put(product_id, data)
+            if journal is not None:
+                journal.record(product_id, journal.DONE, lastmod=lastmod, etag=request.headers.get("ETag"),
+                               last_modified=request.headers.get("Last-Modified"))
+            time.sleep(random.uniform(*REQUEST_DELAY))
             return product_id  # Return the product ID on success
         
         except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            if controller is not None and request is None:
+                controller.record(None, time.monotonic() - started)  # No response at all
+            if metrics is not None:
+                if request is None:
+                    metrics.observe_request(None, time.monotonic() - started)
+                metrics.observe_retry(type(e).__name__, RETRY_DELAY)
             print(f"Error fetching product {product_id} on attempt {attempt + 1}: {e}")
-            time.sleep(2)  # Wait before retrying
+            last_error, last_reason = str(e), type(e).__name__
+            time.sleep(RETRY_DELAY)  # Wait before retrying
     
+    print(f"Failed to fetch product {product_id}: {last_error or 'HTTP 403'}.")
+    if metrics is not None:
+        metrics.observe_failure(product_id, last_reason or "HTTP 403", last_error or "HTTP 403")
+    if journal is not None:
+        journal.record(product_id, journal.FAILED, last_error or "HTTP 403")
     return None  # Return None if all attempts fail
 
 
-def scrape_products(session, xml_namespace, json_dir, product_urls, checkpoint):
+def iter_products_to_fetch(products, product_store, checkpoint=0, journal=None, incremental=None):
+    """Filter a stream of sitemap products down to those that have to be requested.
+
+    Products below the checkpoint and products the journal already has are
+    skipped, and unchanged products are carried forward from the previous
+    run. The stream is consumed lazily, one product at a time.
+
+    Args:
+        products (iterable): (product_id, lastmod) tuples, e.g. from iter_sitemap_products.
+        product_store (JsonDirectoryStore or SnapshotDay): The store the product data is saved in.
+        checkpoint (int, optional): The product ID threshold for skipping products. Defaults to 0.
+        journal (CrawlJournal, optional): Journal of the crawl. Defaults to None.
+        incremental (IncrementalCrawl, optional): Previous run to compare against. Defaults to None.
+
+    Yields:
+        tuple: (product_id, lastmod) of every product that has to be requested.
+    """
+    completed_ids = journal.completed_ids() if journal is not None else set()
+
+    for product_id, lastmod in products:
+        # SKIP PRODUCTS UP UNTIL THIS NUMBER
+        if int(product_id) < checkpoint:
+            continue
+
+        # SKIP PRODUCTS THE JOURNAL ALREADY HAS
+        if product_id in completed_ids:
+            continue
+
+        # CARRY FORWARD PRODUCTS THAT DID NOT CHANGE SINCE THE PREVIOUS RUN
+        if incremental is not None and incremental.is_unchanged(product_id, lastmod):
+            incremental.carry_forward(product_id, product_store, journal, lastmod)
+            continue
+
+        yield product_id, lastmod
+
+
+def scrape_products(session, product_store, products, checkpoint, journal=None, incremental=None,
+                    max_workers=10, max_pending=None, base_url=BASE_URL, controller=None, metrics=None,
+                    budget=None):
     """Scrape product data concurrently from the API.
 
     This function retrieves product data from the API using a thread pool
-    to handle multiple requests concurrently. It processes each product URL
-    and saves the resulting data to JSON files.
+    to handle multiple requests concurrently. It processes each product
+    and saves the resulting data in the product store. Products are
+    submitted from a bounded queue, so only max_pending futures exist at
+    any time and fetching starts while the sitemap is still being read.
 
     Args:
         session (requests.Session): The session object to manage requests.
-        xml_namespace (dict): The XML namespace used for parsing product URLs.
-        json_dir (str): The directory path where the JSON files will be saved.
-        product_urls (list): A list of product URL elements from the sitemap.
+        product_store (JsonDirectoryStore or SnapshotDay): The store the product data is saved in.
+        products (iterable): (product_id, lastmod) tuples, e.g. from iter_sitemap_products.
         checkpoint (int): The product ID threshold for skipping products.
+        journal (CrawlJournal, optional): Journal of the crawl. Products it records as
+            done are skipped and every outcome is written to it. Defaults to None.
+        incremental (IncrementalCrawl, optional): Previous run to compare against. Products
+            whose sitemap <lastmod> did not change are carried forward without a request.
+            Defaults to None.
+        max_workers (int, optional): Number of worker threads. Defaults to 10.
+        max_pending (int, optional): Maximum number of submitted, unfinished products.
+            Defaults to 4 * max_workers.
+        base_url (str, optional): The host to request the products from. Defaults to BASE_URL.
+        controller (AimdController, optional): Adaptive concurrency controller. The pool gets
+            controller.maximum threads, of which only controller.limit fetch at a time.
+            Defaults to None.
+        metrics (RunMetrics, optional): Receives every response, retry and failure. Defaults to None.
+        budget (CrawlBudget, optional): Stop submitting products once its requests or time are
+            used up; the products left over are collected in budget.skipped. Defaults to None.
     """
-    base_api_str = r"https://www.ah.nl/zoeken/api/products/product?webshopId="
-    product_id_pattern = "(?<=/wi)(\d+)"
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-        for url in product_urls:
-            product_url = url.find('ns:loc', xml_namespace).text
-            product_id = re.search(product_id_pattern, product_url).group()
-            api_search_url = base_api_str + product_id
-
-            # SKIP PRODUCTS UP UNTIL THIS NUMBER
-            if int(product_id) < checkpoint:
-                continue
-            
+    if controller is not None:
+        max_workers = controller.maximum
+    max_pending = max_pending or 4 * max_workers
+    progress = tqdm()
+
+    def fetch(product_id, lastmod):
+        api_search_url = base_url + PRODUCT_API_PATH + product_id
+        if controller is None:
+            return fetch_product_data(session, api_search_url, None, product_id, product_store,
+                                      journal=journal, incremental=incremental, lastmod=lastmod, metrics=metrics)
+        controller.acquire()
+        try:
+            return fetch_product_data(session, api_search_url, None, product_id, product_store,
+                                      journal=journal, incremental=incremental, lastmod=lastmod,
+                                      controller=controller, metrics=metrics)
+        finally:
+            controller.release()
+
+    def report(finished):
+        for future in finished:
+            future.result()  # Failures are reported by fetch_product_data, this raises unexpected errors
+        progress.update(len(finished))
+        if controller is not None:
+            state = controller.state()
+            progress.set_postfix(limit=state["limit"], error_rate=f"{state['error_rate']:.2f}")
+
+    products_to_fetch = iter_products_to_fetch(products, product_store, checkpoint, journal, incremental)
+    if budget is not None:
+        products_to_fetch = budget.limit(products_to_fetch)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for product_id, lastmod in products_to_fetch:
+            if len(pending) >= max_pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                report(finished)
+
             # Submit the fetch operation to the thread pool
-            futures.append(executor.submit(fetch_product_data, session, api_search_url, api_headers, product_id, json_dir))
+            pending.add(executor.submit(fetch, product_id, lastmod))
+
+        # Process the remaining results as they complete
+        report(wait(pending).done)
+    progress.close()
+
 
-        # Process results as they complete
-        for future in tqdm(as_completed(futures), total=len(futures)):
-            product_id = future.result()
-            if product_id is None:
-                print("Failed to fetch product data.")
+def carry_forward_skipped(product_ids, product_store):
+    """Fill in the products a crawl budget left out with their data from the previous run.
 
+    The products are not recorded in the journal, so running the crawl
+    again on the same day still fetches them.
 
-def collect_product_jsons(xml_headers, api_headers, checkpoint = 0):
+    Args:
+        product_ids (list): The product IDs that were not requested.
+        product_store (JsonDirectoryStore or SnapshotDay): Today's product store.
+    """
+    previous_store = product_store.previous()
+    carried = 0
+    if previous_store is not None:
+        for product_id in product_ids:
+            if previous_store.has(product_id):
+                product_store.carry_forward(previous_store, product_id)
+                carried += 1
+    print(f"{len(product_ids)} products were over the crawl budget: {carried} carried forward from "
+          f"{previous_store.date if previous_store is not None else 'no previous run'}, "
+          f"{len(product_ids) - carried} left without data.")
+
+
+def collect_product_jsons(xml_headers, api_headers, checkpoint = 0, fetch_mode="threads",
+                          requests_per_second=5.0, max_concurrency=10, incremental=False, storage="json",
+                          base_url=BASE_URL, product_store=None, http2=False, adaptive=False, metrics=None,
+                          priority=False, max_requests=None, max_seconds=None, date=None):
     """Main entry point for the product scraping script.
 
-    This function orchestrates the scraping process by creating the JSON 
-    directory, fetching the sitemap, parsing product URLs, initializing 
-    the session, and scraping the product data.
+    This function orchestrates the scraping process by opening today's
+    product store, streaming the sitemap, initializing the session, and
+    scraping the product data. Progress is recorded in a
+    crawl journal next to the product store, so running it again on the
+    same day only fetches the products that are missing or failed.
 
     Args:
         xml_headers (dict): The headers to include in the XML request.
         api_headers (dict): The headers to include in the API requests.
+        checkpoint (int, optional): The product ID threshold for skipping products. Defaults to 0.
+        fetch_mode (str, optional): "threads" for the thread pool scraper or "async" for the
+            asyncio scraper with a shared token-bucket rate limiter. Defaults to "threads".
+        requests_per_second (float, optional): Request rate shared by all async workers. Defaults to 5.0.
+        max_concurrency (int, optional): Maximum number of in-flight requests: worker threads and
+            pooled connections in threads mode, concurrent requests in async mode. Defaults to 10.
+        incremental (bool, optional): Only request products that changed since the most recent
+            previous run and carry the others forward from its product store. Defaults to False.
+        storage (str, optional): "json" for one JSON file per product in
+            json_collections/product_jsons_<date>/ or "snapshot" for the compressed,
+            content-addressed snapshot store. Defaults to "json".
+        base_url (str, optional): The host to scrape. Defaults to BASE_URL (the AH_BASE_URL
+            environment variable or https://www.ah.nl).
+        product_store (optional): Store to save the products in instead of the one selected by
+            storage, e.g. a fused_pipeline.StreamingCsvWriter. Stores without a journal_path
+            are crawled without a journal. Defaults to None.
+        http2 (bool, optional): Multiplex the threads mode requests over HTTP/2 with httpx.
+            Defaults to False.
+        adaptive (bool, optional): Adapt the concurrency to the server's error rate and latency
+            with an AimdController, with max_concurrency as the ceiling. Defaults to False.
+        metrics (RunMetrics, optional): Receives every response, retry and failure. Defaults to None.
+        priority (bool, optional): Fetch the products whose prices change most often first, scored
+            from the price history (see crawl_priority.score_products), instead of in sitemap
+            order. Defaults to False.
+        max_requests (int, optional): Request at most this many products. Defaults to None.
+        max_seconds (float, optional): Stop requesting products after this many seconds.
+            Defaults to None. Products left over by either budget are carried forward from the
+            previous run, so the day stays complete with the least volatile data the stalest.
+        date (str, optional): The date the product store of the crawl is named after, as
+            yyyy-mm-dd. Defaults to today.
     """
-    json_dir = create_json_directory()
-    sitemap_content = fetch_sitemap(xml_headers)
-    product_urls, xml_namespace = parse_product_urls(sitemap_content)
+    if product_store is None and storage == "json":
+        product_store = JsonDirectoryStore(create_json_directory(date))
+    elif product_store is None:
+        product_store = open_product_store(storage, date)
+    journal = CrawlJournal.for_store(product_store) if product_store.journal_path else None
+    incremental_crawl = IncrementalCrawl.from_previous_run(product_store) if incremental else None
+
+    # The sitemap is parsed while it downloads and products are fetched as they are parsed
+    products = iter_sitemap_products(xml_headers, base_url + SITEMAP_PATH)
+    if priority:
+        products = prioritize_products(products, load_priority_scores())
+    budget = CrawlBudget(max_requests, max_seconds) if max_requests is not None or max_seconds is not None else None
+    controller = AimdController(maximum=max_concurrency, max_backoff=FORBIDDEN_BACKOFF) if adaptive else None
+
+    if fetch_mode == "async":
+        from async_scrape import scrape_products_async
+        scrape_products_async(api_headers, product_store, products, checkpoint,
+                              requests_per_second=requests_per_second, max_concurrency=max_concurrency,
+                              journal=journal, incremental=incremental_crawl, base_url=base_url,
+                              controller=controller, metrics=metrics, budget=budget)
+    elif fetch_mode == "threads":
+        session = initialize_session(api_headers, base_url, pool_size=max_concurrency, http2=http2)
+        scrape_products(session, product_store, products, checkpoint, journal=journal,
+                        incremental=incremental_crawl, max_workers=max_concurrency, base_url=base_url,
+                        controller=controller, metrics=metrics, budget=budget)
+        print_connection_stats(get_connection_stats(session))
+        session.close()
+    else:
+        raise ValueError(f"Unknown fetch mode: {fetch_mode}")
+
+    if controller is not None:
+        print(f"Adaptive concurrency: {controller.state()}")
 
-    session = initialize_session(api_headers)
+    if budget is not None and budget.skipped:
+        carry_forward_skipped(budget.skipped, product_store)
 
-    scrape_products(session, xml_namespace, json_dir, product_urls, checkpoint)
+    if journal is not None:
+        failures = journal.failures()
+        if failures:
+            print(f"{len(failures)} products failed, run again to retry them.")
+        journal.close()
+    product_store.close()
 
 
 if __name__ == "__main__":
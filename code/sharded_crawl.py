@@ -0,0 +1,380 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from multiprocessing import Process
+from header_objects import api_headers, xml_headers
+from crawl_journal import CrawlJournal
+from product_store import JsonDirectoryStore, open_product_store, get_project_root
+from scrape_data import BASE_URL, SITEMAP_PATH, iter_sitemap_products, initialize_session, scrape_products
+
+
+def get_crawl_dir(date=None):
+    """Return the working directory of the sharded crawl of a date, json_collections/crawl_<date>/.
+
+    It holds the work queue (queue.sqlite) and one worker-<id>/ directory per worker.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+    """
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    crawl_dir = os.path.join(get_project_root(), "json_collections", f"crawl_{date}")
+    os.makedirs(crawl_dir, exist_ok=True)
+    return crawl_dir
+
+
+class WorkQueue:
+    """Shards of product IDs leased to crawl workers through a SQLite database.
+
+    A worker leases the next pending shard for lease_seconds and renews the
+    lease while it works on it. If a worker dies its lease expires and the
+    shard is leased to the next worker that asks, so every shard is crawled
+    even when workers are lost. Leasing runs in an IMMEDIATE transaction,
+    which lets any number of processes use the same queue without handing
+    out a shard twice.
+
+    This relies on SQLite's file locking, so the queue file must be on a
+    local filesystem and all workers on the same host. Locking over NFS or
+    SMB is unreliable and can lease a shard to two workers at once; spread
+    a crawl over several hosts with a queue server instead.
+
+    Args:
+        queue_path (str): The path of the SQLite queue file.
+    """
+
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+
+    def __init__(self, queue_path):
+        self.queue_path = queue_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(queue_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS shards (
+                shard_id INTEGER PRIMARY KEY,
+                products TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                leases INTEGER NOT NULL DEFAULT 0,
+                completed_at TEXT
+            )"""
+        )
+
+    def add_shards(self, products, shard_size=500):
+        """Split a stream of products into shards and queue them.
+
+        Args:
+            products (iterable): (product_id, lastmod) tuples, e.g. from iter_sitemap_products.
+            shard_size (int, optional): Number of products per shard. Defaults to 500.
+
+        Returns:
+            int: The number of shards added.
+        """
+        shards, shard = [], []
+        for product in products:
+            shard.append(list(product))
+            if len(shard) >= shard_size:
+                shards.append(shard)
+                shard = []
+        if shard:
+            shards.append(shard)
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany("INSERT INTO shards (products, status) VALUES (?, ?)",
+                                        [(json.dumps(shard), self.PENDING) for shard in shards])
+            self.connection.execute("COMMIT")
+        return len(shards)
+
+    def lease(self, worker_id, lease_seconds=600):
+        """Lease the next pending shard, or a shard whose lease expired.
+
+        Args:
+            worker_id (str): The ID of the leasing worker.
+            lease_seconds (float, optional): How long the lease lasts without renewal. Defaults to 600.
+
+        Returns:
+            tuple: (shard_id, products) with products a list of (product_id, lastmod) tuples,
+                or None if no shard is available right now.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    """SELECT shard_id, products FROM shards
+                       WHERE status = ? OR (status = ? AND lease_expires < ?)
+                       ORDER BY shard_id LIMIT 1""", (self.PENDING, self.LEASED, now)).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE shards SET status = ?, worker = ?, lease_expires = ?, leases = leases + 1 "
+                        "WHERE shard_id = ?", (self.LEASED, worker_id, now + lease_seconds, row[0]))
+            finally:
+                self.connection.execute("COMMIT")
+        if row is None:
+            return None
+        shard_id, products = row
+        return shard_id, [tuple(product) for product in json.loads(products)]
+
+    def renew(self, shard_id, worker_id, lease_seconds=600):
+        """Extend the lease of a shard.
+
+        Returns:
+            bool: False if the worker no longer holds the lease.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE shards SET lease_expires = ? WHERE shard_id = ? AND worker = ? AND status = ?",
+                (time.time() + lease_seconds, shard_id, worker_id, self.LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, shard_id, worker_id):
+        """Mark a shard as done. A shard is also accepted from a worker whose lease had expired."""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE shards SET status = ?, worker = ?, completed_at = ? WHERE shard_id = ? AND status != ?",
+                (self.DONE, worker_id, datetime.now().isoformat(timespec="seconds"), shard_id, self.DONE))
+
+    def counts(self):
+        """Return the number of shards per status; expired leases are counted as "expired"."""
+        with self.lock:
+            rows = self.connection.execute(
+                """SELECT CASE WHEN status = ? AND lease_expires < ? THEN 'expired' ELSE status END, COUNT(*)
+                   FROM shards GROUP BY 1""", (self.LEASED, time.time())).fetchall()
+        return dict(rows)
+
+    def is_empty(self):
+        return not self.counts()
+
+    def is_finished(self):
+        counts = self.counts()
+        return bool(counts) and set(counts) == {self.DONE}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class LeaseHeartbeat:
+    """Renews the lease of a shard from a background thread until stopped."""
+
+    def __init__(self, queue, shard_id, worker_id, lease_seconds):
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(queue, shard_id, worker_id, lease_seconds),
+                                       daemon=True)
+        self.thread.start()
+
+    def _run(self, queue, shard_id, worker_id, lease_seconds):
+        while not self.stopped.wait(lease_seconds / 3):
+            if not queue.renew(shard_id, worker_id, lease_seconds):
+                print(f"Lost the lease of shard {shard_id}, another worker may crawl it too.")
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def create_crawl(date=None, base_url=BASE_URL, shard_size=500):
+    """Queue the shards of a sharded crawl from the sitemap, the coordinator's first step.
+
+    Calling it again for a date whose queue already has shards does nothing,
+    so a coordinator can be restarted safely.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+        base_url (str, optional): The host to read the sitemap from. Defaults to BASE_URL.
+        shard_size (int, optional): Number of products per shard. Defaults to 500.
+
+    Returns:
+        str: The crawl directory.
+    """
+    crawl_dir = get_crawl_dir(date)
+    queue = WorkQueue(os.path.join(crawl_dir, "queue.sqlite"))
+    if queue.is_empty():
+        shard_count = queue.add_shards(iter_sitemap_products(xml_headers, base_url + SITEMAP_PATH), shard_size)
+        print(f"Queued {shard_count} shards of up to {shard_size} products in {crawl_dir}.")
+    else:
+        print(f"The crawl in {crawl_dir} is already queued: {queue.counts()}.")
+    queue.close()
+    return crawl_dir
+
+
+def run_worker(crawl_dir, worker_id=None, base_url=BASE_URL, max_workers=10, lease_seconds=600,
+               poll_interval=10, http2=False):
+    """Lease shards from the crawl's queue and crawl them until every shard is done.
+
+    The products are saved in the worker's own store,
+    <crawl_dir>/worker-<id>/product_jsons_<date>/, with its own crawl journal,
+    so workers never write to the same files. A worker
+    restarted with the same ID skips the products its journal already has.
+
+    Args:
+        crawl_dir (str): The crawl directory made by create_crawl, on a local filesystem (see WorkQueue).
+        worker_id (str, optional): A unique worker ID. Defaults to <hostname>-<pid>.
+        base_url (str, optional): The host to scrape. Defaults to BASE_URL.
+        max_workers (int, optional): Number of threads of this worker. Defaults to 10.
+        lease_seconds (float, optional): Lease duration, renewed every third of it. Defaults to 600.
+        poll_interval (float, optional): Seconds to wait for leases of other workers to finish
+            or expire when no shard is available. Defaults to 10.
+        http2 (bool, optional): Multiplex the requests over HTTP/2 with httpx. Defaults to False.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    date = os.path.basename(os.path.normpath(crawl_dir))[len("crawl_"):]
+    queue = WorkQueue(os.path.join(crawl_dir, "queue.sqlite"))
+    store = JsonDirectoryStore(os.path.join(crawl_dir, f"worker-{worker_id}", f"product_jsons_{date}"))
+    os.makedirs(store.json_dir, exist_ok=True)
+    journal = CrawlJournal.for_store(store)
+    session = initialize_session(api_headers, base_url, pool_size=max_workers, http2=http2)
+
+    shards_done = 0
+    while True:
+        leased = queue.lease(worker_id, lease_seconds)
+        if leased is None:
+            if queue.is_finished():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        shard_id, products = leased
+        print(f"Worker {worker_id} crawls shard {shard_id} ({len(products)} products).")
+        heartbeat = LeaseHeartbeat(queue, shard_id, worker_id, lease_seconds)
+        try:
+            scrape_products(session, store, products, 0, journal=journal, max_workers=max_workers,
+                            base_url=base_url)
+        finally:
+            heartbeat.stop()
+        queue.complete(shard_id, worker_id)
+        shards_done += 1
+
+    print(f"Worker {worker_id} finished after {shards_done} shards.")
+    session.close()
+    journal.close()
+    store.close()
+    queue.close()
+
+
+def merge_worker_stores(crawl_dir, product_store):
+    """Merge the stores and journals of all workers of a crawl into one dated product store.
+
+    Products crawled by more than one worker (after a lease expired) are
+    taken once. The validators of every product go into the journal of
+    product_store, so the next day's incremental crawl can use them, and
+    products that failed on every worker are recorded as failed.
+
+    Args:
+        crawl_dir (str): The crawl directory made by create_crawl, on a local filesystem (see WorkQueue).
+        product_store (JsonDirectoryStore or SnapshotDay): The store of the day to merge into.
+
+    Returns:
+        int: The number of products merged.
+    """
+    date = os.path.basename(os.path.normpath(crawl_dir))[len("crawl_"):]
+    journal = CrawlJournal(product_store.journal_path) if product_store.journal_path else None
+    merged, failures = 0, {}
+
+    for worker_dir in sorted(os.listdir(crawl_dir)):
+        worker_json_dir = os.path.join(crawl_dir, worker_dir, f"product_jsons_{date}")
+        if not worker_dir.startswith("worker-") or not os.path.isdir(worker_json_dir):
+            continue
+        worker_store = JsonDirectoryStore(worker_json_dir)
+        for product_id in worker_store.product_ids():
+            if product_store.has(product_id):
+                continue
+            if isinstance(product_store, JsonDirectoryStore):
+                product_store.carry_forward(worker_store, product_id)  # Hardlink, no copy
+            else:
+                product_store.put(product_id, worker_store.load(product_id))
+            merged += 1
+
+        worker_journal = CrawlJournal(worker_store.journal_path)
+        if journal is not None:
+            journal.import_manifest(worker_journal.manifest())
+        for product_id, attempts, last_error in worker_journal.failures():
+            failures[str(product_id)] = last_error
+        worker_journal.close()
+
+    if journal is not None:
+        completed = journal.completed_ids()
+        for product_id, last_error in failures.items():
+            if product_id not in completed:
+                journal.record(product_id, journal.FAILED, last_error)
+        journal.close()
+
+    failed = len(failures.keys() - set(product_store.product_ids()))
+    print(f"Merged {merged} products into {product_store}" + (f", {failed} failed on every worker." if failed else "."))
+    product_store.close()
+    return merged
+
+
+def run_local_crawl(workers=4, date=None, storage="json", base_url=BASE_URL, shard_size=500, threads_per_worker=2,
+                    lease_seconds=600):
+    """Run a whole sharded crawl on this machine: queue, worker processes and merge.
+
+    Args:
+        workers (int, optional): Number of worker processes. Defaults to 4.
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+        storage (str, optional): "json" or "snapshot", see product_store.open_product_store.
+            Defaults to "json".
+        base_url (str, optional): The host to scrape. Defaults to BASE_URL.
+        shard_size (int, optional): Number of products per shard. Defaults to 500.
+        threads_per_worker (int, optional): Threads of each worker process. Defaults to 2.
+        lease_seconds (float, optional): Lease duration. Defaults to 600.
+
+    Returns:
+        JsonDirectoryStore or SnapshotDay: The merged store of the day.
+    """
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    crawl_dir = create_crawl(date, base_url, shard_size)
+
+    processes = [Process(target=run_worker, args=(crawl_dir, f"local{index}", base_url, threads_per_worker,
+                                                  lease_seconds, 1))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    product_store = open_product_store(storage, date)
+    if storage == "json":
+        os.makedirs(product_store.json_dir, exist_ok=True)
+    merge_worker_stores(crawl_dir, product_store)
+    return open_product_store(storage, date)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Crawl the catalogue with several worker processes on this host "
+                                                 "sharing a work queue on the local filesystem.")
+    parser.add_argument("command", choices=["coordinator", "worker", "merge", "local"],
+                        help="coordinator: queue the shards; worker: crawl shards until all are done; "
+                             "merge: merge the workers' output; local: all of it with worker processes")
+    parser.add_argument("--date", help="the crawl date as yyyy-mm-dd (default: today)")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--storage", choices=["json", "snapshot"], default="json")
+    parser.add_argument("--shard-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4, help="worker processes of the local command")
+    parser.add_argument("--threads", type=int, default=2, help="threads per worker")
+    parser.add_argument("--worker-id", help="unique worker ID (default: <hostname>-<pid>)")
+    parser.add_argument("--lease-seconds", type=float, default=600)
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        create_crawl(args.date, args.base_url, args.shard_size)
+    elif args.command == "worker":
+        run_worker(get_crawl_dir(args.date), args.worker_id, args.base_url, args.threads, args.lease_seconds)
+    elif args.command == "merge":
+        store = open_product_store(args.storage, args.date)
+        if args.storage == "json":
+            os.makedirs(store.json_dir, exist_ok=True)
+        merge_worker_stores(get_crawl_dir(args.date), store)
+    else:
+        run_local_crawl(args.workers, args.date, args.storage, args.base_url, args.shard_size, args.threads,
+                        args.lease_seconds)
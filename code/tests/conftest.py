@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scrape_data
+from mock_ah_server import MockAHServer
+from product_store import JsonDirectoryStore
+
+
+@pytest.fixture(autouse=True)
+def no_delays(monkeypatch):
+    """Scrape without the politeness delays between requests."""
+    monkeypatch.setattr(scrape_data, "REQUEST_DELAY", (0, 0))
+    monkeypatch.setattr(scrape_data, "RETRY_DELAY", 0)
+    monkeypatch.setattr(scrape_data, "FORBIDDEN_BACKOFF", 0)
+
+
+@pytest.fixture
+def mock_server():
+    """Start mock AH servers with the given options and stop them after the test."""
+    servers = []
+
+    def start(**options):
+        options.setdefault("latency", 0)
+        options.setdefault("jitter", 0)
+        servers.append(MockAHServer(**options).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def json_store(tmp_path):
+    """Return a factory of empty JSON directory stores for a date under tmp_path."""
+    def make(date="2024-01-01"):
+        store = JsonDirectoryStore(os.path.join(tmp_path, "json_collections", f"product_jsons_{date}"))
+        os.makedirs(store.json_dir, exist_ok=True)
+        return store
+
+    return make
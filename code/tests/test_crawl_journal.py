@@ -0,0 +1,75 @@
+import threading
+
+from crawl_journal import CrawlJournal, get_failed_ids
+from header_objects import api_headers
+from scrape_data import initialize_session, scrape_products
+
+
+def crawl(server, store, products, journal):
+    session = initialize_session(api_headers, server.base_url, pool_size=4)
+    try:
+        scrape_products(session, store, products, 0, journal=journal, max_workers=4, base_url=server.base_url)
+    finally:
+        session.close()
+
+
+def test_journal_records_every_outcome(mock_server, json_store):
+    server = mock_server(products=30)
+    store = json_store()
+    journal = CrawlJournal.for_store(store)
+    # Products 31 to 35 are not in the catalogue and answer 404
+    products = [(str(product_id), "2024-01-01") for product_id in range(1, 36)]
+
+    crawl(server, store, products, journal)
+
+    assert journal.completed_ids() == set(store.product_ids()) == {str(i) for i in range(1, 31)}
+    assert journal.failures() == [(product_id, 1, "HTTP 404") for product_id in range(31, 36)]
+    assert journal.manifest()["1"].etag is not None
+    journal.close()
+    assert get_failed_ids(store) == {str(i) for i in range(31, 36)}
+
+
+def test_resume_requests_only_pending_products(mock_server, json_store):
+    server = mock_server(products=40, rate_500=0.3, seed=1)
+    store = json_store()
+    journal = CrawlJournal.for_store(store)
+    products = [(str(product_id), None) for product_id in range(1, 41)]
+
+    crawl(server, store, products, journal)
+    failed = {str(product_id) for product_id, _, _ in journal.failures()}
+    assert failed, "the mock server should have failed some products"
+    assert failed | journal.completed_ids() == {product_id for product_id, _ in products}
+    journal.close()
+
+    # A restarted run opens the journal again and only asks for what failed
+    server.rate_500 = 0
+    server.reset_stats()
+    journal = CrawlJournal.for_store(store)
+    assert set(journal.pending(product_id for product_id, _ in products)) == failed
+    crawl(server, store, products, journal)
+
+    assert set(server.product_requests) == failed
+    assert journal.failures() == []
+    assert len(store.product_ids()) == 40
+    journal.close()
+
+
+def test_concurrent_records_from_many_threads(tmp_path):
+    journal = CrawlJournal(str(tmp_path / "journal.sqlite"))
+
+    def record(thread):
+        for product_id in range(thread * 100, thread * 100 + 100):
+            journal.record(str(product_id), journal.DONE, lastmod="2024-01-01")
+            journal.record(str(product_id), journal.FAILED if product_id % 10 == 0 else journal.DONE)
+
+    threads = [threading.Thread(target=record, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failures = journal.failures()
+    assert len(journal.completed_ids()) + len(failures) == 800
+    assert len(failures) == 80
+    assert {attempts for _, attempts, _ in failures} == {2}
+    journal.close()
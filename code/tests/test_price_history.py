@@ -0,0 +1,71 @@
+from crawl_journal import CrawlJournal
+from header_objects import api_headers
+from mock_ah_server import make_product_json
+from price_history import PriceHistory, update_price_history
+from scrape_data import initialize_session, scrape_products
+from write_csv_from_jsons import get_product_prices
+
+
+def test_intervals_follow_changes_delistings_and_failures(tmp_path):
+    history = PriceHistory(str(tmp_path / "price_history.sqlite"))
+
+    assert history.update("2024-01-01", [(1, 2.0, None), (2, 3.0, None), (3, 4.0, None)]) == 3
+    # 1 goes on sale, 2 is unchanged, 3 failed to fetch and 4 appears
+    assert history.update("2024-01-02", [(1, 2.0, 1.5), (2, 3.0, None), (4, 1.0, None)], failed_ids=["3"]) == 2
+    # 1 is delisted and 3 is back with its old prices
+    assert history.update("2024-01-03", [(2, 3.0, None), (3, 4.0, None), (4, 1.0, None)]) == 1
+    assert history.update("2024-01-04", [(1, 2.0, None), (2, 3.0, None), (3, 4.0, None), (4, 1.0, None)]) == 1
+
+    assert history.history(1) == [("2024-01-01", "2024-01-02", 2.0, None),
+                                  ("2024-01-02", "2024-01-03", 2.0, 1.5),
+                                  ("2024-01-04", None, 2.0, None)]
+    assert history.history(2) == [("2024-01-01", None, 3.0, None)]
+    assert history.history(3) == [("2024-01-01", None, 4.0, None)]
+    assert history.prices_on("2024-01-02") == [(1, 2.0, 1.5), (2, 3.0, None), (3, 4.0, None), (4, 1.0, None)]
+    assert history.prices_on("2024-01-03") == [(2, 3.0, None), (3, 4.0, None), (4, 1.0, None)]
+    assert history.on_sale("2024-01-02") == [(1, 2.0, 1.5)]
+    assert history.update("2024-01-04", []) == 0
+    history.close()
+
+
+def crawl_day(server, store, product_ids):
+    journal = CrawlJournal.for_store(store)
+    session = initialize_session(api_headers, server.base_url, pool_size=4)
+    products = [(str(product_id), None) for product_id in product_ids]
+    scrape_products(session, store, products, 0, journal=journal, max_workers=4, base_url=server.base_url)
+    session.close()
+    return journal
+
+
+def expected_prices(product_id, seed):
+    regular, sale = get_product_prices(make_product_json(product_id, seed))
+    return float(regular), None if sale == "NA" else float(sale)
+
+
+def test_daily_crawls_of_the_mock_server(mock_server, json_store, tmp_path):
+    db_path = str(tmp_path / "price_history.sqlite")
+    server = mock_server(products=60, seed=0)
+    store = json_store("2024-01-01")
+    crawl_day(server, store, range(1, 61)).close()
+    update_price_history(store, db_path)
+
+    # The next day prices change with the seed, 59 and 60 are delisted and 7 fails
+    server.seed = 1
+    store = json_store("2024-01-02")
+    journal = crawl_day(server, store, [product_id for product_id in range(1, 59) if product_id != 7])
+    journal.record("7", journal.FAILED, "HTTP 500")
+    journal.close()
+    update_price_history(store, db_path)
+
+    history = PriceHistory(db_path)
+    changed = [product_id for product_id in range(1, 59)
+               if product_id != 7 and expected_prices(product_id, 0) != expected_prices(product_id, 1)]
+    assert changed, "the seed should change the sale prices of some products"
+    for product_id in changed:
+        assert history.history(product_id) == [("2024-01-01", "2024-01-02", *expected_prices(product_id, 0)),
+                                               ("2024-01-02", None, *expected_prices(product_id, 1))]
+    assert history.history(7) == [("2024-01-01", None, *expected_prices(7, 0))]
+    assert history.history(60) == [("2024-01-01", "2024-01-02", *expected_prices(60, 0))]
+    assert history.prices_on("2024-01-02") == [
+        (product_id, *expected_prices(product_id, 0 if product_id == 7 else 1)) for product_id in range(1, 59)]
+    history.close()
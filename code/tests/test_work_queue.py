@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+
+import sharded_crawl
+from crawl_journal import CrawlJournal
+from sharded_crawl import WorkQueue, LeaseHeartbeat, create_crawl, run_worker, merge_worker_stores
+
+
+def make_queue(tmp_path, product_count=10, shard_size=5):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.add_shards(((str(product_id), None) for product_id in range(1, product_count + 1)), shard_size)
+    return queue
+
+
+def test_expired_lease_goes_to_another_worker(tmp_path):
+    queue = make_queue(tmp_path, product_count=5)
+
+    shard_id, products = queue.lease("a", lease_seconds=0.2)
+    assert products == [(str(product_id), None) for product_id in range(1, 6)]
+    assert queue.lease("b", lease_seconds=0.2) is None
+
+    time.sleep(0.3)
+    assert queue.counts() == {"expired": 1}
+    assert queue.lease("b", lease_seconds=60)[0] == shard_id
+    assert not queue.renew(shard_id, "a", lease_seconds=60)
+
+    # The late worker may still finish the shard, it is done once
+    queue.complete(shard_id, "a")
+    queue.complete(shard_id, "b")
+    assert queue.is_finished()
+    queue.close()
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = make_queue(tmp_path, product_count=5)
+    shard_id, _ = queue.lease("a", lease_seconds=0.3)
+
+    heartbeat = LeaseHeartbeat(queue, shard_id, "a", lease_seconds=0.3)
+    time.sleep(1.0)
+    assert queue.lease("b", lease_seconds=60) is None
+    assert queue.counts() == {WorkQueue.LEASED: 1}
+    heartbeat.stop()
+
+    time.sleep(0.4)
+    assert queue.lease("b", lease_seconds=60)[0] == shard_id
+    queue.close()
+
+
+def test_concurrent_workers_never_share_a_shard(tmp_path):
+    make_queue(tmp_path, product_count=200, shard_size=2).close()
+    leased, lock = [], threading.Lock()
+
+    def work(worker_id):
+        queue = WorkQueue(str(tmp_path / "queue.sqlite"))  # Own connection, like a worker process
+        while (shard := queue.lease(worker_id, lease_seconds=60)) is not None:
+            with lock:
+                leased.append(shard[0])
+            queue.complete(shard[0], worker_id)
+        queue.close()
+
+    threads = [threading.Thread(target=work, args=(f"worker-{number}",)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(leased) == list(range(1, 101))
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    assert queue.is_finished()
+    queue.close()
+
+
+def test_workers_crawl_and_merge_every_product(mock_server, json_store, tmp_path, monkeypatch):
+    server = mock_server(products=45)
+    monkeypatch.setattr(sharded_crawl, "get_project_root", lambda: str(tmp_path))
+    crawl_dir = create_crawl("2024-01-01", base_url=server.base_url, shard_size=10)
+    assert create_crawl("2024-01-01", base_url=server.base_url, shard_size=10) == crawl_dir
+
+    workers = [threading.Thread(target=run_worker, args=(crawl_dir, f"w{number}", server.base_url),
+                                kwargs={"max_workers": 2, "lease_seconds": 30, "poll_interval": 0.1})
+               for number in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    queue = WorkQueue(os.path.join(crawl_dir, "queue.sqlite"))
+    assert queue.counts() == {WorkQueue.DONE: 5}
+    queue.close()
+
+    store = json_store("2024-01-01")
+    assert merge_worker_stores(crawl_dir, store) == 45
+    assert store.product_ids() == [str(product_id) for product_id in range(1, 46)]
+    journal = CrawlJournal(store.journal_path)
+    assert len(journal.manifest()) == 45
+    journal.close()
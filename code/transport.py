@@ -0,0 +1,255 @@
+import threading
+from collections import Counter
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def module_available(name):
+    """Return True if the optional module can be imported."""
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+def supported_encodings(client="requests"):
+    """Return the content codings an HTTP client library can decode in this environment.
+
+    Brotli and zstd support depends on optional packages and differs per
+    library and version, so each library is asked itself.
+
+    Args:
+        client (str, optional): "requests", "httpx" or "aiohttp". Defaults to "requests".
+
+    Returns:
+        set: The decodable codings, e.g. {"identity", "gzip", "deflate", "br"}.
+    """
+    encodings = {"identity", "gzip", "deflate"}
+    if client == "requests":
+        from urllib3.util.request import ACCEPT_ENCODING
+        encodings.update(coding.strip() for coding in ACCEPT_ENCODING.split(","))
+    elif client == "httpx":
+        # httpx decodes br with brotli or brotlicffi and, from 0.27.1 on, zstd with zstandard
+        if any(module_available(name) for name in ("brotli", "brotlicffi")):
+            encodings.add("br")
+        if module_available("zstandard"):
+            encodings.add("zstd")
+    elif client == "aiohttp":
+        from aiohttp import compression_utils
+        if compression_utils.HAS_BROTLI:
+            encodings.add("br")
+        if getattr(compression_utils, "HAS_ZSTD", False):
+            encodings.add("zstd")
+    else:
+        raise ValueError(f"Unknown HTTP client: {client}")
+    return encodings
+
+
+def negotiate_headers(headers, client="requests"):
+    """Drop the codings from accept-encoding that the client cannot decode.
+
+    header_objects.api_headers advertises "gzip, deflate, br, zstd" like a
+    browser. If the server picks a coding the client library has no decoder
+    for, the body arrives compressed and fails to parse as JSON, so such
+    codings are not advertised.
+
+    Args:
+        headers (dict): The request headers.
+        client (str, optional): The HTTP client library, see supported_encodings. Defaults to "requests".
+
+    Returns:
+        dict: A copy of headers with a decodable accept-encoding.
+    """
+    headers = dict(headers)
+    for name in list(headers):
+        if name.lower() == "accept-encoding":
+            supported = supported_encodings(client)
+            wanted = [coding.strip() for coding in headers[name].split(",")]
+            usable = [coding for coding in wanted if coding.split(";")[0].strip() in supported]
+            if len(usable) < len(wanted):
+                dropped = ", ".join(coding for coding in wanted if coding not in usable)
+                print(f"Not advertising {dropped}: {client} cannot decode it here.")
+            headers[name] = ", ".join(usable)
+    return headers
+
+
+class ConnectionStats:
+    """Thread-safe count of requests and newly opened connections per host."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.connections = {}
+
+    def add(self, host, requests=0, connections=0):
+        with self.lock:
+            self.requests[host] = self.requests.get(host, 0) + requests
+            self.connections[host] = self.connections.get(host, 0) + connections
+
+    def report(self):
+        """Return a list of {host, connections, requests, requests_per_connection} dicts."""
+        with self.lock:
+            return [{
+                "host": host,
+                "connections": self.connections.get(host, 0),
+                "requests": count,
+                "requests_per_connection": count / max(1, self.connections.get(host, 0)),
+            } for host, count in sorted(self.requests.items())]
+
+
+def get_connection_stats(session):
+    """Return connection reuse statistics of a session created by create_session.
+
+    For requests sessions the counters of urllib3's connection pools are used,
+    for HTTP/2 sessions the counts collected by HttpxSession.
+
+    Args:
+        session (requests.Session or HttpxSession): The session.
+
+    Returns:
+        list: {host, connections, requests, requests_per_connection} dicts, one per host.
+    """
+    if isinstance(session, HttpxSession):
+        return session.stats.report()
+
+    stats = ConnectionStats()
+    # create_session mounts the same adapter for http:// and https://
+    for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats.add(f"{pool.scheme}://{pool.host}:{pool.port}", pool.num_requests, pool.num_connections)
+    return stats.report()
+
+
+def print_connection_stats(stats):
+    for host_stats in stats:
+        print(f"{host_stats['host']}: {host_stats['requests']} requests over {host_stats['connections']} "
+              f"connections ({host_stats['requests_per_connection']:.1f} requests per connection)")
+
+
+def get_response_size(response):
+    """Return the number of body bytes a response took on the wire, before decoding.
+
+    Args:
+        response (requests.Response or HttpxResponse): A response whose body has been read.
+
+    Returns:
+        int: The number of bytes received.
+    """
+    if isinstance(response, HttpxResponse):
+        return response.response.num_bytes_downloaded
+    try:
+        return response.raw.tell()
+    except (AttributeError, OSError):
+        return len(response.content)
+
+
+class HttpxResponse:
+    """The part of the requests.Response interface the scrapers use, on top of an httpx response."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+
+    def json(self):
+        return self.response.json()
+
+    def raise_for_status(self):
+        if self.response.is_error:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error for {self.response.url}", response=self)
+
+
+class HttpxSession:
+    """HTTP/2 capable session with the get() interface of requests.Session.
+
+    Requests to the same host are multiplexed over a small number of HTTP/2
+    connections. Transport errors are raised as requests exceptions so the
+    scrapers' retry logic handles both session types the same way.
+
+    Args:
+        headers (dict): The headers to send with every request.
+        pool_size (int): Maximum number of connections.
+        keepalive_expiry (float): Seconds an idle connection is kept open.
+    """
+
+    def __init__(self, headers, pool_size, keepalive_expiry):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("HTTP/2 requires httpx with the http2 extra (pip install 'httpx[http2]').") from e
+
+        self.httpx = httpx
+        self.stats = ConnectionStats()
+        # httpx silently falls back to HTTP/1.1 (e.g. for plain http:// URLs), so the versions
+        # actually spoken are counted
+        self.http_versions = Counter()
+        self.client = httpx.Client(
+            http2=True,
+            headers=headers,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(30.0),
+        )
+
+    @property
+    def headers(self):
+        return self.client.headers
+
+    def get(self, url, headers=None, **kwargs):
+        parsed_url = self.httpx.URL(url)
+        port = parsed_url.port or (443 if parsed_url.scheme == "https" else 80)
+        host = f"{parsed_url.scheme}://{parsed_url.host}:{port}"
+
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                self.stats.add(host, connections=1)
+
+        try:
+            response = self.client.get(url, headers=headers, extensions={"trace": trace}, **kwargs)
+        except self.httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        self.stats.add(host, requests=1)
+        self.http_versions[response.http_version] += 1
+        return HttpxResponse(response)
+
+    def close(self):
+        self.client.close()
+
+
+def create_session(headers, pool_size=10, http2=False, keepalive_expiry=60.0):
+    """Create the HTTP session shared by all scraper threads.
+
+    The connection pool is sized to the number of workers so that no thread
+    has to open a throwaway connection, and pool_block makes threads wait
+    for a free connection instead. With http2=True an httpx client is used
+    that multiplexes requests over HTTP/2.
+
+    Args:
+        headers (dict): The headers to send with every request.
+        pool_size (int, optional): Maximum number of pooled connections; match the worker count.
+            Defaults to 10.
+        http2 (bool, optional): Use HTTP/2 through httpx. Defaults to False.
+        keepalive_expiry (float, optional): Seconds an idle HTTP/2 connection is kept open.
+            Defaults to 60.
+
+    Returns:
+        requests.Session or HttpxSession: The session.
+    """
+    headers = negotiate_headers(headers, "httpx" if http2 else "requests")
+    if http2:
+        return HttpxSession(headers, pool_size, keepalive_expiry)
+
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,179 @@
+from typing import Annotated, Any, Optional, Union
+from nutrient_list import nutrition_labels
+from nutrient_parser import parse_dense_nutrient_rows
+
+try:
+    import msgspec
+    from msgspec import UNSET, UnsetType
+except ImportError as e:
+    raise ImportError("The typed product decoder requires msgspec (pip install msgspec).") from e
+
+
+# Only the fields the extractors read are declared; msgspec skips everything else while
+# decoding. Structs are created with gc=False since they never form reference cycles.
+# UNSET marks a missing key, which the dict extractors treat differently from null.
+
+class Price(msgspec.Struct, gc=False):
+    now: Union[Any, UnsetType] = UNSET
+    was: Union[Any, UnsetType] = UNSET
+    unitSize: Union[Optional[str], UnsetType] = UNSET
+
+
+class Taxonomy(msgspec.Struct, gc=False):
+    name: str
+
+
+class Image(msgspec.Struct, gc=False):
+    url: str
+
+
+class Product(msgspec.Struct, gc=False):
+    id: int
+    title: str
+    price: Price
+    taxonomies: list[Taxonomy]
+    images: list[Image]
+
+
+class Allergens(msgspec.Struct, gc=False):
+    contains: list[str] = []
+    mayContain: list[str] = []
+
+
+class Ingredients(msgspec.Struct, gc=False):
+    statement: Union[Optional[str], UnsetType] = UNSET
+    allergens: Union[Optional[Allergens], UnsetType] = UNSET
+    nonfoodIngredientStatement: Union[Optional[str], UnsetType] = UNSET
+
+
+class Meta(msgspec.Struct, gc=False):
+    # Nutrition tables come in many shapes (null values, numbers, tables without nutrients),
+    # so they are decoded as plain objects and a bad one only blanks the nutrient columns
+    nutritions: Any = None
+    ingredients: Optional[Ingredients] = None
+
+
+class Card(msgspec.Struct, gc=False):
+    products: Annotated[list[Product], msgspec.Meta(min_length=1)]
+    meta: Optional[Meta] = None
+
+
+class ProductPayload(msgspec.Struct, gc=False):
+    card: Card
+
+
+PRODUCT_DECODER = msgspec.json.Decoder(ProductPayload)
+
+
+class MalformedProductError(ValueError):
+    """A product payload that does not match the ProductPayload schema."""
+
+    def __init__(self, product_id, reason):
+        super().__init__(f"Malformed product {product_id}: {reason}")
+        self.product_id = product_id
+        self.reason = reason
+
+
+def decode_product(raw, product_id=None):
+    """Decode the JSON bytes of a product straight into a ProductPayload.
+
+    Args:
+        raw (bytes): The product JSON, e.g. from product_store.load_raw.
+        product_id (str, optional): The product ID, used in the error message. Defaults to None.
+
+    Returns:
+        ProductPayload: The typed product.
+
+    Raises:
+        MalformedProductError: If the payload is not valid JSON or misses required fields,
+            with the path of the offending field.
+    """
+    try:
+        return PRODUCT_DECODER.decode(raw)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        raise MalformedProductError(product_id, str(e)) from e
+
+
+def get_typed_product_prices(product):
+    """Return the regular and sale price like write_csv_from_jsons.get_product_prices."""
+    product_price_new = "NA" if product.price.now is UNSET else product.price.now
+    product_price_old = "NA" if product.price.was is UNSET else product.price.was
+
+    if product_price_old == "NA" and product_price_new != "NA":
+        return product_price_new, "NA"
+    elif product_price_old != "NA" and product_price_new != "NA":
+        return product_price_old, product_price_new
+    return "NA", "NA"
+
+
+def get_typed_categories(product):
+    categories = [taxonomy.name for taxonomy in product.taxonomies]
+    return categories + ["NA"] * (6 - len(categories))
+
+
+def get_typed_nutrition_data(meta):
+    """Return the dense nutrition columns like write_csv_from_jsons.get_nutrition_data."""
+    nutrition_values = ['NA'] * len(nutrition_labels)
+    if meta is None:
+        return nutrition_values
+    try:
+        positions = parse_dense_nutrient_rows((nutrient["name"], nutrient["value"])
+                                              for nutrient in meta.nutritions[0]["nutrients"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return nutrition_values
+    for index, value in positions:
+        nutrition_values[index] = value
+    return nutrition_values
+
+
+def get_typed_ingredients_and_allergens(meta):
+    """Return ingredients, allergens, may contain allergens and the non-food statement."""
+    if meta is None or meta.ingredients is None:
+        return "NA", "NA", "NA", "NA"
+    ingredients = meta.ingredients
+
+    ingredient_list = (None if ingredients.statement is UNSET else ingredients.statement) or "NA"
+    non_food_ingredient_list = (None if ingredients.nonfoodIngredientStatement is UNSET
+                                else ingredients.nonfoodIngredientStatement) or "NA"
+
+    if ingredients.allergens is UNSET or ingredients.allergens is None:
+        allergens_contains = allergens_may_contain = "NA"
+    else:
+        allergens_contains = ", ".join(ingredients.allergens.contains) or "NA"
+        allergens_may_contain = ", ".join(ingredients.allergens.mayContain) or "NA"
+
+    return (ingredient_list.replace("\n", " "), allergens_contains, allergens_may_contain,
+            non_food_ingredient_list.replace("\n", " "))
+
+
+def get_typed_image_urls(product):
+    image_urls = [image.url for image in product.images]
+    return image_urls + ["NA"] * (3 - len(image_urls))
+
+
+def build_typed_product_row(payload):
+    """Return the output row of a typed product, equal to write_csv_from_jsons.build_product_row.
+
+    Args:
+        payload (ProductPayload): The product, from decode_product.
+
+    Returns:
+        list: The values of the row, in the order of get_csv_header.
+    """
+    product = payload.card.products[0]
+    meta = payload.card.meta
+    price_regular, price_sale = get_typed_product_prices(product)
+    unit_size = "NA" if product.price.unitSize is UNSET else product.price.unitSize
+
+    return (
+        [product.id, product.title, price_regular, price_sale] +
+        get_typed_categories(product) +
+        [unit_size] +
+        get_typed_nutrition_data(meta) +
+        list(get_typed_ingredients_and_allergens(meta)) +
+        get_typed_image_urls(product)
+    )
+
+
+if __name__ == "__main__":
+    pass
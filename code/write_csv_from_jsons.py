@@ -1,12 +1,42 @@
 import os
-import json
+import io
 import csv
-import re
+import time
+from contextlib import nullcontext
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from nutrient_list import nutrition_labels
+from nutrient_parser import parse_dense_nutrients, get_long_nutrients
+from product_store import open_product_store, get_dataset_dir
 from datetime import datetime
 
 
+def get_product_id_and_name(ah_json_file):
+    """Extract the product ID and title from the product JSON data.
+
+    Args:
+        ah_json_file (dict): Parsed JSON data of the product.
+
+    Returns:
+        tuple: The product ID and the product name.
+    """
+    product = ah_json_file["card"]["products"][0]
+    return product["id"], product["title"]
+
+
+def get_unit_size(ah_json_file):
+    """Extract the unit size, e.g. "500 g", from the product JSON data.
+
+    Args:
+        ah_json_file (dict): Parsed JSON data of the product.
+
+    Returns:
+        tuple: A one-element tuple with the unit size, 'NA' if missing.
+    """
+    return (ah_json_file["card"]["products"][0]["price"].get("unitSize", "NA"),)
+
+
 def get_product_prices(ah_json_file):
     """Extract and return the regular and sale prices from the product JSON data.
 
@@ -43,51 +73,23 @@ def get_product_prices(ah_json_file):
 def get_nutrition_data(ah_json_file):
     """Extract nutrition data from the product JSON and return it as a list.
 
+    Only the nutrients the product actually has are parsed (see
+    nutrient_parser.parse_dense_nutrients); every other position stays 'NA'.
+
     Args:
         ah_json_file (dict): Parsed JSON data of the product.
 
     Returns:
         list: A list of nutrition values corresponding to the defined nutrition labels.
     """
-    global nutrition_labels
-
-    def extract_energy_values(nutrient_value):
-        """Extract energy values (kcal and kJ) from the nutrient value string.
-
-        Args:
-            nutrient_value (str): The nutrient value string containing energy information.
-
-        Returns:
-            tuple: A tuple containing kcal and kJ as integers.
-        """
-        pattern_kj_first = r"([\d.]+)\s*kJ\s*\(([\d.]+)\s*kcal\)"
-        pattern_kcal_first = r"([\d.]+)\s*kcal\s*\(([\d.]+)\s*kJ\)"
-
-        match_kj_first = re.search(pattern_kj_first, nutrient_value)
-        match_kcal_first = re.search(pattern_kcal_first, nutrient_value)
-        
-        if match_kj_first:
-            kj, kcal = match_kj_first.groups()
-        elif match_kcal_first:
-            kcal, kj = match_kcal_first.groups()
-    
-        return int(kcal), int(kj)
-
-    try:                
-        nutrition_rows = ah_json_file["card"]["meta"]["nutritions"][0]["nutrients"]
-        nutrition_dict = {label: 'NA' for label in nutrition_labels}
-
-        for nutrient in nutrition_rows:
-            if nutrient["name"] != "Energie":
-                if nutrient["name"] in nutrition_labels:
-                    nutrition_dict[nutrient["name"]] = nutrient["value"]
-            else:
-                nutrition_dict["Energie (kcal)"], nutrition_dict["Energie (kJ)"] = extract_energy_values(nutrient["value"])
-            
-    except:
-        nutrition_dict = {label: 'NA' for label in nutrition_labels}
+    nutrition_values = ['NA'] * len(nutrition_labels)
+    try:
+        for index, value in parse_dense_nutrients(ah_json_file):
+            nutrition_values[index] = value
+    except (KeyError, IndexError, TypeError, ValueError):
+        return ['NA'] * len(nutrition_labels)
 
-    return list(nutrition_dict.values())
+    return nutrition_values
 
 
 def get_categories(ah_json_file):
@@ -160,64 +162,211 @@ def get_image_urls(ah_json_file):
     return image_resolutions
 
 
-def get_csv_file_path():
+# The output columns in order, each group with the extractor returning its values
+COLUMN_GROUPS = [
+    (["ProductId", "ProductName"], get_product_id_and_name),
+    (["PriceRegular", "PriceSale"], get_product_prices),
+    (["Category1", "Category2", "Category3", "Category4", "Category5", "Category6"], get_categories),
+    (["ProductUnitSize"], get_unit_size),
+    (nutrition_labels, get_nutrition_data),
+    (["Ingredients", "ContainedAllergens", "MayContainAllergens", "NonFoodIngredients"], get_ingredients_and_allergens),
+    (["ImageLowURL", "ImageMediumURL", "ImageHighURL"], get_image_urls),
+]
+
+# Column name -> (extractor, position in the extractor's values)
+COLUMN_REGISTRY = {column: (extractor, position)
+                   for columns, extractor in COLUMN_GROUPS
+                   for position, column in enumerate(columns)}
+
+
+def select_columns(columns=None):
+    """Validate a subset of the output columns.
+
+    Args:
+        columns (list, optional): Column names in the wanted order, None for all columns.
+
+    Returns:
+        list: The column names.
+
+    Raises:
+        ValueError: If a column is not in COLUMN_REGISTRY.
+    """
+    if columns is None:
+        return list(COLUMN_REGISTRY)
+    unknown = [column for column in columns if column not in COLUMN_REGISTRY]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return list(columns)
+
+
+@lru_cache(maxsize=None)
+def get_extraction_plan(columns=None):
+    """Return which extractors to run for a tuple of columns, and where their values go.
+
+    Args:
+        columns (tuple, optional): Column names, None for all columns.
+
+    Returns:
+        tuple: The row width and a list of (extractor, start, picks), one per extractor that
+            at least one of the columns needs. picks is None if all values of the extractor go
+            to the row in order from index start, otherwise a list of (row index, position in
+            the extractor's values).
+    """
+    columns = select_columns(columns)
+    picks = {}
+    for index, column in enumerate(columns):
+        extractor, position = COLUMN_REGISTRY[column]
+        picks.setdefault(extractor, []).append((index, position))
+
+    steps = []
+    for group_columns, extractor in COLUMN_GROUPS:
+        if extractor not in picks:
+            continue
+        start = picks[extractor][0][0]
+        in_order = picks[extractor] == [(start + position, position) for position in range(len(group_columns))]
+        steps.append((extractor, start, None if in_order else picks[extractor]))
+    return len(columns), steps
+
+
+def get_csv_file_path(date=None):
     """
     Construct the file path for the CSV output based on the current date.
 
     The path will be stored in the "complete_datasets" directory, and the filename will 
     be formatted as "<today's date>.csv".
 
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+
     Returns:
         str: The full file path of the CSV file.
     """
-    today_date = datetime.now().strftime('%Y-%m-%d')
-    working_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(working_dir)
-    return os.path.join(project_root, "complete_datasets", f"{today_date}.csv")
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    return os.path.join(get_dataset_dir(), f"{date}.csv")
 
 
-def get_json_files():
+def get_nutrient_csv_file_path(date=None):
     """
-    Retrieve and sort JSON files from the directory based on the current date.
+    Construct the file path of the long-format nutrient CSV, complete_datasets/<date>_nutrients.csv.
 
-    The files are assumed to be stored in a subdirectory named after the current date within
-    the "json_collections" directory. The JSON files will be sorted by their numeric filename.
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+
+    Returns:
+        str: The full file path of the CSV file.
+    """
+    csv_file_path = get_csv_file_path(date)
+    return csv_file_path[:-len(".csv")] + "_nutrients.csv"
+
+
+def get_json_files(date=None, json_dir=None):
+    """
+    Retrieve and sort the JSON files of a dated product directory.
+
+    The files are assumed to be stored in a subdirectory named after the date within
+    the "json_collections" directory of the project root, so the result does not depend
+    on the working directory. The JSON files will be sorted by their numeric filename.
+
+    Args:
+        date (str, optional): The date as yyyy-mm-dd. Defaults to today.
+        json_dir (str, optional): The directory to list instead. Defaults to None.
 
     Returns:
         list: A sorted list of JSON filenames in the directory.
     """
-    today_date = datetime.now().strftime('%Y-%m-%d')
-    working_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(working_dir)
-    jsons_path = os.path.join(project_root, "json_collections", f"product_jsons_{today_date}")
+    if json_dir is None:
+        json_dir = open_product_store("json", date).json_dir
 
-    json_files = os.listdir(jsons_path)
+    json_files = [file for file in os.listdir(json_dir) if file.endswith(".json")]
     return sorted(json_files, key=lambda x: int(x.split('.')[0]))
 
 
-def write_csv_header(writer):
+def get_csv_header(columns=None):
+    """
+    Return the names of the output columns.
+
+    The header includes product attributes such as product ID, name, price, categories,
+    nutritional information, ingredients, allergens, and image URLs, in the same order
+    as the values returned by build_product_row. It is generated from COLUMN_REGISTRY.
+
+    Args:
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
+
+    Returns:
+        list: The column names.
+    """
+    return select_columns(columns)
+
+
+def write_csv_header(writer, columns=None):
     """
     Write the header row to the CSV file.
 
-    This function writes a fixed header that includes product attributes such as 
-    product ID, name, price, categories, nutritional information, ingredients, allergens, 
-    and image URLs.
+    The header includes product attributes such as product ID, name, price, categories,
+    nutritional information, ingredients, allergens, and image URLs, or only the
+    requested columns.
 
     Args:
         writer (csv.writer): The CSV writer object used to write rows to the CSV file.
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
     """
-    header = (
-        ["ProductId", "ProductName", "PriceRegular", "PriceSale"] +
-        ["Category1", "Category2", "Category3", "Category4", "Category5", "Category6"] +
-        ["ProductUnitSize"] +
-        nutrition_labels +
-        ["Ingredients", "ContainedAllergens", "MayContainAllergens", "NonFoodIngredients"] +
-        ["ImageLowURL", "ImageMediumURL", "ImageHighURL"]
-    )
-    writer.writerow(header)
+    writer.writerow(get_csv_header(columns))
 
 
-def write_product_data(writer, json_data):
+def run_extractor(extractor, json_data, extractor_times=None):
+    """
+    Call an extractor on a product, adding its run time to extractor_times if given.
+
+    Args:
+        extractor (function): The extractor, e.g. get_nutrition_data.
+        json_data (dict): The JSON object containing product data.
+        extractor_times (dict, optional): {extractor name: [seconds, calls]} totals. Defaults to None.
+
+    Returns:
+        The result of the extractor.
+    """
+    if extractor_times is None:
+        return extractor(json_data)
+    started = time.perf_counter()
+    try:
+        return extractor(json_data)
+    finally:
+        totals = extractor_times.setdefault(extractor.__name__, [0.0, 0])
+        totals[0] += time.perf_counter() - started
+        totals[1] += 1
+
+
+def build_product_row(json_data, extractor_times=None, columns=None):
+    """
+    Extract product data from a JSON object as one output row.
+
+    The product data includes information such as product ID, name, prices, categories,
+    unit size, nutritional information, ingredients, allergens, and image URLs. Missing
+    values are "NA", as in the CSV. With a subset of columns only the extractors those
+    columns need are run, so e.g. a price-only row skips the nutrient and ingredient parsing.
+
+    Args:
+        json_data (dict): The JSON object containing product data.
+        extractor_times (dict, optional): {extractor name: [seconds, calls]} totals the run
+            time of every extractor is added to. Defaults to None.
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
+
+    Returns:
+        list: The values of the row, in the order of get_csv_header(columns).
+    """
+    width, steps = get_extraction_plan(None if columns is None else tuple(columns))
+    row = [None] * width
+    for extractor, start, picks in steps:
+        values = run_extractor(extractor, json_data, extractor_times)
+        if picks is None:
+            row[start:start + len(values)] = values
+        else:
+            for index, position in picks:
+                row[index] = values[position]
+    return row
+
+
+def write_product_data(writer, json_data, extractor_times=None, columns=None):
     """
     Extract product data from a JSON object and write it to the CSV file.
 
@@ -227,51 +376,255 @@ def write_product_data(writer, json_data):
     Args:
         writer (csv.writer): The CSV writer object used to write rows to the CSV file.
         json_data (dict): The JSON object containing product data.
+        extractor_times (dict, optional): {extractor name: [seconds, calls]} totals, see
+            build_product_row. Defaults to None.
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
+    """
+    writer.writerow(build_product_row(json_data, extractor_times, columns))
+
+
+def load_product(product_store, product_id, extractor_times=None):
+    """Load a product from the store, timed as the "load" step if extractor_times is given."""
+    if extractor_times is None:
+        return product_store.load(product_id)
+    started = time.perf_counter()
+    try:
+        return product_store.load(product_id)
+    finally:
+        totals = extractor_times.setdefault("load", [0.0, 0])
+        totals[0] += time.perf_counter() - started
+        totals[1] += 1
+
+
+def write_product_chunk(product_store, product_ids, columns=None):
     """
-    product_id = json_data["card"]["products"][0]["id"]
-    product_name = json_data["card"]["products"][0]["title"]
-    product_price_regular, product_price_sale = get_product_prices(json_data)
-    product_categories = get_categories(json_data)
-    product_unit_size = json_data["card"]["products"][0]["price"].get("unitSize", "NA")
-    product_nutrition = get_nutrition_data(json_data)
-    product_ingredients, product_contained_allergens, product_may_contain_allergens, product_non_food_ingredients = get_ingredients_and_allergens(json_data)
-    product_img_url_200px, product_img_url_400px, product_img_url_800px = get_image_urls(json_data)
+    Build the CSV rows of a chunk of products.
 
-    writer.writerow(
-        [product_id, product_name, product_price_regular, product_price_sale] +
-        product_categories +
-        [product_unit_size] +
-        product_nutrition +
-        [product_ingredients, product_contained_allergens, product_may_contain_allergens, product_non_food_ingredients,
-         product_img_url_200px, product_img_url_400px, product_img_url_800px]
-    )
+    This is the unit of work of the parallel conversion. It runs in a worker process
+    and returns the rows already formatted by csv.writer, so the parent process only
+    has to write them out in order.
 
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay): The store to read the products from.
+        product_ids (list): The product IDs of the chunk.
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
+
+    Returns:
+        str: The CSV text of the rows of the chunk.
+    """
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    for product_id in product_ids:
+        write_product_data(writer, product_store.load(product_id), columns=columns)
+    return buffer.getvalue()
 
-def write_csv_from_json_dir():
+
+def write_timed_product_chunk(product_store, product_ids, columns=None):
+    """
+    Build the CSV rows of a chunk of products, timing the loading and every extractor.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay): The store to read the products from.
+        product_ids (list): The product IDs of the chunk.
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
+
+    Returns:
+        tuple: The CSV text of the rows and the {name: [seconds, calls]} totals of the chunk.
+    """
+    extractor_times = {}
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    for product_id in product_ids:
+        write_product_data(writer, load_product(product_store, product_id, extractor_times), extractor_times,
+                           columns)
+    return buffer.getvalue(), extractor_times
+
+
+def write_typed_product_chunk(product_store, product_ids, columns=None):
+    """
+    Build the CSV rows of a chunk of products with the typed msgspec decoder.
+
+    The raw JSON of each product is decoded straight into the typed_products
+    structs, skipping every field no column uses. Products that do not match the
+    schema are returned with the reason and converted with the dict extractors, so
+    the rows are the same as with the json decoder.
+    The typed row is cheap to build in full, a subset of columns is picked from it.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay): The store to read the products from.
+        product_ids (list): The product IDs of the chunk.
+        columns (list, optional): A subset of the columns, see select_columns. Defaults to all.
+
+    Returns:
+        tuple: The CSV text of the rows, a list of (product_id, reason) of the malformed
+            products and the {name: [seconds, calls]} totals of loading, decoding and extracting.
+    """
+    from typed_products import decode_product, build_typed_product_row, MalformedProductError
+
+    all_columns = get_csv_header()
+    indexes = None if columns is None else [all_columns.index(column) for column in select_columns(columns)]
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    malformed = []
+    load_seconds = decode_seconds = extract_seconds = 0.0
+    for product_id in product_ids:
+        started = time.perf_counter()
+        raw = product_store.load_raw(product_id)
+        loaded = time.perf_counter()
+        try:
+            payload = decode_product(raw, product_id)
+        except MalformedProductError as e:
+            # The dict extractors write what they can, so both decoders write the same rows
+            malformed.append((product_id, e.reason))
+            writer.writerow(build_product_row(product_store.load(product_id), columns=columns))
+            continue
+        decoded = time.perf_counter()
+        row = build_typed_product_row(payload)
+        writer.writerow(row if indexes is None else [row[index] for index in indexes])
+        load_seconds += loaded - started
+        decode_seconds += decoded - loaded
+        extract_seconds += time.perf_counter() - decoded
+
+    count = len(product_ids) - len(malformed)
+    extractor_times = {"load": [load_seconds, count], "typed_decode": [decode_seconds, count],
+                       "typed_extract": [extract_seconds, count]}
+    return buffer.getvalue(), malformed, extractor_times
+
+
+def write_csv_from_json_dir(product_store=None, workers=1, chunk_size=500, metrics=None, decoder="json",
+                            columns=None, csv_file_path=None):
     """
     Write product data from JSON files into a CSV file.
 
-    The function reads product information from multiple JSON files in a specific directory,
-    processes each file to extract relevant product data, and writes it into a CSV file.
-    The CSV file is named based on the current date and saved in the "complete_datasets" directory.
+    The function reads product information from a product store (by default today's
+    directory of JSON files), processes each product to extract relevant product data,
+    and writes it into a CSV file sorted by product ID. The CSV file is named after the
+    store's date and saved in the "complete_datasets" directory.
+
+    With more than one worker, chunks of products are converted in a process pool and
+    written in the same sorted order, so the output is identical to the serial path.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay, optional): The store to read the
+            products from. Defaults to today's JSON directory.
+        workers (int, optional): Number of worker processes. Defaults to 1 (no pool).
+        chunk_size (int, optional): Number of products per worker task. Defaults to 500.
+        metrics (RunMetrics, optional): Receives the time spent loading products and in each
+            extractor, and the malformed products. Defaults to None.
+        decoder (str, optional): "json" to extract the columns from json.load dicts or "typed"
+            to decode into msgspec structs (typed_products), which is several times faster and
+            also reports the products that do not match the schema. Both write the same rows.
+            Defaults to "json".
+        columns (list, optional): Only write these columns, running only the extractors they
+            need (see build_product_row). Defaults to all columns.
+        csv_file_path (str, optional): The output file. Defaults to complete_datasets/<date>.csv,
+            or complete_datasets/<date>_columns.csv for a subset of the columns.
     """
-    csv_file_path = get_csv_file_path()
+    if product_store is None:
+        product_store = open_product_store("json")
+    columns = None if columns is None else select_columns(columns)
+    if csv_file_path is None:
+        csv_file_path = get_csv_file_path(product_store.date)
+        if columns is not None:
+            csv_file_path = csv_file_path[:-len(".csv")] + "_columns.csv"
+    product_ids = product_store.product_ids()
+    extractor_times = {} if metrics is not None else None
     
     with open(csv_file_path, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
-        write_csv_header(writer)
+        write_csv_header(writer, columns)
+
+        if decoder == "typed":
+            chunks = [product_ids[i:i + chunk_size] for i in range(0, len(product_ids), chunk_size)]
+            malformed_count = 0
+            with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+                if executor is None:
+                    results = (write_typed_product_chunk(product_store, chunk, columns) for chunk in chunks)
+                else:
+                    results = executor.map(write_typed_product_chunk, [product_store] * len(chunks), chunks,
+                                           [columns] * len(chunks))
+                for chunk_rows, malformed, chunk_times in tqdm(results, total=len(chunks)):
+                    csvfile.write(chunk_rows)
+                    for product_id, reason in malformed:
+                        print(f"Malformed product {product_id}: {reason}")
+                        if metrics is not None:
+                            metrics.observe_malformed(product_id, reason)
+                    malformed_count += len(malformed)
+                    if metrics is not None:
+                        metrics.merge_extractor_times(chunk_times)
+            if malformed_count:
+                print(f"{malformed_count} malformed products were converted with the json decoder.")
+            return
+        elif decoder != "json":
+            raise ValueError(f"Unknown decoder: {decoder}")
+
+        if workers <= 1:
+            for product_id in tqdm(product_ids):
+                json_data = load_product(product_store, product_id, extractor_times)
+                write_product_data(writer, json_data, extractor_times, columns)
+        else:
+            chunks = [product_ids[i:i + chunk_size] for i in range(0, len(product_ids), chunk_size)]
+            chunk_writer = write_product_chunk if metrics is None else write_timed_product_chunk
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # map() yields results in submission order, which keeps the rows sorted by ID
+                rows = executor.map(chunk_writer, [product_store] * len(chunks), chunks, [columns] * len(chunks))
+                for chunk_rows in tqdm(rows, total=len(chunks)):
+                    if metrics is not None:
+                        chunk_rows, chunk_times = chunk_rows
+                        metrics.merge_extractor_times(chunk_times)
+                    csvfile.write(chunk_rows)
+
+    if metrics is not None and workers <= 1:
+        metrics.merge_extractor_times(extractor_times)
+
+
+def write_nutrient_csv_from_json_dir(product_store=None):
+    """
+    Write the nutrients of all products into a sparse, long-format CSV file.
 
-        json_files = get_json_files()
-        for file in tqdm(json_files):
-            file_path = os.path.join("json_collections", f"product_jsons_{datetime.now().strftime('%Y-%m-%d')}", file)
-            
-            with open(file_path, 'r') as f:
-                json_data = json.load(f) 
-                write_product_data(writer, json_data)
+    Every row is one nutrient of one product (ProductId, Nutrient, Value, Unit, Qualifier), so
+    the size of the file and the time to write it depend on the number of nutrients
+    the products have, not on the length of nutrition_labels.
+
+    Args:
+        product_store (JsonDirectoryStore or SnapshotDay, optional): The store to read the
+            products from. Defaults to today's JSON directory.
+    """
+    if product_store is None:
+        product_store = open_product_store("json")
+
+    with open(get_nutrient_csv_file_path(product_store.date), 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["ProductId", "Nutrient", "Value", "Unit", "Qualifier"])
+        for product_id in tqdm(product_store.product_ids()):
+            writer.writerows(get_long_nutrients(product_store.load(product_id)))
 
 
 if __name__ == "__main__":
-    write_csv_from_json_dir()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write today's product JSONs into a CSV file.")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--nutrients", action="store_true", help="also write the long-format nutrient CSV")
+    parser.add_argument("--decoder", choices=["json", "typed"], default="json",
+                        help="typed decodes with msgspec, faster and reports malformed products (default: json)")
+    parser.add_argument("--columns", type=lambda text: text.split(","),
+                        help="comma-separated subset of the columns, e.g. ProductId,PriceRegular,PriceSale, "
+                             "written to complete_datasets/<date>_columns.csv")
+    parser.add_argument("--report", action="store_true",
+                        help="append stage and extractor timings to run_reports/<date>.jsonl")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="profile the conversion")
+    args = parser.parse_args()
+
+    from run_metrics import RunMetrics, get_run_report_path
+    metrics = RunMetrics(get_run_report_path() if args.report else None, args.profile)
+    with metrics.stage("convert"):
+        write_csv_from_json_dir(workers=args.workers, metrics=metrics, decoder=args.decoder, columns=args.columns)
+    if args.nutrients:
+        with metrics.stage("nutrients"):
+            write_nutrient_csv_from_json_dir()
+    print(metrics.summary()["extractor_seconds"])
+    metrics.close()
 
     # file_to_check = r"C:\Users\idris\Desktop\ah_price_project\json_collections\product_jsons_2024-10-19\582336.json"
     # with open(file_to_check, 'r') as f: